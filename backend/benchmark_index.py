@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+"""
+Script to benchmark FAISS index configurations on the course dataset.
+
+For each configuration it reports build time, recall@k against exact (flat)
+search and p50/p99 single-query latency, so FAISS_INDEX_TYPE and its
+parameters can be chosen from measurements.
+
+Usage: python benchmark_index.py [--queries 500] [--k 20]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import django
+from pathlib import Path
+
+# Add the project directory to Python path
+project_dir = Path(__file__).resolve().parent
+sys.path.append(str(project_dir))
+
+# Setup Django
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'university_recommender.settings')
+django.setup()
+
+import numpy as np
+from recommendations.langchain_service_fast import UniversityRecommendationService
+from recommendations.index_types import build_index, reconstruct_rows
+
+# (label, build config, search-time settings to sweep)
+CONFIGURATIONS = [
+    ('flat', {'type': 'flat'}, [{}]),
+    ('ivf', {'type': 'ivf', 'nlist': 0, 'nprobe': 1}, [{'nprobe': n} for n in (1, 4, 16, 64)]),
+    ('hnsw', {'type': 'hnsw', 'hnsw_m': 32, 'ef_construction': 80, 'ef_search': 16},
+     [{'ef_search': ef} for ef in (16, 32, 64, 128)]),
+    ('ivfpq', {'type': 'ivfpq', 'nlist': 0, 'nprobe': 1, 'pq_m': 16, 'pq_nbits': 8},
+     [{'nprobe': n} for n in (4, 16, 64)]),
+]
+
+
+def sample_queries(service, count):
+    """Query vectors for random but realistic preference sets drawn from the catalog"""
+    catalog = service.catalog
+    random.seed(0)
+    vectors = []
+    for _ in range(count):
+        row = catalog.row(random.randrange(len(catalog)))
+        preferences = {
+            'desired_program': row['parent_course'],
+            'program_level': row['program_type'],
+            'preferred_countries': [row['country']] if row['country'] else [],
+        }
+        query = service._create_query_from_preferences(preferences)
+        vectors.append(service._query_vector(preferences, query)[0])
+    return np.vstack(vectors).astype(np.float32)
+
+
+def set_search_settings(index, search):
+    if 'nprobe' in search:
+        index.nprobe = search['nprobe']
+    if 'ef_search' in search:
+        index.hnsw.efSearch = search['ef_search']
+
+
+def benchmark(queries_count, k):
+    print("🚀 Loading recommendation service...")
+    service = UniversityRecommendationService()
+    index = service.vector_store.index
+    vectors = reconstruct_rows(index, np.arange(index.ntotal))
+    queries = sample_queries(service, queries_count)
+    print(f"📊 {len(vectors)} vectors of dimension {vectors.shape[1]}, {len(queries)} queries, k={k}")
+
+    exact = build_index(vectors, {'type': 'flat'})
+    _, truth = exact.search(queries, k)
+
+    print(f"\n{'config':<28} {'build s':>8} {'recall@k':>9} {'p50 ms':>8} {'p99 ms':>8}")
+    for label, build_config, sweeps in CONFIGURATIONS:
+        config = dict(build_config)
+        build_start = time.time()
+        index = build_index(vectors, config)
+        build_duration = time.time() - build_start
+        if config['type'] != build_config['type']:
+            print(f"{label:<28} skipped: dataset too small, fell back to {config['type']}")
+            continue
+
+        for search in sweeps:
+            set_search_settings(index, search)
+            _, found = index.search(queries, k)
+            recall = np.mean([
+                len(set(found[i][found[i] >= 0]) & set(truth[i])) / len(truth[i])
+                for i in range(len(queries))
+            ])
+
+            latencies = []
+            for query in queries:
+                query_start = time.perf_counter()
+                index.search(query.reshape(1, -1), k)
+                latencies.append((time.perf_counter() - query_start) * 1000)
+
+            name = label + ''.join(f" {key}={value}" for key, value in search.items())
+            print(f"{name:<28} {build_duration:8.2f} {recall:9.3f} "
+                  f"{np.percentile(latencies, 50):8.3f} {np.percentile(latencies, 99):8.3f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark FAISS index configurations")
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--k', type=int, default=20)
+    args = parser.parse_args()
+    benchmark(args.queries, args.k)
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+"""
+Script to measure how closely composed label vectors follow live query embeddings.
+
+Structured preference sets are answered from precomputed label embeddings
+(LABEL_EMBEDDINGS_ENABLED). For random preference sets drawn from the catalog
+it searches the index once with the composed vector and once with the live
+embedding of the same query text, and reports the overlap of the two top-k
+row sets plus the time each vector takes to produce. Run it with the
+embedding backend that serves production to decide whether composition is
+close enough.
+
+Usage: python benchmark_label_embeddings.py [--queries 200] [--k 20]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import django
+from pathlib import Path
+
+# Add the project directory to Python path
+project_dir = Path(__file__).resolve().parent
+sys.path.append(str(project_dir))
+
+# Setup Django
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'university_recommender.settings')
+django.setup()
+
+import numpy as np
+from recommendations.langchain_service_fast import UniversityRecommendationService
+
+
+def sample_preferences(service, count):
+    """Random structured preference sets (no free text) drawn from catalog rows"""
+    catalog = service.catalog
+    random.seed(0)
+    preference_sets = []
+    for i in range(count):
+        row = catalog.row(random.randrange(len(catalog)))
+        other = catalog.row(random.randrange(len(catalog)))
+        preferences = {'desired_program': row['parent_course']}
+        if i % 2:
+            preferences['program_level'] = row['program_type']
+        countries = {row['country'], other['country']} - {None}
+        if countries:
+            preferences['preferred_countries'] = sorted(countries)
+        if i % 3 == 0 and row['university_type']:
+            preferences['university_types'] = [row['university_type']]
+        preference_sets.append(preferences)
+    return preference_sets
+
+
+def benchmark(queries_count, k):
+    print("🚀 Loading recommendation service...")
+    service = UniversityRecommendationService()
+    if service.label_embeddings is None:
+        print("⚠️  No label embeddings - set LABEL_EMBEDDINGS_ENABLED=True and rebuild the cache")
+        sys.exit(1)
+    index = service.vector_store.index
+
+    overlaps, compose_times, live_times = [], [], []
+    skipped = 0
+    for preferences in sample_preferences(service, queries_count):
+        query = service._create_query_from_preferences(preferences)
+        start = time.perf_counter()
+        composed = service.label_embeddings.compose(preferences)
+        compose_times.append(time.perf_counter() - start)
+        if composed is None:
+            skipped += 1
+            continue
+        # Straight to the model: a cached live vector would make the timing meaningless
+        start = time.perf_counter()
+        live = np.asarray(service.embeddings.embeddings.embed_query(query), dtype=np.float32)
+        live_times.append(time.perf_counter() - start)
+
+        _, composed_rows = index.search(composed.reshape(1, -1), k)
+        _, live_rows = index.search(live.reshape(1, -1), k)
+        overlaps.append(len(set(composed_rows[0]) & set(live_rows[0])) / k)
+
+    overlaps = np.array(overlaps)
+    print(f"📊 {len(overlaps)} preference sets compared ({skipped} could not be composed), k={k}")
+    print(f"   top-{k} overlap: mean {overlaps.mean():.1%}, p10 {np.percentile(overlaps, 10):.1%}, "
+          f"min {overlaps.min():.1%}")
+    print(f"   composed vector: {np.median(compose_times) * 1000:.3f} ms median")
+    print(f"   live embedding:  {np.median(live_times) * 1000:.3f} ms median")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare composed label vectors with live query embeddings")
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=20)
+    args = parser.parse_args()
+    benchmark(args.queries, args.k)
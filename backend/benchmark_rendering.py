@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+"""
+Script to benchmark the document-text rendering stage on its own.
+
+The catalog is built from the dataset (repeated until it has --rows courses,
+so large catalogs can be simulated), then every document text is rendered
+without embedding anything. Reports rows/sec for the whole catalog and for
+index-build sized batches, plus the time of the missing-field report.
+
+Usage: python benchmark_rendering.py [--rows 100000] [--repeat 3]
+"""
+import argparse
+import itertools
+import os
+import sys
+import time
+import django
+from pathlib import Path
+
+# Add the project directory to Python path
+project_dir = Path(__file__).resolve().parent
+sys.path.append(str(project_dir))
+
+# Setup Django
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'university_recommender.settings')
+django.setup()
+
+from django.conf import settings
+from recommendations.catalog import CourseCatalog
+from recommendations.documents import DocumentTexts, iter_records, missing_field_report
+
+
+def best_of(repeat, function):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def benchmark(rows, repeat):
+    records = iter_records(settings.UNIVERSITY_DATASET_PATH)
+    if rows:
+        records = itertools.islice(itertools.cycle(list(records)), rows)
+    catalog = CourseCatalog.from_records(records)
+    texts = DocumentTexts(catalog)
+    batch_size = settings.INDEX_BUILD_BATCH_SIZE
+    print(f"📊 {len(catalog)} courses, best of {repeat} runs")
+
+    duration, rendered = best_of(repeat, lambda: list(texts))
+    print(f"  full catalog          {duration:8.3f}s  {len(rendered) / duration:12,.0f} rows/sec")
+    average = sum(len(text) for text in rendered) / len(rendered)
+    del rendered
+
+    duration, _ = best_of(repeat, lambda: [texts[start:start + batch_size] for start in range(0, len(texts), batch_size)])
+    print(f"  batches of {batch_size:<10} {duration:8.3f}s  {len(texts) / duration:12,.0f} rows/sec")
+
+    duration, report = best_of(repeat, lambda: missing_field_report(catalog))
+    print(f"  missing-field report  {duration:8.3f}s  ({len(report)} fields with gaps)")
+    print(f"  average text length   {average:.0f} characters")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark document-text rendering")
+    parser.add_argument('--rows', type=int, default=0, help="repeat the dataset up to this many courses")
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    benchmark(args.rows, args.repeat)
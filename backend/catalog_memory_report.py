@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+"""
+Script to compare the memory footprint of the columnar course catalog against
+the previous list-of-dicts + per-Document metadata layout
+"""
+import json
+import os
+import sys
+import django
+from pathlib import Path
+
+# Add the project directory to Python path
+project_dir = Path(__file__).resolve().parent
+sys.path.append(str(project_dir))
+
+# Setup Django
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'university_recommender.settings')
+django.setup()
+
+from django.conf import settings
+from recommendations.catalog import CATALOG_FIELDS, CourseCatalog
+
+
+def deep_getsizeof(obj, seen=None):
+    """Recursive sys.getsizeof that counts every shared object once"""
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_getsizeof(k, seen) + deep_getsizeof(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_getsizeof(item, seen) for item in obj)
+    return size
+
+
+def format_mb(size):
+    return f"{size / (1024 * 1024):8.2f} MB"
+
+
+def memory_report():
+    """Print the memory used by both layouts for the configured dataset"""
+    print(f"📊 Loading dataset from {settings.UNIVERSITY_DATASET_PATH}...")
+    with open(settings.UNIVERSITY_DATASET_PATH, 'r') as f:
+        university_data = json.load(f)
+
+    # Previous layout: the raw records plus one metadata dict per Document
+    metadatas = [
+        {key: item.get(field) for key, field in CATALOG_FIELDS}
+        for item in university_data
+    ]
+    seen = set()
+    records_size = deep_getsizeof(university_data, seen)
+    metadata_size = deep_getsizeof(metadatas, seen)
+    legacy_size = records_size + metadata_size
+
+    catalog = CourseCatalog.from_records(university_data)
+    column_sizes = catalog.memory_usage()
+    catalog_size = sum(column_sizes.values())
+
+    print(f"\nRows: {len(catalog)}")
+    print("\nPrevious layout")
+    print(f"  university_data (list of dicts): {format_mb(records_size)}")
+    print(f"  Document metadata dicts:         {format_mb(metadata_size)}")
+    print(f"  Total:                           {format_mb(legacy_size)}")
+
+    print("\nColumnar catalog")
+    for key, size in sorted(column_sizes.items(), key=lambda x: -x[1]):
+        column = catalog.column(key)
+        categories = f"{len(column.categories)} categories" if column.is_string else ''
+        print(f"  {key:<24} {column.kind:<6} {format_mb(size)}  {categories}")
+    print(f"  Total:                           {format_mb(catalog_size)}")
+
+    if catalog_size:
+        print(f"\n✅ Catalog uses {legacy_size / catalog_size:.1f}x less memory than the previous layout")
+
+
+if __name__ == '__main__':
+    memory_report()
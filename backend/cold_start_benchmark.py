@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+"""
+Script to measure cold start time of the recommendation service.
+
+Each run starts a fresh Python process, sets up Django and constructs
+UniversityRecommendationService from the existing vector_store_cache, so the
+numbers include imports and everything __init__ does before the first request.
+Build the cache first (python create_cache.py).
+
+Usage: python cold_start_benchmark.py [--runs 5]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+project_dir = Path(__file__).resolve().parent
+
+# Runs in the child process; prints the timings as JSON on the last line
+CHILD = """
+import json, os, sys, time
+start = time.perf_counter()
+sys.path.append({project_dir!r})
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'university_recommender.settings')
+import django
+django.setup()
+from recommendations.langchain_service_fast import UniversityRecommendationService
+imported = time.perf_counter()
+service = UniversityRecommendationService()
+ready = time.perf_counter()
+print(json.dumps({{'imports': imported - start, 'init': ready - imported, 'total': ready - start,
+                   'rows': len(service.catalog)}}))
+"""
+
+
+def measure(runs):
+    code = CHILD.format(project_dir=str(project_dir))
+    results = []
+    for run in range(runs):
+        output = subprocess.run(
+            [sys.executable, '-c', code], cwd=project_dir, capture_output=True, text=True, check=True
+        ).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+        print(f"  run {run + 1}: __init__ {results[-1]['init'] * 1000:.0f} ms, "
+              f"total {results[-1]['total'] * 1000:.0f} ms")
+
+    print(f"\n📊 {results[0]['rows']} courses, {runs} runs")
+    for key in ('imports', 'init', 'total'):
+        values = [result[key] * 1000 for result in results]
+        print(f"  {key:<8} median {statistics.median(values):8.1f} ms   min {min(values):8.1f} ms")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Measure recommendation service cold start time")
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+    if not os.path.exists(project_dir / 'vector_store_cache'):
+        print("⚠️  No vector_store_cache found - run python create_cache.py first")
+        sys.exit(1)
+    measure(args.runs)
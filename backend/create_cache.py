@@ -15,13 +15,13 @@ sys.path.append(str(project_dir))
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'university_recommender.settings')
 django.setup()
 
-from recommendations.langchain_service import UniversityRecommendationService
+from recommendations.langchain_service_fast import UniversityRecommendationService
 import time
 
 def create_cache():
     """Create the vector store cache for faster loading"""
     print("🚀 Creating vector store cache for faster startup...")
-    print("This may take 5-10 minutes on first run...")
+    print("This may take 5-10 minutes on first run; rerun to resume an interrupted build...")
     
     start_time = time.time()
     
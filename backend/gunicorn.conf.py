@@ -0,0 +1,32 @@
+"""
+gunicorn configuration for production serving.
+
+The application (and with it the FAISS index, catalog and lookup structures
+of the recommendation service) is loaded once in the parent process before
+the workers are forked, so every worker starts ready and shares that memory
+copy-on-write instead of loading its own copy.
+
+Usage: gunicorn -c gunicorn.conf.py university_recommender.wsgi:application
+"""
+import gc
+import os
+
+# Load the service while the application is imported (see wsgi.py), not in a background thread
+os.environ.setdefault('RECOMMENDATION_PRELOAD', 'True')
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.getenv('GUNICORN_WORKERS', str(min(4, 2 * (os.cpu_count() or 1) + 1))))
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', '4'))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
+preload_app = True
+accesslog = '-'
+
+
+def when_ready(server):
+    """Runs in the parent after the application is loaded, before the first worker is forked"""
+    # Move everything allocated so far out of the collector's reach: collections in the workers would
+    # otherwise write to the headers of every loaded object and copy the pages they live on
+    gc.collect()
+    gc.freeze()
+    server.log.info(f"Froze {gc.get_freeze_count()} loaded objects before forking workers")
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+"""
+Script to measure pre-fork serving: startup time and per-worker memory.
+
+For each worker count it starts a fresh parent process and forks the workers
+the way gunicorn does, either after loading the recommendation service in the
+parent (preload, as gunicorn.conf.py serves) or with every worker loading its
+own (per-worker). Each worker then answers --requests recommendation
+requests and reports the memory it has written and shares with no other
+process: its own allocations plus every shared page it copied. Startup is
+the time until every worker is ready to serve. Total PSS adds up the memory
+of the parent and all workers, each shared page counted once. Build the
+cache first (python create_cache.py).
+
+Usage: python prefork_benchmark.py [--workers 1 2 4 8] [--requests 50] [--mode both]
+"""
+import argparse
+import gc
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+project_dir = Path(__file__).resolve().parent
+
+MODES = ('preload', 'per-worker')
+
+
+def memory():
+    """Resident memory of this process: bytes it has written and shares with no other process
+    (its own allocations and the shared pages it copied), and its proportional share of everything"""
+    fields = {}
+    with open('/proc/self/smaps_rollup', 'r') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1]) * 1024
+    return {'private_dirty': fields['Private_Dirty'], 'pss': fields['Pss']}
+
+
+def preference_sets(service, count):
+    programs = service.facets.values('programs')
+    countries = service.facets.values('countries')
+    return [
+        {'desired_program': programs[i % len(programs)], 'preferred_countries': [countries[i % len(countries)]],
+         'max_tuition_usd': 10000 + 5000 * (i % 6)}
+        for i in range(count)
+    ]
+
+
+def serve(start, service, requests):
+    """Worker body: report readiness, answer the requests, report memory"""
+    ready = time.perf_counter() - start
+    for preferences in preference_sets(service, requests):
+        service.get_recommendations(preferences)
+    # A long-running worker eventually runs full collections, which touch every object they track
+    gc.collect()
+    return dict(memory(), ready=ready)
+
+
+def run(mode, workers, requests):
+    """One parent process: load (preload) or not, fork the workers and collect their reports"""
+    start = time.perf_counter()
+    sys.path.append(str(project_dir))
+    # Every request must be computed, not served by another worker's cached result
+    os.environ['RECOMMENDATION_CACHE_ENABLED'] = 'False'
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'university_recommender.settings')
+    import django
+    django.setup()
+    from recommendations.langchain_service_fast import UniversityRecommendationService
+
+    service = None
+    if mode == 'preload':
+        service = UniversityRecommendationService()
+        gc.collect()
+        gc.freeze()
+
+    pipes = []
+    for _ in range(workers):
+        read_end, write_end = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_end)
+            report = serve(start, service or UniversityRecommendationService(), requests)
+            os.write(write_end, json.dumps(report).encode('utf-8'))
+            os.close(write_end)
+            signal.pause()  # stay alive (and keep sharing) until the parent has measured
+            os._exit(0)
+        os.close(write_end)
+        pipes.append((pid, read_end))
+
+    reports = []
+    for pid, read_end in pipes:
+        with os.fdopen(read_end, 'rb') as f:
+            reports.append(json.loads(f.read()))
+    # Measured while the workers still run, so the pages the parent shares with them are split
+    parent = memory()
+    for pid, _ in pipes:
+        os.kill(pid, signal.SIGTERM)
+        os.waitpid(pid, 0)
+    print(json.dumps({'parent': parent, 'workers': reports}))
+
+
+def measure(worker_counts, requests, modes):
+    print(f"{'mode':<11} {'workers':>7} {'startup':>10} {'private dirty/worker':>21} {'total PSS':>10}")
+    for mode in modes:
+        for workers in worker_counts:
+            output = subprocess.run(
+                [sys.executable, __file__, '--run', mode, '--workers', str(workers), '--requests', str(requests)],
+                cwd=project_dir, capture_output=True, text=True, check=True
+            ).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            reports = result['workers']
+            startup = max(report['ready'] for report in reports)
+            dirty = sum(report['private_dirty'] for report in reports) / len(reports)
+            total_pss = result['parent']['pss'] + sum(report['pss'] for report in reports)
+            print(f"{mode:<11} {workers:>7} {startup * 1000:>8.0f}ms {dirty / 2**20:>18.1f} MB "
+                  f"{total_pss / 2**20:>7.1f} MB")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Measure startup time and worker memory of pre-fork serving")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--requests', type=int, default=50)
+    parser.add_argument('--mode', choices=MODES + ('both',), default='both')
+    parser.add_argument('--run', choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if not sys.platform.startswith('linux'):
+        print("⚠️  Needs fork and /proc/self/smaps_rollup (Linux)")
+        sys.exit(1)
+    if args.run:
+        run(args.run, args.workers[0], args.requests)
+        sys.exit(0)
+    if not os.path.exists(project_dir / 'vector_store_cache'):
+        print("⚠️  No vector_store_cache found - run python create_cache.py first")
+        sys.exit(1)
+    measure(args.workers, args.requests, MODES if args.mode == 'both' else (args.mode,))
@@ -0,0 +1,346 @@
+import json
+import math
+import os
+import struct
+import sys
+from array import array
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+# Metadata key exposed to the rest of the service -> field name in the dataset
+CATALOG_FIELDS = (
+    ('university_id', 'university_id'),
+    ('course_id', 'university_course_id'),
+    ('university_name', 'university_name'),
+    ('university_slug', 'university_slug'),
+    ('course_name', 'university_course_name'),
+    ('course_program_label', 'course_program_label'),
+    ('program_level', 'program_level'),
+    ('program_type', 'program_type'),
+    ('credential', 'university_courses_credential'),
+    ('parent_course', 'parent_course_name'),
+    ('location', 'location_name'),
+    ('country', 'country_name'),
+    ('global_rank', 'university_global_rank'),
+    ('tuition_usd', 'university_course_tuition_usd'),
+    ('tuition_local', 'university_course_tuition_local'),
+    ('university_type', 'university_type'),
+    ('currency', 'country_currency'),
+    ('is_partner', 'is_partner'),
+    ('is_published', 'is_published'),
+    ('university_views', 'university_views'),
+    ('scholarship_count', 'scholarship_count'),
+    ('is_gre_required', 'is_gre_required'),
+    ('tuition_affordability', 'tuition_affordability'),
+    ('university_quality', 'university_quality'),
+    ('country_popularity', 'country_popularity'),
+)
+
+CATALOG_KEYS = tuple(key for key, _ in CATALOG_FIELDS)
+
+CATALOG_FILE = 'catalog.bin'
+
+# File layout: magic, header length (little-endian uint64), JSON header, then
+# 64-byte aligned sections addressed by (offset, length) from the header
+_MAGIC = b'UFCATLG1'
+_PREFIX = struct.Struct('<8sQ')
+_ALIGNMENT = 64
+
+
+class StringTable:
+    """Read-only sequence of strings stored as one UTF-8 blob plus end offsets.
+
+    Strings are decoded on access, so a table opened from a memory-mapped file
+    costs no Python objects until its values are actually used.
+    """
+
+    __slots__ = ('offsets', 'blob')
+
+    def __init__(self, offsets: np.ndarray, blob: np.ndarray):
+        self.offsets = offsets
+        self.blob = blob
+
+    @classmethod
+    def from_strings(cls, strings: Sequence[str]) -> 'StringTable':
+        encoded = [value.encode('utf-8') for value in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in encoded], out=offsets[1:])
+        return cls(offsets, np.frombuffer(b''.join(encoded), dtype=np.uint8))
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index: int) -> str:
+        if index < 0:
+            index += len(self)
+        return self.blob[self.offsets[index]:self.offsets[index + 1]].tobytes().decode('utf-8')
+
+    def __iter__(self) -> Iterator[str]:
+        data = self.blob.tobytes()
+        bounds = self.offsets.tolist()
+        for start, end in zip(bounds, bounds[1:]):
+            yield data[start:end].decode('utf-8')
+
+    @property
+    def nbytes(self) -> int:
+        return self.offsets.nbytes + self.blob.nbytes
+
+
+class CatalogColumn:
+    """A single catalog column.
+
+    String columns are stored as interned int32 codes into ``categories``
+    (-1 marks a missing value), a tuple or a lazily decoded StringTable. Numeric and boolean columns are stored as
+    float64 with NaN for missing values; ``kind`` records how to turn a
+    stored value back into the Python type found in the dataset.
+    """
+
+    __slots__ = ('kind', 'values', 'categories', '_lookup', '_lowered')
+
+    def __init__(self, kind: str, values: np.ndarray, categories: Optional[Sequence[str]] = None):
+        self.kind = kind
+        self.values = values
+        self.categories = categories
+        self._lookup = None
+        self._lowered = None
+
+    @property
+    def is_string(self) -> bool:
+        return self.kind == 'str'
+
+    def get(self, row_id: int) -> Any:
+        """Materialize a single value as a plain Python object"""
+        value = self.values[row_id]
+        if self.kind == 'str':
+            return self.categories[value] if value >= 0 else None
+        if math.isnan(value):
+            return None
+        if self.kind == 'int':
+            return int(value)
+        if self.kind == 'bool':
+            return bool(value)
+        return float(value)
+
+    def code_of(self, value: str) -> int:
+        """Return the interned code for ``value`` or -1 if it never occurs"""
+        if self._lookup is None:
+            self._lookup = {category: code for code, category in enumerate(self.categories)}
+        return self._lookup.get(value, -1)
+
+    def lowered_categories(self) -> Tuple[str, ...]:
+        """Lower-cased categories, computed once for case-insensitive matching"""
+        if self._lowered is None:
+            self._lowered = tuple(category.lower() for category in self.categories)
+        return self._lowered
+
+    def memory_usage(self) -> int:
+        total = self.values.nbytes
+        if isinstance(self.categories, StringTable):
+            total += self.categories.nbytes
+        elif self.categories is not None:
+            total += sys.getsizeof(self.categories)
+            total += sum(sys.getsizeof(category) for category in self.categories)
+        return total
+
+
+class _ColumnBuilder:
+    """Accumulates one column row by row, inferring its kind on the way"""
+
+    __slots__ = ('is_string', 'numbers', 'codes', 'lookup', 'categories',
+                 'all_bool', 'all_int', 'has_values')
+
+    def __init__(self):
+        self.is_string = False
+        self.numbers = array('d')
+        self.codes = array('i')
+        self.lookup = {}
+        self.categories = []
+        self.all_bool = True
+        self.all_int = True
+        self.has_values = False
+
+    def append(self, value: Any):
+        if value is None or (isinstance(value, float) and math.isnan(value)):
+            if self.is_string:
+                self.codes.append(-1)
+            else:
+                self.numbers.append(math.nan)
+            return
+
+        if not self.is_string and isinstance(value, (bool, int, float)):
+            self.has_values = True
+            if not isinstance(value, bool):
+                self.all_bool = False
+            if isinstance(value, float):
+                self.all_int = False
+            self.numbers.append(value)
+            return
+
+        if not self.is_string:
+            self._switch_to_strings()
+        self.codes.append(self._intern(str(value)))
+
+    def _intern(self, value: str) -> int:
+        code = self.lookup.get(value)
+        if code is None:
+            code = len(self.categories)
+            self.lookup[value] = code
+            self.categories.append(value)
+        return code
+
+    def _switch_to_strings(self):
+        """A column that mixes numbers and strings is stored as strings"""
+        self.is_string = True
+        for number in self.numbers:
+            if math.isnan(number):
+                self.codes.append(-1)
+            elif self.all_int:
+                self.codes.append(self._intern(str(int(number))))
+            else:
+                self.codes.append(self._intern(str(number)))
+        self.numbers = array('d')
+
+    def finish(self) -> CatalogColumn:
+        if self.is_string:
+            return CatalogColumn('str', np.frombuffer(self.codes, dtype=np.int32).copy(), tuple(self.categories))
+        if not self.has_values:
+            kind = 'float'
+        elif self.all_bool:
+            kind = 'bool'
+        elif self.all_int:
+            kind = 'int'
+        else:
+            kind = 'float'
+        return CatalogColumn(kind, np.frombuffer(self.numbers, dtype=np.float64).copy())
+
+
+class CourseCatalog:
+    """Columnar course catalog addressed by FAISS row id.
+
+    Row ``i`` of the catalog is the course stored at position ``i`` of the
+    vector index, so search results can be resolved without keeping a
+    metadata dict per course in the FAISS docstore.
+    """
+
+    def __init__(self, columns: Dict[str, CatalogColumn], size: int):
+        self.columns = columns
+        self.size = size
+
+    def __len__(self) -> int:
+        return self.size
+
+    @classmethod
+    def from_records(cls, records: Iterable[Dict[str, Any]]) -> 'CourseCatalog':
+        """Build a catalog from raw dataset records (dicts keyed by dataset field)"""
+        builders = [(field, _ColumnBuilder()) for _, field in CATALOG_FIELDS]
+        size = 0
+        for record in records:
+            for field, builder in builders:
+                builder.append(record.get(field))
+            size += 1
+
+        columns = {
+            key: builder.finish()
+            for (key, _), (_, builder) in zip(CATALOG_FIELDS, builders)
+        }
+        return cls(columns, size)
+
+    def column(self, key: str) -> CatalogColumn:
+        return self.columns[key]
+
+    def row(self, row_id: int) -> Dict[str, Any]:
+        """Materialize one course as a metadata dict"""
+        return {key: column.get(row_id) for key, column in self.columns.items()}
+
+    def rows(self, row_ids: Iterable[int]) -> List[Dict[str, Any]]:
+        return [self.row(int(row_id)) for row_id in row_ids]
+
+    def value_counts(self, key: str) -> List[Tuple[str, int]]:
+        """(value, count) pairs for a string column, most frequent first then alphabetical"""
+        column = self.columns[key]
+        codes = column.values
+        counts = np.bincount(codes[codes >= 0], minlength=len(column.categories))
+        pairs = [
+            (column.categories[code], int(count))
+            for code, count in enumerate(counts)
+            if count > 0 and column.categories[code]
+        ]
+        pairs.sort(key=lambda x: (-x[1], x[0]))
+        return pairs
+
+    def save(self, path: str):
+        """Write the catalog as a single binary file: column arrays plus string tables"""
+        sections = []
+        columns = {}
+        position = 0
+
+        def add(array: np.ndarray) -> List[int]:
+            nonlocal position
+            data = np.ascontiguousarray(array).tobytes()
+            entry = [position, len(data)]
+            sections.append(data)
+            position += len(data)
+            padding = -position % _ALIGNMENT
+            sections.append(b'\0' * padding)
+            position += padding
+            return entry
+
+        for key, column in self.columns.items():
+            spec = {'kind': column.kind, 'dtype': column.values.dtype.str, 'values': add(column.values)}
+            if column.categories is not None:
+                table = column.categories
+                if not isinstance(table, StringTable):
+                    table = StringTable.from_strings(table)
+                spec['offsets'] = add(table.offsets)
+                spec['blob'] = add(table.blob)
+            columns[key] = spec
+
+        header = json.dumps({'size': self.size, 'columns': columns}).encode('utf-8')
+        data_start = _PREFIX.size + len(header)
+        data_start += -data_start % _ALIGNMENT
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(_PREFIX.pack(_MAGIC, len(header)))
+            f.write(header)
+            f.write(b'\0' * (data_start - _PREFIX.size - len(header)))
+            for data in sections:
+                f.write(data)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> 'CourseCatalog':
+        """Open a saved catalog without creating any per-row Python objects.
+
+        With ``mmap`` the column arrays and string tables are read-only views
+        of the file, so every process on the host shares one page-cached copy.
+        """
+        with open(path, 'rb') as f:
+            magic, header_length = _PREFIX.unpack(f.read(_PREFIX.size))
+            if magic != _MAGIC:
+                raise ValueError(f"{path} is not a course catalog file")
+            header = json.loads(f.read(header_length))
+        data_start = _PREFIX.size + header_length
+        data_start += -data_start % _ALIGNMENT
+
+        if mmap:
+            buffer = np.memmap(path, dtype=np.uint8, mode='r')
+        else:
+            buffer = np.fromfile(path, dtype=np.uint8)
+
+        def section(entry: List[int], dtype) -> np.ndarray:
+            offset, length = entry
+            return np.asarray(buffer[data_start + offset:data_start + offset + length]).view(dtype)
+
+        columns = {}
+        for key, spec in header['columns'].items():
+            categories = None
+            if 'offsets' in spec:
+                categories = StringTable(section(spec['offsets'], np.int64), section(spec['blob'], np.uint8))
+            columns[key] = CatalogColumn(spec['kind'], section(spec['values'], np.dtype(spec['dtype'])), categories)
+        return cls(columns, header['size'])
+
+    def memory_usage(self) -> Dict[str, int]:
+        """Approximate bytes held by each column"""
+        return {key: column.memory_usage() for key, column in self.columns.items()}
@@ -0,0 +1,70 @@
+import numpy as np
+from django.conf import settings
+
+
+DIVERSITY_MODES = ('none', 'mmr', 'university_cap')
+
+
+def diversity_mode_from_settings() -> str:
+    """The configured diversification of result pages"""
+    mode = settings.RECOMMENDATION_DIVERSITY
+    if mode not in DIVERSITY_MODES:
+        raise ValueError(f"Unknown RECOMMENDATION_DIVERSITY: {mode!r} (expected one of {', '.join(DIVERSITY_MODES)})")
+    return mode
+
+
+def mmr_order(relevance: np.ndarray, vectors: np.ndarray, k: int, weight: float) -> np.ndarray:
+    """Greedy maximal marginal relevance over candidates.
+
+    Each step picks the candidate maximizing ``weight * relevance - (1 - weight)
+    * redundancy``, where relevance is rescaled to [0, 1] over the candidates and
+    redundancy is the highest cosine similarity (floored at 0) to any candidate
+    already picked. A step is one matrix-vector product over the candidates.
+    Ties go to the lower index. Returns ``k`` candidate indices in pick order.
+    """
+    count = len(relevance)
+    k = min(k, count)
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+
+    relevance = np.asarray(relevance, dtype=np.float64)
+    span = relevance.max() - relevance.min()
+    scaled = (relevance - relevance.min()) / span if span > 0 else np.zeros(count)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    unit = vectors / np.where(norms > 0, norms, 1)
+
+    redundancy = np.zeros(count)
+    available = np.ones(count, dtype=bool)
+    picked = np.empty(k, dtype=np.int64)
+    for step in range(k):
+        scores = np.where(available, weight * scaled - (1 - weight) * redundancy, -np.inf)
+        choice = int(np.argmax(scores))
+        picked[step] = choice
+        available[choice] = False
+        np.maximum(redundancy, unit @ unit[choice], out=redundancy)
+    return picked
+
+
+def cap_per_group(groups: np.ndarray, cap: int, k: int) -> np.ndarray:
+    """The first ``k`` positions of a ranked list, at most ``cap`` per group.
+
+    ``groups`` holds each ranked candidate's group. If the cap leaves fewer than
+    ``k`` candidates, the capped ones fill the remaining places in rank order.
+    """
+    if len(groups) == 0 or k <= 0:
+        return np.empty(0, dtype=np.int64)
+    positions = np.arange(len(groups))
+    kept = group_occurrence(groups) < max(cap, 1)
+    return np.concatenate((positions[kept], positions[~kept]))[:k]
+
+
+def group_occurrence(groups: np.ndarray) -> np.ndarray:
+    """For each entry of a ranked list, how many earlier entries share its group"""
+    count = len(groups)
+    order = np.argsort(groups, kind='stable')
+    ordered = groups[order]
+    starts = np.flatnonzero(np.concatenate(([True], ordered[1:] != ordered[:-1])))
+    sizes = np.diff(np.append(starts, count))
+    occurrence = np.empty(count, dtype=np.int64)
+    occurrence[order] = np.arange(count) - np.repeat(starts, sizes)
+    return occurrence
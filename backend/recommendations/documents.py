@@ -0,0 +1,222 @@
+import json
+import re
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Union
+
+import numpy as np
+
+from .catalog import CatalogColumn, CourseCatalog
+
+
+# Text embedded for each course; placeholders are catalog keys
+DOCUMENT_TEMPLATE = """
+            University: {university_name}
+            Course: {course_name}
+            Program: {course_program_label}
+            Parent Course: {parent_course}
+            Level: {program_type} - {credential}
+            Location: {location}, {country}
+            Global Rank: {global_rank}
+            Tuition (USD): ${tuition_usd}
+            University Type: {university_type}
+            Currency: {currency}
+            Scholarship Count: {scholarship_count}
+            GRE Required: {is_gre_required}
+            University Views: {university_views}
+            Tuition Affordability: {tuition_affordability}
+            University Quality: {university_quality}
+            Country Popularity: {country_popularity}
+            """
+
+_PLACEHOLDER = re.compile(r"\{(\w+)\}")
+
+DOCUMENT_KEYS = tuple(_PLACEHOLDER.findall(DOCUMENT_TEMPLATE))
+
+# The template as a printf-style format filled with one tuple of values per row
+_ROW_FORMAT = _PLACEHOLDER.sub('%s', DOCUMENT_TEMPLATE.replace('%', '%%'))
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_NUMBER_END = ' \t\n\r,]'
+
+
+def iter_records(path: str, chunk_size: int = 1 << 20) -> Iterator[Dict[str, Any]]:
+    """Yield the records of a JSON array file one at a time.
+
+    The file is read in ``chunk_size`` pieces and each record is decoded with
+    ``JSONDecoder.raw_decode`` as soon as it is complete, so memory use is
+    bounded by the chunk size and the largest record, not the file size.
+    Accepts what ``json.load`` accepts for such a file, plus a leading BOM.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, 'r', encoding='utf-8-sig') as f:
+        buffer = ''
+        position = 0
+        eof = False
+        expect = '['
+
+        while True:
+            position = _WHITESPACE.match(buffer, position).end()
+            if position == len(buffer):
+                if eof:
+                    if expect == 'end':
+                        return
+                    raise ValueError(f"{path}: unexpected end of file")
+                chunk = f.read(chunk_size)
+                eof = not chunk
+                buffer = buffer[position:] + chunk
+                position = 0
+                continue
+
+            char = buffer[position]
+            if expect == 'end':
+                raise ValueError(f"{path}: unexpected data after the array")
+            if expect == '[':
+                if char != '[':
+                    raise ValueError(f"{path}: expected a JSON array of records")
+                position += 1
+                expect = 'first'
+            elif expect == 'separator' or (expect == 'first' and char == ']'):
+                if char == ']':
+                    position += 1
+                    expect = 'end'
+                    continue
+                if char != ',':
+                    raise ValueError(f"{path}: expected ',' or ']' between records")
+                position += 1
+                expect = 'record'
+            else:
+                try:
+                    record, end = decoder.raw_decode(buffer, position)
+                    # A number may continue in the next chunk: "1" of "12", "0.5" of "0.5e-7"
+                    complete = (eof or not isinstance(record, (int, float))
+                                or (end < len(buffer) and buffer[end] in _NUMBER_END))
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                    complete = False
+                if not complete:
+                    # The record continues in the next chunk
+                    chunk = f.read(chunk_size)
+                    eof = not chunk
+                    buffer = buffer[position:] + chunk
+                    position = 0
+                    continue
+                yield record
+                position = end
+                expect = 'separator'
+                if position >= chunk_size:
+                    buffer = buffer[position:]
+                    position = 0
+
+
+class _ColumnFormatter:
+    """Formats a whole slice of one catalog column to strings at once.
+
+    String columns format each distinct value once and gather by code;
+    numeric columns go through ``tolist`` and ``map(str)``.
+    """
+
+    def __init__(self, column: CatalogColumn):
+        self.column = column
+        self._table = None
+        if column.is_string:
+            self.style = 'str'
+            return
+        missing = np.isnan(column.values)
+        if missing.all() and len(missing):
+            # A column without a single number is an object column of None
+            self.style = 'none'
+        elif column.kind == 'float' or (column.kind == 'int' and missing.any()):
+            self.style = 'float'
+        elif column.kind == 'bool':
+            self.style = 'bool'
+        else:
+            self.style = 'int'
+
+    def __call__(self, row_ids: np.ndarray) -> Sequence[str]:
+        values = self.column.values[row_ids]
+        if self.style == 'str':
+            if self._table is None:
+                # The trailing entry is what missing values (code -1) print as
+                self._table = np.array([*self.column.categories, 'None'], dtype=object)
+            return self._table[values]
+        if self.style == 'none':
+            return ['None'] * len(row_ids)
+        if self.style == 'float':
+            return list(map(str, values.tolist()))
+        if self.style == 'int':
+            return list(map(str, values.astype(np.int64).tolist()))
+        # Booleans: False / True, or None for a missing value
+        choices = np.where(np.isnan(values), 2, values != 0).astype(np.intp)
+        return _BOOL_STRINGS[choices]
+
+
+_BOOL_STRINGS = np.array(['False', 'True', 'None'], dtype=object)
+
+
+def missing_field_report(catalog: CourseCatalog, samples: int = 3) -> Dict[str, Dict[str, Any]]:
+    """Per field: how many courses lack a value and a few (distinct) universities they belong to"""
+    names = catalog.column('university_name')
+    report = {}
+    for key, column in catalog.columns.items():
+        missing = column.values < 0 if column.is_string else np.isnan(column.values)
+        count = int(missing.sum())
+        if count:
+            report[key] = {
+                'count': count,
+                'examples': list(dict.fromkeys(
+                    names.get(int(row_id)) for row_id in np.flatnonzero(missing)[:100 * samples]
+                ))[:samples],
+            }
+    return report
+
+
+class DocumentTexts(Sequence):
+    """The document text of every catalog row, rendered on demand.
+
+    Nothing is kept per row, so index builds can walk the texts batch by batch
+    (and hash them) without holding every document in memory. A batch is
+    rendered column by column: each template field is formatted for all rows
+    of the batch at once and the rows are then filled in with one printf-style
+    format each. Values are formatted the way the original DataFrame-based
+    rendering printed them: integer columns with gaps print as floats,
+    missing numbers as ``nan`` and other missing values as ``None``.
+
+    The catalog keeps less than the DataFrame did, so texts differ from that
+    rendering in three cases: a string or boolean key absent from a record
+    (rather than null) prints ``None`` where pandas printed ``nan``, booleans
+    in a column that also holds integers print as ``0``/``1``, and integers
+    beyond 2**53 lose precision (numbers are stored as float64).
+
+    ``row_ids`` restricts the sequence to those rows, in that order.
+    """
+
+    CHUNK_SIZE = 4096
+
+    def __init__(self, catalog: CourseCatalog, row_ids: Optional[np.ndarray] = None):
+        self.catalog = catalog
+        self.row_ids = row_ids
+        self._formatters = [_ColumnFormatter(catalog.column(key)) for key in DOCUMENT_KEYS]
+
+    def __len__(self) -> int:
+        return len(self.catalog) if self.row_ids is None else len(self.row_ids)
+
+    def render_rows(self, row_ids: np.ndarray) -> List[str]:
+        """The texts of catalog rows ``row_ids``"""
+        columns = [formatter(row_ids) for formatter in self._formatters]
+        return [_ROW_FORMAT % values for values in zip(*columns)]
+
+    def _row_ids(self, positions: np.ndarray) -> np.ndarray:
+        return positions if self.row_ids is None else np.asarray(self.row_ids)[positions]
+
+    def __getitem__(self, item: Union[int, slice]) -> Union[str, List[str]]:
+        if isinstance(item, slice):
+            return self.render_rows(self._row_ids(np.arange(*item.indices(len(self)))))
+        if item < 0:
+            item += len(self)
+        if not 0 <= item < len(self):
+            raise IndexError(item)
+        return self.render_rows(self._row_ids(np.array([item])))[0]
+
+    def __iter__(self) -> Iterator[str]:
+        for start in range(0, len(self), self.CHUNK_SIZE):
+            yield from self[start:start + self.CHUNK_SIZE]
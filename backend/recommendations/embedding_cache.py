@@ -0,0 +1,245 @@
+import asyncio
+import hashlib
+import inspect
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+
+def canonicalize_query(text: str) -> str:
+    """Collapse whitespace and case so trivially different queries share a cache entry"""
+    return " ".join(text.split()).casefold()
+
+
+class QueryEmbeddingCache:
+    """Two-tier cache of query embeddings.
+
+    The first tier is an in-process LRU dict; the second is a SQLite file
+    shared by every worker on the host. Entries are keyed on the embedding
+    model name plus the canonicalized query text, and both tiers are size
+    bounded (least recently used entries are evicted first).
+    """
+
+    # How many disk inserts happen between two eviction passes
+    EVICTION_INTERVAL = 64
+
+    def __init__(self, model_name: str, path: Optional[str] = None,
+                 memory_size: int = 1024, disk_size: int = 100000):
+        self.model_name = model_name
+        self.path = path
+        self.memory_size = memory_size
+        self.disk_size = disk_size
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._connections = []
+        self._inserts = 0
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if self.path:
+            try:
+                os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+                self._connection().execute(
+                    "CREATE TABLE IF NOT EXISTS query_embeddings ("
+                    "key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+                )
+                self._connection().execute(
+                    "CREATE INDEX IF NOT EXISTS query_embeddings_last_used ON query_embeddings (last_used)"
+                )
+            except sqlite3.Error as e:
+                logger.warning(f"❌ Disabling on-disk query embedding cache: {e}")
+                self.path = None
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, 'connection', None)
+        # A connection inherited through fork must not be used by the child
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+            with self._lock:
+                self._connections.append((os.getpid(), connection))
+        return connection
+
+    def close(self):
+        """Close the disk tier connections this process opened, in every thread; later calls reconnect"""
+        with self._lock:
+            owned = [connection for pid, connection in self._connections if pid == os.getpid()]
+            self._connections = []
+            self._local = threading.local()
+        for connection in owned:
+            connection.close()
+
+    def _key(self, text: str) -> str:
+        payload = f"{self.model_name}\0{canonicalize_query(text)}".encode('utf-8')
+        return hashlib.sha256(payload).hexdigest()
+
+    def _remember(self, key: str, vector: np.ndarray):
+        with self._lock:
+            self._memory[key] = vector
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_size:
+                self._memory.popitem(last=False)
+
+    def get_memory(self, text: str) -> Optional[np.ndarray]:
+        """The in-process tier alone: never blocks on the disk, and a miss here is not counted"""
+        key = self._key(text)
+        with self._lock:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+            return vector
+
+    def get(self, text: str) -> Optional[np.ndarray]:
+        vector = self.get_memory(text)
+        if vector is not None:
+            return vector
+
+        key = self._key(text)
+        if self.path:
+            try:
+                connection = self._connection()
+                row = connection.execute(
+                    "SELECT vector FROM query_embeddings WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    connection.execute(
+                        "UPDATE query_embeddings SET last_used = ? WHERE key = ?", (time.time(), key)
+                    )
+                    vector = np.frombuffer(row[0], dtype=np.float32)
+                    self._remember(key, vector)
+                    with self._lock:
+                        self.disk_hits += 1
+                    return vector
+            except sqlite3.Error as e:
+                logger.warning(f"❌ Query embedding cache read failed: {e}")
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, text: str, vector) -> np.ndarray:
+        key = self._key(text)
+        vector = np.asarray(vector, dtype=np.float32)
+        self._remember(key, vector)
+
+        if self.path:
+            try:
+                connection = self._connection()
+                connection.execute(
+                    "INSERT OR REPLACE INTO query_embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                    (key, vector.tobytes(), time.time())
+                )
+                with self._lock:
+                    self._inserts += 1
+                    evict = self._inserts % self.EVICTION_INTERVAL == 0
+                if evict:
+                    self._evict(connection)
+            except sqlite3.Error as e:
+                logger.warning(f"❌ Query embedding cache write failed: {e}")
+        return vector
+
+    def _evict(self, connection: sqlite3.Connection):
+        (count,) = connection.execute("SELECT COUNT(*) FROM query_embeddings").fetchone()
+        excess = count - self.disk_size
+        if excess > 0:
+            connection.execute(
+                "DELETE FROM query_embeddings WHERE key IN "
+                "(SELECT key FROM query_embeddings ORDER BY last_used ASC LIMIT ?)",
+                (excess,)
+            )
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+        if self.path:
+            self._connection().execute("DELETE FROM query_embeddings")
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'memory_entries': len(self._memory),
+            }
+
+
+class CachedQueryEmbeddings(Embeddings):
+    """Embeddings wrapper that answers ``embed_query`` from a QueryEmbeddingCache"""
+
+    def __init__(self, embeddings: Embeddings, cache: QueryEmbeddingCache):
+        self.embeddings = embeddings
+        self.cache = cache
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        vector = self.cache.get(text)
+        if vector is None:
+            vector = self.cache.put(text, self.embeddings.embed_query(text))
+        return vector.tolist()
+
+    def embed_queries(self, texts: List[str]) -> np.ndarray:
+        """Embed several queries, sending only the cache misses to the model in one batch"""
+        vectors = [self.cache.get(text) for text in texts]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            fresh = self._embed_query_batch([texts[i] for i in missing])
+            for i, vector in zip(missing, fresh):
+                vectors[i] = self.cache.put(texts[i], vector)
+        if not vectors:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.vstack(vectors)
+
+    async def aembed_queries(self, texts: List[str]) -> np.ndarray:
+        """``embed_queries`` for async callers: cache misses are awaited instead of blocking the event loop"""
+        vectors = [self.cache.get_memory(text) for text in texts]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            # The disk tier is SQLite, whose calls block: only the memory tier is read on the event loop
+            found = await asyncio.to_thread(lambda: [self.cache.get(texts[i]) for i in missing])
+            for i, vector in zip(missing, found):
+                vectors[i] = vector
+            missing = [i for i in missing if vectors[i] is None]
+        if missing:
+            fresh = await self._aembed_query_batch([texts[i] for i in missing])
+            stored = await asyncio.to_thread(
+                lambda: [self.cache.put(texts[i], vector) for i, vector in zip(missing, fresh)]
+            )
+            for i, vector in zip(missing, stored):
+                vectors[i] = vector
+        if not vectors:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.vstack(vectors)
+
+    async def _aembed_query_batch(self, texts: List[str]) -> List[List[float]]:
+        if 'task_type' in inspect.signature(self.embeddings.aembed_documents).parameters:
+            return await self.embeddings.aembed_documents(texts, task_type='retrieval_query')
+        if 'task_type' in inspect.signature(self.embeddings.embed_documents).parameters:
+            # The client has no async call taking a task type; keep its one batched request off the event loop
+            return await asyncio.to_thread(self.embeddings.embed_documents, texts, task_type='retrieval_query')
+        return list(await asyncio.gather(*(self.embeddings.aembed_query(text) for text in texts)))
+
+    def _embed_query_batch(self, texts: List[str]) -> List[List[float]]:
+        # Clients that accept a task type can embed many queries in one request
+        if 'task_type' in inspect.signature(self.embeddings.embed_documents).parameters:
+            return self.embeddings.embed_documents(texts, task_type='retrieval_query')
+        return [self.embeddings.embed_query(text) for text in texts]
@@ -0,0 +1,90 @@
+import re
+import zlib
+from typing import List, Tuple
+
+import numpy as np
+from django.conf import settings
+from langchain_core.embeddings import Embeddings
+
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+class HashingEmbeddings(Embeddings):
+    """Deterministic, offline text embeddings computed with NumPy.
+
+    Word unigrams, word bigrams and character trigrams are hashed (CRC32, so
+    the result is stable across processes) into ``dimension`` signed buckets,
+    weighted by log-scaled term frequency and L2 normalized. No model, network
+    access or API key is needed, which makes it suitable for building and
+    querying the index offline, in tests and in benchmarks.
+    """
+
+    def __init__(self, dimension: int = 512):
+        self.dimension = dimension
+
+    @property
+    def model_name(self) -> str:
+        return f"local-hashing-v1-{self.dimension}"
+
+    @staticmethod
+    def _features(text: str) -> List[str]:
+        words = _TOKEN_PATTERN.findall(text.lower())
+        features = [f"w:{word}" for word in words]
+        features.extend(f"b:{first} {second}" for first, second in zip(words, words[1:]))
+        for word in words:
+            padded = f" {word} "
+            features.extend(f"c:{padded[i:i + 3]}" for i in range(len(padded) - 2))
+        return features
+
+    def _hash(self, features: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        hashes = np.fromiter(
+            (zlib.crc32(feature.encode('utf-8')) for feature in features),
+            dtype=np.uint32, count=len(features)
+        )
+        buckets = (hashes % self.dimension).astype(np.int64)
+        # The top bit decides the sign so that collisions tend to cancel out
+        signs = np.where(hashes >> 31, -1.0, 1.0)
+        return buckets, signs
+
+    def _embed(self, text: str) -> np.ndarray:
+        features = self._features(text)
+        vector = np.zeros(self.dimension, dtype=np.float64)
+        if not features:
+            return vector.astype(np.float32)
+
+        unique, counts = np.unique(np.array(features, dtype=object), return_counts=True)
+        buckets, signs = self._hash(list(unique))
+        np.add.at(vector, buckets, signs * (1.0 + np.log(counts)))
+
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector /= norm
+        return vector.astype(np.float32)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text).tolist() for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text).tolist()
+
+
+def get_embedding_backend() -> Tuple[Embeddings, str]:
+    """Build the embedding client selected by ``settings.EMBEDDING_BACKEND``.
+
+    Returns the client and the model name used to key caches and saved indexes.
+    """
+    backend = settings.EMBEDDING_BACKEND
+    if backend == 'local':
+        embeddings = HashingEmbeddings(dimension=settings.LOCAL_EMBEDDING_DIMENSION)
+        return embeddings, embeddings.model_name
+    if backend == 'gemini':
+        from langchain_google_genai import GoogleGenerativeAIEmbeddings
+
+        model_name = "models/embedding-001"
+        embeddings = GoogleGenerativeAIEmbeddings(
+            model=model_name,
+            google_api_key=settings.GEMINI_API_KEY
+        )
+        return embeddings, model_name
+    raise ValueError(f"Unknown EMBEDDING_BACKEND: {backend!r} (expected 'gemini' or 'local')")
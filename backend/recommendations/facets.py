@@ -0,0 +1,52 @@
+import hashlib
+import json
+from types import MappingProxyType
+from typing import Dict, Mapping, Sequence, Tuple
+
+from .catalog import CourseCatalog
+
+
+# Facet -> catalog column
+FACET_COLUMNS = {
+    'programs': 'parent_course',
+    'countries': 'country',
+    'locations': 'location',
+    'university_types': 'university_type',
+    'program_levels': 'program_level',
+}
+
+# Facets listed alphabetically in the options; the others are most frequent first
+ALPHABETICAL_FACETS = ('locations',)
+
+
+class FacetSnapshot:
+    """Value counts of every facet, computed once per catalog and never modified.
+
+    The options response is serialized when the snapshot is built, so serving
+    it is a matter of returning ``options_body``; ``etag`` identifies its
+    content for conditional requests.
+    """
+
+    def __init__(self, counts: Mapping[str, Sequence[Tuple[str, int]]], extra_options: Mapping[str, Sequence[str]]):
+        self.counts = MappingProxyType({facet: tuple(pairs) for facet, pairs in counts.items()})
+        values = {}
+        for facet, pairs in self.counts.items():
+            values[facet] = tuple(value for value, _ in pairs)
+            if facet in ALPHABETICAL_FACETS:
+                values[facet] = tuple(sorted(values[facet]))
+        self._values = MappingProxyType(values)
+        options = {facet: list(values) for facet, values in self._values.items()}
+        options.update((key, list(values)) for key, values in extra_options.items())
+        self.options_body = json.dumps(options, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        self.etag = '"%s"' % hashlib.blake2b(self.options_body, digest_size=16).hexdigest()
+
+    @classmethod
+    def build(cls, catalog: CourseCatalog, extra_options: Mapping[str, Sequence[str]]) -> 'FacetSnapshot':
+        return cls({facet: catalog.value_counts(key) for facet, key in FACET_COLUMNS.items()}, extra_options)
+
+    def values(self, facet: str) -> Tuple[str, ...]:
+        """The option list of ``facet``"""
+        return self._values[facet]
+
+    def sizes(self) -> Dict[str, int]:
+        return {facet: len(values) for facet, values in self._values.items()}
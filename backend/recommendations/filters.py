@@ -0,0 +1,191 @@
+from typing import Any, Dict, List, Optional
+
+import faiss
+import numpy as np
+
+from .catalog import CourseCatalog
+
+
+# Categorical hard constraints: preference key -> catalog column
+CATEGORICAL_CONSTRAINTS = (
+    ('preferred_countries', 'country'),
+    ('university_types', 'university_type'),
+)
+
+# Numeric "at most" hard constraints: preference key -> catalog column. As in the scorer, a
+# missing or 0 value means unknown, and a row with an unknown value never satisfies the constraint.
+NUMERIC_CONSTRAINTS = (
+    ('max_tuition_usd', 'tuition_usd'),
+    ('min_global_rank', 'global_rank'),
+)
+
+# Start from the smallest constraint's row list instead of ANDing bitmaps when
+# it holds fewer than 1/SELECTIVE_FRACTION of the catalog
+SELECTIVE_FRACTION = 64
+
+# Allowed sets up to this size are handed to FAISS as an id batch, larger ones as a bitmap
+ID_BATCH_LIMIT = 4096
+
+
+class AllowedRows:
+    """Row ids that satisfy every hard constraint, plus an optional packed bitmap of them"""
+
+    __slots__ = ('ids', 'bitmap')
+
+    def __init__(self, ids: np.ndarray, bitmap: Optional[np.ndarray] = None):
+        self.ids = ids
+        self.bitmap = bitmap
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def selector(self):
+        """FAISS ID selector restricting a search to the allowed rows"""
+        if self.bitmap is not None and len(self.ids) > ID_BATCH_LIMIT:
+            return faiss.IDSelectorBitmap(self.bitmap)
+        return faiss.IDSelectorBatch(self.ids)
+
+
+class _Constraint:
+    """One hard constraint, able to produce its rows as ids, as a bitmap, or to test given rows"""
+
+    def __init__(self, count: int, ids, bitmap, check):
+        self.count = count
+        self.ids = ids
+        self.bitmap = bitmap
+        self.check = check
+
+
+class ConstraintIndex:
+    """Bitmap inverted indexes and sorted numeric columns over the catalog.
+
+    Built once at load time so strict-filter searches can compute the set of
+    rows satisfying a user's hard constraints without scanning the catalog.
+    """
+
+    def __init__(self, catalog: CourseCatalog):
+        self.size = len(catalog)
+        self._codes = {}
+        self._postings = {}
+        self._bitmaps = {}
+        self._numbers = {}
+        self._sorted = {}
+
+        for _, key in CATEGORICAL_CONSTRAINTS:
+            column = catalog.column(key)
+            if not column.is_string:
+                continue
+            codes = column.values
+            order = np.argsort(codes, kind='stable').astype(np.int64)
+            counts = np.bincount(codes + 1, minlength=len(column.categories) + 1)
+            offsets = np.concatenate(([0], np.cumsum(counts)))
+            # Slot 0 holds rows with a missing value (code -1)
+            self._codes[key] = (column, codes)
+            self._postings[key] = (order, offsets)
+            self._bitmaps[key] = [
+                self._pack(order[offsets[code + 1]:offsets[code + 2]])
+                for code in range(len(column.categories))
+            ]
+
+        for _, key in NUMERIC_CONSTRAINTS:
+            column = catalog.column(key)
+            if column.is_string:
+                continue
+            values = column.values
+            known = np.flatnonzero(~np.isnan(values) & (values != 0))
+            order = known[np.argsort(values[known], kind='stable')].astype(np.int64)
+            self._numbers[key] = values
+            self._sorted[key] = (order, values[order])
+
+    def _pack(self, ids: np.ndarray) -> np.ndarray:
+        mask = np.zeros(self.size, dtype=bool)
+        mask[ids] = True
+        return np.packbits(mask, bitorder='little')
+
+    def _categorical(self, key: str, values: List[Any]) -> Optional[_Constraint]:
+        if key not in self._codes:
+            return None
+        column, codes = self._codes[key]
+        order, offsets = self._postings[key]
+        wanted = sorted({column.code_of(value) for value in values if isinstance(value, str)} - {-1})
+        count = int(sum(offsets[code + 2] - offsets[code + 1] for code in wanted))
+
+        def ids():
+            if not wanted:
+                return np.empty(0, dtype=np.int64)
+            return np.concatenate([order[offsets[code + 1]:offsets[code + 2]] for code in wanted])
+
+        def bitmap():
+            bits = np.zeros((self.size + 7) // 8, dtype=np.uint8)
+            for code in wanted:
+                bits |= self._bitmaps[key][code]
+            return bits
+
+        def check(rows):
+            return np.isin(codes[rows], wanted)
+
+        return _Constraint(count, ids, bitmap, check)
+
+    def _at_most(self, key: str, limit: float) -> Optional[_Constraint]:
+        if key not in self._sorted:
+            return None
+        order, sorted_values = self._sorted[key]
+        values = self._numbers[key]
+        count = int(np.searchsorted(sorted_values, limit, side='right'))
+
+        def ids():
+            return order[:count]
+
+        def bitmap():
+            return self._pack(order[:count])
+
+        def check(rows):
+            row_values = values[rows]
+            return (row_values <= limit) & (row_values != 0)
+
+        return _Constraint(count, ids, bitmap, check)
+
+    def _constraints(self, preferences: Dict[str, Any]) -> List[_Constraint]:
+        constraints = []
+        for preference, key in CATEGORICAL_CONSTRAINTS:
+            if preferences.get(preference):
+                constraint = self._categorical(key, preferences[preference])
+                if constraint is not None:
+                    constraints.append(constraint)
+
+        for preference, key in NUMERIC_CONSTRAINTS:
+            if not preferences.get(preference):
+                continue
+            try:
+                limit = float(preferences[preference])
+            except (TypeError, ValueError):
+                continue
+            constraint = self._at_most(key, limit)
+            if constraint is not None:
+                constraints.append(constraint)
+        return constraints
+
+    def allowed_rows(self, preferences: Dict[str, Any]) -> Optional[AllowedRows]:
+        """Rows satisfying every hard constraint in ``preferences``, or None if there are none"""
+        constraints = self._constraints(preferences)
+        if not constraints:
+            return None
+
+        constraints.sort(key=lambda c: c.count)
+        smallest = constraints[0]
+
+        # Selective: walk the smallest row list and test the other constraints on it directly
+        if smallest.count * SELECTIVE_FRACTION <= self.size:
+            rows = smallest.ids()
+            for constraint in constraints[1:]:
+                if len(rows) == 0:
+                    break
+                rows = rows[constraint.check(rows)]
+            return AllowedRows(np.sort(rows).astype(np.int64))
+
+        # Broad: intersect packed bitmaps
+        bits = smallest.bitmap()
+        for constraint in constraints[1:]:
+            bits &= constraint.bitmap()
+        mask = np.unpackbits(bits, count=self.size, bitorder='little').astype(bool)
+        return AllowedRows(np.flatnonzero(mask).astype(np.int64), bits)
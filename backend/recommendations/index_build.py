@@ -0,0 +1,201 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, List, Optional, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class IndexBuilder:
+    """Embeds documents in fixed-size batches on a bounded thread pool.
+
+    Every finished batch is written to ``checkpoint_dir`` as a ``.npy`` file,
+    so a build that fails part way through continues from the batches already
+    on disk when it is run again. Checkpoints are tied to a fingerprint of the
+    embedding model, batch size and document texts and are discarded when any
+    of those change.
+    """
+
+    CHECKPOINT_MANIFEST = 'checkpoint.json'
+
+    def __init__(self, embeddings, model_name: str, checkpoint_dir: str,
+                 batch_size: int = 100, max_workers: int = 4, max_retries: int = 3,
+                 progress: Optional[Callable[[int, int], None]] = None):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.checkpoint_dir = checkpoint_dir
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.progress = progress
+        self._lock = threading.Lock()
+
+    def _fingerprint(self, texts: Sequence[str]) -> str:
+        digest = hashlib.sha256(f"{self.model_name}\0{self.batch_size}\0{len(texts)}".encode('utf-8'))
+        for text in texts:
+            digest.update(hashlib.sha256(text.encode('utf-8')).digest())
+        return digest.hexdigest()
+
+    def _batch_path(self, batch: int) -> str:
+        return os.path.join(self.checkpoint_dir, f"batch_{batch:06d}.npy")
+
+    def _prepare_checkpoint_dir(self, fingerprint: str):
+        manifest_path = os.path.join(self.checkpoint_dir, self.CHECKPOINT_MANIFEST)
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'r') as f:
+                if json.load(f).get('fingerprint') == fingerprint:
+                    return
+            logger.info("🧹 Discarding checkpoints from a different dataset or embedding model")
+            shutil.rmtree(self.checkpoint_dir)
+
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        with open(manifest_path, 'w') as f:
+            json.dump({'fingerprint': fingerprint, 'model_name': self.model_name, 'batch_size': self.batch_size}, f)
+
+    def _load_batch(self, batch: int, expected_rows: int) -> Optional[np.ndarray]:
+        path = self._batch_path(batch)
+        if not os.path.exists(path):
+            return None
+        try:
+            vectors = np.load(path, allow_pickle=False)
+        except (OSError, ValueError):
+            return None
+        return vectors if vectors.ndim == 2 and len(vectors) == expected_rows else None
+
+    def _embed_batch(self, batch: int, texts: List[str]) -> np.ndarray:
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                vectors = np.asarray(self.embeddings.embed_documents(texts), dtype=np.float32)
+                break
+            except Exception as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = 2 ** attempt
+                logger.warning(f"⚠️ Batch {batch} failed (attempt {attempt}/{self.max_retries}): {e}; retrying in {delay}s")
+                time.sleep(delay)
+
+        # Write to a temporary file first so a crash never leaves a truncated checkpoint
+        path = self._batch_path(batch)
+        temp_path = f"{path}.tmp.npy"
+        np.save(temp_path, vectors)
+        os.replace(temp_path, path)
+        return vectors
+
+    def build(self, texts: Sequence[str]) -> np.ndarray:
+        """Return one embedding row per text, reusing any checkpointed batches.
+        
+        ``texts`` only needs ``len`` and slicing, so documents can be rendered
+        lazily one batch at a time. Finished batches are copied straight into
+        the result matrix.
+        """
+        total = len(texts)
+        batch_count = (total + self.batch_size - 1) // self.batch_size
+        self._prepare_checkpoint_dir(self._fingerprint(texts))
+        vectors = None
+
+        def store(batch: int, batch_vectors: np.ndarray):
+            nonlocal vectors
+            if vectors is None:
+                vectors = np.empty((total, batch_vectors.shape[1]), dtype=np.float32)
+            vectors[batch * self.batch_size:batch * self.batch_size + len(batch_vectors)] = batch_vectors
+
+        pending = []
+        for batch in range(batch_count):
+            start = batch * self.batch_size
+            loaded = self._load_batch(batch, min(self.batch_size, total - start))
+            if loaded is None:
+                pending.append(batch)
+            else:
+                store(batch, loaded)
+
+        resumed = total - sum(min(self.batch_size, total - b * self.batch_size) for b in pending)
+        if resumed:
+            logger.info(f"♻️ Resuming index build: {resumed}/{total} documents already embedded")
+
+        done = resumed
+        embedded = 0
+        build_start = time.time()
+        if self.progress:
+            self.progress(done, total)
+
+        # Only a few batches are rendered and in flight at a time, which bounds memory
+        remaining = iter(pending)
+        in_flight = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            def submit_next():
+                batch = next(remaining, None)
+                if batch is not None:
+                    batch_texts = texts[batch * self.batch_size:(batch + 1) * self.batch_size]
+                    in_flight[executor.submit(self._embed_batch, batch, batch_texts)] = batch
+
+            for _ in range(2 * self.max_workers):
+                submit_next()
+            while in_flight:
+                finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    batch = in_flight.pop(future)
+                    batch_vectors = future.result()
+                    store(batch, batch_vectors)
+                    with self._lock:
+                        done += len(batch_vectors)
+                        embedded += len(batch_vectors)
+                    elapsed = time.time() - build_start
+                    rate = embedded / elapsed if elapsed > 0 else 0.0
+                    eta = (total - done) / rate if rate > 0 else 0.0
+                    logger.info(f"⏳ Embedded {done}/{total} documents ({rate:.1f} docs/sec, ETA {eta:.0f}s)")
+                    if self.progress:
+                        self.progress(done, total)
+                    submit_next()
+
+        if vectors is None:
+            return np.empty((0, 0), dtype=np.float32)
+        return vectors
+
+    def clear(self):
+        """Remove the checkpoints once the finished index has been saved"""
+        shutil.rmtree(self.checkpoint_dir, ignore_errors=True)
+
+
+def content_hashes(texts: Sequence[str]) -> np.ndarray:
+    """Fixed-width content hash of each rendered document text"""
+    return np.array(
+        [hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest() for text in texts],
+        dtype='U32'
+    )
+
+
+def plan_incremental_update(old_keys: np.ndarray, old_hashes: np.ndarray,
+                            keys: np.ndarray, hashes: np.ndarray):
+    """Match new rows to indexed rows by (university_course_id, content hash).
+
+    Returns ``reuse`` (for each new row the old row whose vector can be kept,
+    or -1 if it must be embedded) and a dict of added/changed/removed/unchanged
+    counts.
+    """
+    old_rows = {
+        (key, content_hash): row
+        for row, (key, content_hash) in enumerate(zip(old_keys.tolist(), old_hashes.tolist()))
+    }
+    reuse = np.fromiter(
+        (old_rows.pop((key, content_hash), -1) for key, content_hash in zip(keys.tolist(), hashes.tolist())),
+        dtype=np.int64, count=len(keys)
+    )
+
+    old_key_set = set(old_keys.tolist())
+    new_key_set = set(keys.tolist())
+    embed = reuse < 0
+    added = int(sum(1 for key in keys[embed].tolist() if key not in old_key_set))
+    stats = {
+        'added': added,
+        'changed': int(embed.sum()) - added,
+        'removed': len(old_key_set - new_key_set),
+        'unchanged': int((~embed).sum()),
+    }
+    return reuse, stats
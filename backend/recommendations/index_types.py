@@ -0,0 +1,187 @@
+import logging
+import math
+import threading
+from typing import Any, Dict, Optional
+
+import faiss
+import numpy as np
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+INDEX_TYPES = ('flat', 'ivf', 'hnsw', 'ivfpq')
+
+# Index types that store compressed vectors: reconstructing a row gives an approximation
+LOSSY_INDEX_TYPES = ('ivfpq',)
+
+# Parameters that only change how an index is searched; everything else requires a rebuild
+SEARCH_PARAMETERS = ('nprobe', 'ef_search')
+
+# An approximate (IVF/HNSW) index only visits part of its vectors per search, so a filtered search
+# sees only that part of the allowed rows. Up to this many allowed rows are compared with the query
+# one by one instead; larger allowed sets widen nprobe / efSearch by how selective the filter is.
+EXACT_SEARCH_LIMIT = 4096
+
+
+def index_config_from_settings() -> Dict[str, Any]:
+    """The FAISS index type and parameters configured in settings"""
+    index_type = settings.FAISS_INDEX_TYPE
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown FAISS_INDEX_TYPE: {index_type!r} (expected one of {', '.join(INDEX_TYPES)})")
+
+    config = {'type': index_type}
+    if index_type in ('ivf', 'ivfpq'):
+        config['nlist'] = settings.FAISS_IVF_NLIST
+        config['nprobe'] = settings.FAISS_IVF_NPROBE
+    if index_type == 'ivfpq':
+        config['pq_m'] = settings.FAISS_PQ_M
+        config['pq_nbits'] = settings.FAISS_PQ_NBITS
+    if index_type == 'hnsw':
+        config['hnsw_m'] = settings.FAISS_HNSW_M
+        config['ef_construction'] = settings.FAISS_HNSW_EF_CONSTRUCTION
+        config['ef_search'] = settings.FAISS_HNSW_EF_SEARCH
+    return config
+
+
+def build_parameters(config: Dict[str, Any]) -> Dict[str, Any]:
+    """The part of a config that is baked into the index at build time"""
+    return {key: value for key, value in config.items() if key not in SEARCH_PARAMETERS}
+
+
+def _nlist_for(rows: int, requested: int) -> int:
+    # Rule of thumb: about 4*sqrt(n) lists, with at least ~39 training points per list
+    nlist = requested or int(4 * math.sqrt(rows))
+    return max(1, min(nlist, rows // 39))
+
+
+def _pq_m_for(dimension: int, requested: int) -> int:
+    # Sub-quantizers must divide the vector dimension
+    return max(m for m in range(1, min(requested, dimension) + 1) if dimension % m == 0)
+
+
+def build_index(vectors: np.ndarray, config: Dict[str, Any]) -> faiss.Index:
+    """Create, train and fill an index of the configured type.
+
+    ``config`` is updated with the values actually used (e.g. the effective
+    nlist) so they can be recorded in the cache manifest.
+    """
+    rows, dimension = vectors.shape
+    index_type = config['type']
+
+    if index_type in ('ivf', 'ivfpq'):
+        nbits = config.get('pq_nbits', 8)
+        minimum_rows = 39 * (2 ** nbits) if index_type == 'ivfpq' else 39
+        if rows < minimum_rows:
+            logger.warning(f"⚠️ {rows} rows are too few to train a {index_type} index, using a flat index")
+            index_type = 'flat'
+            config.clear()
+            config['type'] = 'flat'
+
+    if index_type == 'flat':
+        index = faiss.IndexFlatL2(dimension)
+    elif index_type == 'hnsw':
+        index = faiss.IndexHNSWFlat(dimension, config['hnsw_m'])
+        index.hnsw.efConstruction = config['ef_construction']
+        index.hnsw.efSearch = config['ef_search']
+    else:
+        config['nlist'] = _nlist_for(rows, config.get('nlist', 0))
+        quantizer = faiss.IndexFlatL2(dimension)
+        if index_type == 'ivf':
+            index = faiss.IndexIVFFlat(quantizer, dimension, config['nlist'])
+        else:
+            config['pq_m'] = _pq_m_for(dimension, config['pq_m'])
+            index = faiss.IndexIVFPQ(quantizer, dimension, config['nlist'], config['pq_m'], config['pq_nbits'])
+        index.train(vectors)
+        index.nprobe = config['nprobe']
+
+    index.add(vectors)
+    return prepare_reconstruction(index)
+
+
+def apply_search_parameters(index: faiss.Index, config: Dict[str, Any]):
+    """Set the configured nprobe / efSearch on a loaded index"""
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None and 'nprobe' in config:
+        ivf.nprobe = config['nprobe']
+    if isinstance(index, faiss.IndexHNSW) and 'ef_search' in config:
+        index.hnsw.efSearch = config['ef_search']
+
+
+def is_approximate(index: faiss.Index) -> bool:
+    return faiss.try_extract_index_ivf(index) is not None or isinstance(index, faiss.IndexHNSW)
+
+
+def search_parameters(index: faiss.Index, selector=None, selectivity: float = 1.0) -> Optional[faiss.SearchParameters]:
+    """SearchParameters carrying an ID selector plus the index's nprobe / efSearch.
+
+    ``selectivity`` is the fraction of rows the selector allows; the index
+    visits proportionally more lists / graph nodes so a filtered search
+    still meets about as many allowed rows as an unfiltered one meets rows.
+    """
+    if selector is None:
+        return None
+    widen = 1 / max(selectivity, 1e-9)
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        return faiss.SearchParametersIVF(sel=selector, nprobe=min(ivf.nlist, math.ceil(ivf.nprobe * widen)))
+    if isinstance(index, faiss.IndexHNSW):
+        ef_search = min(max(index.ntotal, 1), math.ceil(index.hnsw.efSearch * widen))
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=ef_search)
+    return faiss.SearchParameters(sel=selector)
+
+
+def exact_search(index: faiss.Index, query_vectors: np.ndarray, row_ids: np.ndarray, k: int):
+    """Exact L2 search restricted to ``row_ids``, over their stored vectors; returns (distances, labels) like Index.search"""
+    row_ids = np.asarray(row_ids, dtype=np.int64)
+    k = min(k, len(row_ids))
+    if k == 0:
+        return np.empty((len(query_vectors), 0), dtype=np.float32), np.empty((len(query_vectors), 0), dtype=np.int64)
+    vectors = reconstruct_rows(index, row_ids)
+    distances = (
+        (query_vectors ** 2).sum(axis=1)[:, None]
+        - 2 * query_vectors @ vectors.T
+        + (vectors ** 2).sum(axis=1)[None, :]
+    )
+    np.maximum(distances, 0, out=distances)
+    order = np.argsort(distances, axis=1, kind='stable')[:, :k]
+    return np.take_along_axis(distances, order, axis=1).astype(np.float32), row_ids[order]
+
+
+_direct_map_lock = threading.Lock()
+
+
+def prepare_reconstruction(index: faiss.Index) -> faiss.Index:
+    """Build the row id -> list position map an IVF index needs for ``reconstruct_rows``.
+
+    Done whenever an index is built or read, so the map is written once by
+    the process that loads the index (before a pre-forking server starts its
+    workers) and never by concurrent requests.
+    """
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None and ivf.direct_map.type == faiss.DirectMap.NoMap:
+        ivf.make_direct_map()
+    return index
+
+
+def reconstruct_rows(index: faiss.Index, row_ids: np.ndarray) -> np.ndarray:
+    """Stored vectors for ``row_ids`` (approximate for product-quantized indexes)"""
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None and ivf.direct_map.type == faiss.DirectMap.NoMap:
+        # Only indexes that did not come from build_index / read_index get here
+        with _direct_map_lock:
+            prepare_reconstruction(index)
+    return index.reconstruct_batch(np.asarray(row_ids, dtype=np.int64))
+
+
+def read_index(path: str, mmap: bool = True) -> faiss.Index:
+    """Read a saved index; with ``mmap`` its vectors (flat/HNSW storage, IVF lists) are mapped
+    read-only from the file instead of copied, so worker processes share the page cache"""
+    if not mmap:
+        return prepare_reconstruction(faiss.read_index(path))
+    # IO_FLAG_MMAP_IFC covers every index type used here; adding IO_FLAG_MMAP breaks IVF loading
+    return prepare_reconstruction(faiss.read_index(path, faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY))
+
+
+def write_index(index: faiss.Index, path: str):
+    faiss.write_index(index, path)
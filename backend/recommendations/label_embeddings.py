@@ -0,0 +1,137 @@
+import logging
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .catalog import CourseCatalog
+from .embedding_cache import canonicalize_query
+
+logger = logging.getLogger(__name__)
+
+
+LABEL_EMBEDDINGS_FILE = 'label_embeddings.npz'
+
+# (kind, preference key, query template, catalog columns supplying the labels).
+# Templates match the parts written by _create_query_from_preferences, so a
+# stored vector is the embedding of exactly the text a live query would contain.
+LABEL_KINDS = (
+    ('program', 'desired_program', 'Program: {}', ('parent_course',)),
+    ('level', 'program_level', 'Level: {}', ('program_level', 'program_type')),
+    ('degree', 'program_type', 'Degree: {}', ('program_type',)),
+    ('country', 'preferred_countries', 'Countries: {}', ('country',)),
+    ('location', 'preferred_locations', 'Locations: {}', ('location',)),
+    ('university_type', 'university_types', 'University Types: {}', ('university_type',)),
+)
+
+
+class LabelEmbeddingTable:
+    """Query-side embeddings of every distinct label in the catalog.
+
+    Built once per index version and stored with it. A structured preference set (no free
+    text) is answered by composing the stored vectors of its parts instead of
+    making a live embedding request. Labels are looked up in the canonical
+    form of the query embedding cache, so a preference matches whatever
+    spelling a live query would be cached under.
+    """
+
+    def __init__(self, model_name: str, build_id: str, kinds: np.ndarray, labels: np.ndarray, vectors: np.ndarray):
+        self.model_name = model_name
+        self.build_id = build_id
+        self.kinds = kinds
+        self.labels = labels
+        self.vectors = vectors
+        self._rows = {}
+        for row, (kind, label) in enumerate(zip(kinds, labels)):
+            self._rows.setdefault((str(kind), canonicalize_query(str(label))), row)
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    @staticmethod
+    def _labels(catalog: CourseCatalog) -> List[Tuple[str, str]]:
+        entries = []
+        for kind, _, _, keys in LABEL_KINDS:
+            values = set()
+            for key in keys:
+                column = catalog.column(key)
+                if column.is_string:
+                    values.update(category for category in column.categories if category)
+            # Spellings differing only in case or spacing share one embedding
+            canonical = {}
+            for value in sorted(values):
+                canonical.setdefault(canonicalize_query(value), value)
+            entries.extend((kind, value) for value in canonical.values())
+        return entries
+
+    @classmethod
+    def build(cls, catalog: CourseCatalog, embeddings, model_name: str, build_id: str) -> 'LabelEmbeddingTable':
+        """Embed every label of the catalog of index version ``build_id`` with ``embeddings.embed_queries`` in one batched pass"""
+        templates = {kind: template for kind, _, template, _ in LABEL_KINDS}
+        entries = cls._labels(catalog)
+        texts = [templates[kind].format(label) for kind, label in entries]
+        vectors = embeddings.embed_queries(texts).astype(np.float32)
+        kinds = np.array([kind for kind, _ in entries], dtype=str)
+        labels = np.array([label for _, label in entries], dtype=str)
+        return cls(model_name, build_id, kinds, labels, vectors)
+
+    def save(self, directory: str):
+        # Workers may build the table concurrently: each writes its own file and renames it into place
+        path = os.path.join(directory, LABEL_EMBEDDINGS_FILE)
+        temp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(
+            temp_path,
+            model_name=np.array(self.model_name),
+            build_id=np.array(self.build_id),
+            kinds=np.asarray(self.kinds, dtype=str),
+            labels=np.asarray(self.labels, dtype=str),
+            vectors=self.vectors,
+        )
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, directory: str, model_name: str, build_id: str) -> Optional['LabelEmbeddingTable']:
+        """Load a saved table, or None if it is missing or was built with another model or for another index version"""
+        path = os.path.join(directory, LABEL_EMBEDDINGS_FILE)
+        if not os.path.exists(path):
+            return None
+        with np.load(path, allow_pickle=False) as data:
+            if str(data['model_name']) != model_name:
+                logger.warning(f"⚠️ Ignoring label embeddings built with {data['model_name']}")
+                return None
+            if 'build_id' not in data or str(data['build_id']) != build_id:
+                logger.warning("⚠️ Ignoring label embeddings built for another index version")
+                return None
+            return cls(model_name, build_id, data['kinds'], data['labels'], data['vectors'])
+
+    def vector(self, kind: str, label: str) -> Optional[np.ndarray]:
+        row = self._rows.get((kind, canonicalize_query(label)))
+        return None if row is None else self.vectors[row]
+
+    def compose(self, preferences: Dict[str, Any]) -> Optional[np.ndarray]:
+        """Query vector for a structured preference set, or None if it needs a live embedding"""
+        if preferences.get('additional_preferences'):
+            return None
+
+        parts = []
+        for kind, key, _, _ in LABEL_KINDS:
+            value = preferences.get(key)
+            if not value:
+                continue
+            values = value if isinstance(value, (list, tuple)) else [value]
+            vectors = [self.vector(kind, str(item)) for item in values]
+            if not vectors or any(vector is None for vector in vectors):
+                return None
+            # A list of values is written as one query part; represent it by its mean
+            parts.append(np.mean(vectors, axis=0))
+
+        if not parts:
+            return None
+
+        composed = np.sum(parts, axis=0)
+        norm = np.linalg.norm(composed)
+        if norm == 0:
+            return None
+        # Keep the composed vector on the same scale as a single query embedding
+        target_norm = np.mean([np.linalg.norm(part) for part in parts])
+        return (composed * (target_norm / norm)).astype(np.float32)
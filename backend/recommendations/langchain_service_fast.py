@@ -1,137 +1,477 @@
+import asyncio
+import functools
+import hashlib
 import json
-import pandas as pd
 import numpy as np
 import time
-from typing import List, Dict, Any, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Callable, Optional, Sequence, Tuple
 from django.conf import settings
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
 from langchain_community.vectorstores import FAISS
-from langchain.schema import Document
+from langchain_community.docstore.in_memory import InMemoryDocstore
+import glob
 import logging
 import os
+import shutil
+import tempfile
+import uuid
+
+from .catalog import CATALOG_FILE, CourseCatalog
+from .diversity import cap_per_group, diversity_mode_from_settings, mmr_order
+from .documents import DocumentTexts, iter_records, missing_field_report
+from .embedding_cache import CachedQueryEmbeddings, QueryEmbeddingCache
+from .embeddings import get_embedding_backend
+from .facets import FacetSnapshot
+from .filters import AllowedRows, ConstraintIndex
+from .index_build import IndexBuilder, content_hashes, plan_incremental_update
+from .index_types import (
+    EXACT_SEARCH_LIMIT, LOSSY_INDEX_TYPES, apply_search_parameters, build_index, build_parameters, exact_search,
+    index_config_from_settings, is_approximate, read_index, reconstruct_rows, search_parameters, write_index,
+)
+from .label_embeddings import LabelEmbeddingTable
+from .lexical import LexicalIndex, lexical_query, reciprocal_rank_fusion
+from .result_cache import RecommendationCache, normalize_preferences, result_key
+from .scoring import has_match_criteria, score_candidates, top_k_indices
+from .singleflight import ProcessLocks, SingleFlight, file_lock
+from .typeahead import TYPEAHEAD_FIELDS, TypeaheadIndex
+from .universities import COURSE_KEYS, UNIVERSITY_KEYS, UniversityIndex
 
 logger = logging.getLogger(__name__)
 
+# Held (in BASE_DIR) while a process builds, refreshes or saves the vector store cache
+CACHE_LOCK_FILE = 'vector_store_cache.lock'
+# Every saved index version is a directory of its own in VERSIONS_DIR (inside the cache directory);
+# CURRENT_VERSION_FILE names the one to load and is replaced in one step when a new version is saved
+VERSIONS_DIR = 'versions'
+CURRENT_VERSION_FILE = 'CURRENT'
+# Prefix of the directories a version is written to before it is renamed into place
+STAGING_PREFIX = '.staging-'
+# Float vectors stored next to an index whose own vectors are compressed, for refreshes
+VECTORS_FILE = 'vectors.npy'
+
+
+def current_version_path(cache_path: str) -> Optional[str]:
+    """Directory of the index version in use, or None if no cache was saved.
+    
+    Caches from before versioned directories keep their files in the cache
+    directory itself, which then is the version.
+    """
+    try:
+        with open(os.path.join(cache_path, CURRENT_VERSION_FILE), 'r') as f:
+            return os.path.join(cache_path, VERSIONS_DIR, f.read().strip())
+    except FileNotFoundError:
+        if os.path.exists(os.path.join(cache_path, 'index.faiss')):
+            return cache_path
+        return None
+
 
 class UniversityRecommendationService:
     """Service for intelligent university recommendations using LangChain with Gemini - FAST VERSION"""
     
-    def __init__(self):
+    def __init__(self, progress: Optional[Callable[[str, int, int], None]] = None):
+        """``progress(stage, done, total)`` is called as initialization moves through its stages"""
         start_time = time.time()
         logger.info("🚀 Initializing UniversityRecommendationService (Fast Version)...")
+        self._progress = progress or (lambda stage, done=0, total=0: None)
         
-        self.embeddings = GoogleGenerativeAIEmbeddings(
-            model="models/embedding-001",
-            google_api_key=settings.GEMINI_API_KEY
+        base_embeddings, self.embedding_model = get_embedding_backend()
+        self.index_config = index_config_from_settings()
+        self.diversity = diversity_mode_from_settings()
+        self.query_cache = QueryEmbeddingCache(
+            self.embedding_model,
+            path=settings.QUERY_EMBEDDING_CACHE_PATH,
+            memory_size=settings.QUERY_EMBEDDING_CACHE_MEMORY_SIZE,
+            disk_size=settings.QUERY_EMBEDDING_CACHE_DISK_SIZE,
+        )
+        self.embeddings = CachedQueryEmbeddings(base_embeddings, self.query_cache)
+        # CPU-bound work of async requests (FAISS search, scoring) runs here, never on the event loop
+        self.executor = ThreadPoolExecutor(
+            max_workers=settings.RECOMMENDATION_EXECUTOR_WORKERS, thread_name_prefix='recommendations'
         )
         self.vector_store = None
-        self.university_data = None
+        self.catalog = None
+        self.constraints = None
+        self.universities = None
+        self.label_embeddings = None
+        self.lexical = None
+        self.facets = None
+        self.typeahead = {}
+        self.result_cache = None
+        self.single_flight = SingleFlight() if settings.RECOMMENDATION_SINGLE_FLIGHT else None
+        self.process_locks = None
+        # Identifies the index results come from; replaced by the build id of a saved cache
+        self.index_version = uuid.uuid4().hex
+        # Directory of the loaded or saved index version (None if the cache could not be saved)
+        self.version_path = None
         
-        # Check for cached vector store
-        cache_path = os.path.join(settings.BASE_DIR, 'vector_store_cache')
-        if os.path.exists(cache_path):
-            try:
-                logger.info("📦 Loading cached vector store...")
-                cache_start = time.time()
-                self.vector_store = FAISS.load_local(cache_path, self.embeddings, allow_dangerous_deserialization=True)
-                self._load_data_minimal()  # Load only metadata
-                cache_duration = time.time() - cache_start
-                logger.info(f"✅ Loaded cached vector store successfully in {cache_duration:.2f}s")
-                return
-            except Exception as e:
-                logger.warning(f"❌ Failed to load cached vector store: {e}")
+        try:
+            # Check for cached vector store
+            cache_path = os.path.join(settings.BASE_DIR, 'vector_store_cache')
+            if not self._load_cache(cache_path, refresh=False):
+                # One process at a time builds or refreshes the cache (and its checkpoints); a process
+                # that waited for the lock loads what the previous holder wrote
+                with file_lock(os.path.join(settings.BASE_DIR, CACHE_LOCK_FILE)):
+                    if not self._load_cache(cache_path, refresh=True):
+                        self._build_cache(cache_path)
+            
+            self._progress('preparing_indexes')
+            self._prepare_label_embeddings()
+            self._prepare_lexical_index()
+            self._prepare_facets()
+            self._prepare_typeahead()
+            self._prepare_result_cache()
+        except BaseException:
+            # The loader retries with a new service: a failed one must not keep its threads and connections
+            self.close()
+            raise
         
+        init_duration = time.time() - start_time
+        logger.info(f"✅ Service initialized in {init_duration:.2f}s")
+    
+    def close(self):
+        """Release the executor threads and query cache connections"""
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.query_cache.close()
+    
+    def _load_cache(self, cache_path: str, refresh: bool) -> bool:
+        """Load the cached vector store; False if there is none, it is unusable, or out of date and not to be refreshed here.
+        
+        Every file is read from the directory of one version, which is never
+        modified once saved, so a load needs no lock.
+        """
+        version_path = current_version_path(cache_path)
+        if version_path is None:
+            return False
+        try:
+            logger.info("📦 Loading cached vector store...")
+            self._progress('loading_cache')
+            cache_start = time.time()
+            manifest = self._read_manifest(version_path)
+            if manifest['embedding_model'] != self.embedding_model:
+                raise ValueError(
+                    f"cache was built with {manifest['embedding_model']}, configured backend is {self.embedding_model}"
+                )
+            self.index_version = self._index_version(manifest)
+            self.vector_store = self._load_vector_store(version_path)
+            self._load_data_minimal(version_path)  # Load only metadata
+            apply_search_parameters(self.vector_store.index, self.index_config)
+            self.version_path = version_path
+            if self._cache_is_stale(manifest):
+                if not refresh:
+                    logger.info("🔄 Cached vector store is out of date")
+                    return False
+                # Re-embed only the courses that were added or changed since the cache was built
+                self._refresh_index(cache_path, version_path, manifest)
+            cache_duration = time.time() - cache_start
+            logger.info(f"✅ Loaded cached vector store successfully in {cache_duration:.2f}s")
+            return True
+        except Exception as e:
+            logger.warning(f"❌ Failed to load cached vector store: {e}")
+            return False
+    
+    def _build_cache(self, cache_path: str):
+        """Embed the whole dataset and save it as a new cache"""
         logger.info("🔄 No cache found. Creating vector store from scratch...")
+        self._progress('building_index')
+        # Nothing of a cache that failed to load describes the index built here
+        self.index_version = uuid.uuid4().hex
+        self.version_path = None
         # Load fresh data if no cache
-        self._load_data()
+        texts, vectors = self._load_data()
         
         # Save cache for future use
         try:
-            os.makedirs(cache_path, exist_ok=True)
-            self.vector_store.save_local(cache_path)
+            self._save_cache(cache_path, texts, version=1, vectors=vectors)
+            self._index_builder().clear()
             logger.info("✅ Saved vector store cache for future use")
         except Exception as e:
             logger.warning(f"❌ Failed to save vector store cache: {e}")
+    
+    def _read_manifest(self, version_path: str) -> Dict[str, Any]:
+        """Read the cache manifest; caches written before it existed were built with Gemini"""
+        manifest_path = os.path.join(version_path, 'manifest.json')
+        if not os.path.exists(manifest_path):
+            return {'embedding_model': 'models/embedding-001'}
+        with open(manifest_path, 'r') as f:
+            return json.load(f)
+    
+    def _index_version(self, manifest: Dict[str, Any]) -> str:
+        """Build id of a cached index; manifests from before build ids are identified by their content"""
+        if manifest.get('build_id'):
+            return manifest['build_id']
+        return hashlib.sha256(json.dumps(manifest, sort_keys=True).encode('utf-8')).hexdigest()[:32]
+    
+    def _load_vector_store(self, version_path: str) -> FAISS:
+        """Open the cached index (memory-mapped when FAISS_MMAP is on).
         
-        init_duration = time.time() - start_time
-        logger.info(f"✅ Service initialized in {init_duration:.2f}s")
+        Search goes straight to the index and the catalog, so the store has
+        an empty docstore and nothing is unpickled.
+        """
+        index = read_index(os.path.join(version_path, 'index.faiss'), mmap=settings.FAISS_MMAP)
+        return FAISS(self.embeddings, index, InMemoryDocstore({}), {})
+    
+    def _dataset_fingerprint(self) -> str:
+        digest = hashlib.sha256()
+        with open(settings.UNIVERSITY_DATASET_PATH, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+    
+    def _dataset_stat(self) -> Dict[str, int]:
+        stat = os.stat(settings.UNIVERSITY_DATASET_PATH)
+        return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    
+    def _cache_is_stale(self, manifest: Dict[str, Any]) -> bool:
+        """Whether the dataset changed since the cached index was built"""
+        if self.vector_store.index.ntotal != len(self.catalog):
+            return True
+        # A different index type or build parameter needs a rebuild (from the stored vectors)
+        requested = manifest.get('index_requested', {'type': 'flat'})
+        if requested != build_parameters(index_config_from_settings()):
+            return True
+        # Caches written before fingerprints were recorded are trusted when the row count matches
+        fingerprint = manifest.get('dataset_fingerprint')
+        if fingerprint is not None and manifest.get('dataset_stat') == self._dataset_stat():
+            # Same size and modification time as when it was hashed: skip re-reading the file
+            return False
+        return fingerprint is not None and fingerprint != self._dataset_fingerprint()
+    
+    def _row_keys(self) -> np.ndarray:
+        course_ids = self.catalog.column('course_id')
+        return np.array([str(course_ids.get(row_id)) for row_id in range(len(self.catalog))], dtype=str)
+    
+    def _save_cache(self, cache_path: str, texts: Sequence[str], version: int, vectors: Optional[np.ndarray] = None):
+        """Write a complete index version to a directory of its own and make it the current one.
+        
+        The version is written to a staging directory, renamed into place and
+        then published by replacing the CURRENT file, so a reader loads every
+        file of one version or of the other, never a mix. The previous version
+        stays on disk for processes still loading it; older ones are removed.
+        ``vectors`` (the exact vectors of the index) are kept with an index
+        that stores them compressed. Callers hold the cache lock.
+        """
+        versions_path = os.path.join(cache_path, VERSIONS_DIR)
+        os.makedirs(versions_path, exist_ok=True)
+        # Staging directories left behind by a process that died while saving
+        for path in glob.glob(os.path.join(versions_path, STAGING_PREFIX + '*')):
+            shutil.rmtree(path, ignore_errors=True)
+        
+        build_id = uuid.uuid4().hex
+        manifest = {
+            'version': version,
+            'build_id': build_id,
+            'embedding_model': self.embedding_model,
+            'rows': len(self.catalog),
+            'dimension': self.vector_store.index.d,
+            'dataset_fingerprint': self._dataset_fingerprint(),
+            'dataset_stat': self._dataset_stat(),
+            'index_requested': build_parameters(index_config_from_settings()),
+            'index': self.index_config,
+        }
+        staging_path = tempfile.mkdtemp(prefix=STAGING_PREFIX, dir=versions_path)
+        version_path = os.path.join(versions_path, build_id)
+        try:
+            write_index(self.vector_store.index, os.path.join(staging_path, 'index.faiss'))
+            self.catalog.save(os.path.join(staging_path, CATALOG_FILE))
+            LexicalIndex.build(self.catalog).save(staging_path)
+            np.savez(
+                os.path.join(staging_path, 'row_hashes.npz'),
+                keys=self._row_keys(),
+                hashes=content_hashes(texts),
+            )
+            if vectors is not None and self.index_config['type'] in LOSSY_INDEX_TYPES:
+                np.save(os.path.join(staging_path, VECTORS_FILE), np.asarray(vectors, dtype=np.float32))
+            with open(os.path.join(staging_path, 'manifest.json'), 'w') as f:
+                json.dump(manifest, f, indent=2)
+            # mkdtemp creates the directory readable by its owner only
+            os.chmod(staging_path, 0o755)
+            os.rename(staging_path, version_path)
+        finally:
+            shutil.rmtree(staging_path, ignore_errors=True)
+        
+        previous_path = current_version_path(cache_path)
+        pointer_tmp = os.path.join(cache_path, f"{CURRENT_VERSION_FILE}.tmp")
+        with open(pointer_tmp, 'w') as f:
+            f.write(build_id)
+        os.replace(pointer_tmp, os.path.join(cache_path, CURRENT_VERSION_FILE))
+        self._remove_old_versions(cache_path, keep={version_path, previous_path})
+        
+        # Results of the previous index are keyed by its version and can no longer be served;
+        # they are left to expire rather than cleared, since the cache alias may be shared
+        self.index_version = build_id
+        self.version_path = version_path
+    
+    def _remove_old_versions(self, cache_path: str, keep: set):
+        """Delete saved versions other than ``keep``, and the files of a cache from before versioned directories"""
+        versions_path = os.path.join(cache_path, VERSIONS_DIR)
+        for name in os.listdir(versions_path):
+            path = os.path.join(versions_path, name)
+            if path not in keep and not name.startswith(STAGING_PREFIX):
+                shutil.rmtree(path, ignore_errors=True)
+        if cache_path not in keep:
+            for name in os.listdir(cache_path):
+                path = os.path.join(cache_path, name)
+                if name not in (VERSIONS_DIR, CURRENT_VERSION_FILE) and os.path.isfile(path):
+                    os.remove(path)
+    
+    def _stored_vectors(self, version_path: str, manifest: Dict[str, Any], row_ids: np.ndarray) -> np.ndarray:
+        """Exact vectors of rows of a saved version, for a refresh that keeps them"""
+        vectors_path = os.path.join(version_path, VECTORS_FILE)
+        if os.path.exists(vectors_path):
+            return np.load(vectors_path, mmap_mode='r')[row_ids]
+        if manifest.get('index', {}).get('type') in LOSSY_INDEX_TYPES:
+            # Reconstructing would re-quantize approximations, drifting further with every refresh
+            raise ValueError("cached index stores compressed vectors only, a full rebuild is required")
+        return reconstruct_rows(self.vector_store.index, row_ids)
+    
+    def _refresh_index(self, cache_path: str, version_path: str, manifest: Dict[str, Any]):
+        """Bring a cached index up to date with the dataset, embedding only added or changed rows"""
+        refresh_start = time.time()
+        hashes_path = os.path.join(version_path, 'row_hashes.npz')
+        if not os.path.exists(hashes_path):
+            raise ValueError("cached index has no row hashes, a full rebuild is required")
+        with np.load(hashes_path, allow_pickle=False) as data:
+            old_keys, old_hashes = data['keys'], data['hashes']
+        
+        self.catalog = CourseCatalog.from_records(iter_records(settings.UNIVERSITY_DATASET_PATH))
+        self.constraints = ConstraintIndex(self.catalog)
+        self.universities = UniversityIndex(self.catalog)
+        self._log_missing_fields()
+        texts = DocumentTexts(self.catalog)
+        reuse, stats = plan_incremental_update(old_keys, old_hashes, self._row_keys(), content_hashes(texts))
+        logger.info(
+            f"🔄 Refreshing index: {stats['added']} added, {stats['changed']} changed, "
+            f"{stats['removed']} removed, {stats['unchanged']} unchanged"
+        )
+        
+        vectors = np.empty((len(texts), self.vector_store.index.d), dtype=np.float32)
+        kept = np.flatnonzero(reuse >= 0)
+        if len(kept):
+            vectors[kept] = self._stored_vectors(version_path, manifest, reuse[kept])
+        embed = np.flatnonzero(reuse < 0)
+        if len(embed):
+            vectors[embed] = self._index_builder().build(DocumentTexts(self.catalog, embed))
+        
+        self.vector_store = self._create_vector_store(vectors)
+        version = manifest.get('version', 0) + 1
+        # The new version directory starts without label embeddings; they are built for its catalog
+        self._save_cache(cache_path, texts, version, vectors=vectors)
+        self._index_builder().clear()
+        logger.info(f"✅ Wrote index version {version} in {time.time() - refresh_start:.2f}s")
+    
+    def _prepare_label_embeddings(self):
+        """Load the label embedding table stored with this index version, building it if missing"""
+        if not settings.LABEL_EMBEDDINGS_ENABLED:
+            return
+        try:
+            if self.version_path is not None:
+                self.label_embeddings = LabelEmbeddingTable.load(
+                    self.version_path, self.embedding_model, self.index_version
+                )
+            if self.label_embeddings is None:
+                label_start = time.time()
+                self.label_embeddings = LabelEmbeddingTable.build(
+                    self.catalog, self.embeddings, self.embedding_model, self.index_version
+                )
+                if self.version_path is not None:
+                    self.label_embeddings.save(self.version_path)
+                logger.info(f"✅ Embedded {len(self.label_embeddings)} catalog labels in {time.time() - label_start:.2f}s")
+        except Exception as e:
+            logger.warning(f"❌ Label embeddings unavailable, every query will be embedded live: {e}")
+            self.label_embeddings = None
+    
+    def _prepare_lexical_index(self):
+        """Load the BM25 index written with the vector index, building it for older caches"""
+        if not settings.LEXICAL_RETRIEVAL_ENABLED:
+            return
+        try:
+            if self.version_path is not None:
+                self.lexical = LexicalIndex.load(self.version_path, len(self.catalog))
+            if self.lexical is None:
+                self.lexical = LexicalIndex.build(self.catalog)
+                if self.version_path is not None:
+                    self.lexical.save(self.version_path)
+            logger.info(f"✅ Lexical index ready with {len(self.lexical)} terms")
+        except Exception as e:
+            logger.warning(f"❌ Lexical index unavailable, using vector search only: {e}")
+            self.lexical = None
+    
+    def _prepare_facets(self):
+        """Count every facet once for this catalog and pre-serialize the options response"""
+        self.facets = FacetSnapshot.build(self.catalog, {
+            'previous_degrees': self.get_available_previous_degrees(),
+            'previous_courses': self.get_available_previous_courses(),
+        })
+        sizes = ', '.join(f"{count} {facet}" for facet, count in self.facets.sizes().items())
+        logger.info(f"✅ Facets ready: {sizes}")
+    
+    def _prepare_typeahead(self):
+        """Build the prefix indexes behind typeahead, ranked by the same counts as the option lists"""
+        self.typeahead = {
+            field: TypeaheadIndex(self.facets.counts[field])
+            for field in TYPEAHEAD_FIELDS
+        }
+    
+    def _prepare_result_cache(self):
+        """Cache results for this index version in the shared 'recommendations' cache"""
+        if settings.RECOMMENDATION_CACHE_ENABLED:
+            self.result_cache = RecommendationCache(self.index_version)
+            # Other processes get a coalesced request's result through the cache
+            if self.single_flight is not None and settings.RECOMMENDATION_LOCK_DIR:
+                self.process_locks = ProcessLocks.from_directory(settings.RECOMMENDATION_LOCK_DIR)
+    
+    def _index_builder(self) -> IndexBuilder:
+        return IndexBuilder(
+            self.embeddings,
+            self.embedding_model,
+            checkpoint_dir=os.path.join(settings.BASE_DIR, 'vector_store_checkpoint'),
+            batch_size=settings.INDEX_BUILD_BATCH_SIZE,
+            max_workers=settings.INDEX_BUILD_WORKERS,
+            max_retries=settings.INDEX_BUILD_MAX_RETRIES,
+            progress=lambda done, total: self._progress('embedding', done, total),
+        )
+    
+    def _create_vector_store(self, vectors: np.ndarray) -> FAISS:
+        """Wrap precomputed vectors in a LangChain FAISS store; row metadata lives in the catalog"""
+        config = index_config_from_settings()
+        index_start = time.time()
+        index = build_index(vectors, config)
+        self.index_config = config
+        logger.info(f"✅ Built {config['type']} index over {len(vectors)} vectors in {time.time() - index_start:.2f}s")
+        return FAISS(self.embeddings, index, InMemoryDocstore({}), {})
+    
+    def _log_missing_fields(self):
+        """Log one aggregated report per field with missing values, for debugging"""
+        for key, entry in missing_field_report(self.catalog).items():
+            examples = ', '.join(str(name) for name in entry['examples'])
+            logger.warning(f"⚠️ Missing {key} for {entry['count']}/{len(self.catalog)} courses (e.g. {examples})")
     
-    def _load_data(self):
-        """Load and process university data"""
+    def _load_data(self) -> Tuple[DocumentTexts, Optional[np.ndarray]]:
+        """Stream and index the university data.
+        
+        Returns the (lazily rendered) document texts, and the embedded vectors
+        if the index stores them compressed (None otherwise, freed once indexed).
+        """
         start_time = time.time()
         logger.info("📊 Loading university data...")
         
         try:
-            with open(settings.UNIVERSITY_DATASET_PATH, 'r') as f:
-                self.university_data = json.load(f)
-            
-            # Convert to DataFrame for easier processing
-            df = pd.DataFrame(self.university_data)
+            # Records are parsed one at a time straight into the columnar catalog,
+            # which holds the metadata addressed by FAISS row id
+            self.catalog = CourseCatalog.from_records(iter_records(settings.UNIVERSITY_DATASET_PATH))
+            self.constraints = ConstraintIndex(self.catalog)
+            self.universities = UniversityIndex(self.catalog)
+            self._log_missing_fields()
             
-            # Create documents for vector search
-            documents = []
-            for _, row in df.iterrows():
-                # Create a comprehensive text representation of each university course
-                text = f"""
-                University: {row.get('university_name', 'N/A')}
-                Course: {row.get('university_course_name', 'N/A')}
-                Program: {row.get('course_program_label', 'N/A')}
-                Parent Course: {row.get('parent_course_name', 'N/A')}
-                Level: {row.get('program_type', 'N/A')} - {row.get('university_courses_credential', 'N/A')}
-                Location: {row.get('location_name', 'N/A')}, {row.get('country_name', 'N/A')}
-                Global Rank: {row.get('university_global_rank', 'N/A')}
-                Tuition (USD): ${row.get('university_course_tuition_usd', 'N/A')}
-                University Type: {row.get('university_type', 'N/A')}
-                Currency: {row.get('country_currency', 'N/A')}
-                Scholarship Count: {row.get('scholarship_count', 'N/A')}
-                GRE Required: {row.get('is_gre_required', 'N/A')}
-                University Views: {row.get('university_views', 'N/A')}
-                Tuition Affordability: {row.get('tuition_affordability', 'N/A')}
-                University Quality: {row.get('university_quality', 'N/A')}
-                Country Popularity: {row.get('country_popularity', 'N/A')}
-                """
-                
-                metadata = {
-                    'university_id': row.get('university_id'),
-                    'course_id': row.get('university_course_id'),
-                    'university_name': row.get('university_name'),
-                    'university_slug': row.get('university_slug'),
-                    'course_name': row.get('university_course_name'),
-                    'course_program_label': row.get('course_program_label'),
-                    'program_level': row.get('program_level'),
-                    'program_type': row.get('program_type'),
-                    'credential': row.get('university_courses_credential'),
-                    'parent_course': row.get('parent_course_name'),
-                    'location': row.get('location_name'),
-                    'country': row.get('country_name'),
-                    'global_rank': row.get('university_global_rank'),
-                    'tuition_usd': row.get('university_course_tuition_usd'),
-                    'tuition_local': row.get('university_course_tuition_local'),
-                    'university_type': row.get('university_type'),
-                    'currency': row.get('country_currency'),
-                    'is_partner': row.get('is_partner'),
-                    'is_published': row.get('is_published'),
-                    'university_views': row.get('university_views'),
-                    'scholarship_count': row.get('scholarship_count'),
-                    'is_gre_required': row.get('is_gre_required'),
-                    'tuition_affordability': row.get('tuition_affordability'),
-                    'university_quality': row.get('university_quality'),
-                    'country_popularity': row.get('country_popularity'),
-                }
-                
-                # Log any missing critical fields for debugging
-                missing_fields = [key for key, value in metadata.items() if value is None]
-                if missing_fields:
-                    logger.warning(f"Missing fields for university {metadata.get('university_name', 'Unknown')}: {missing_fields}")
-                
-                doc = Document(page_content=text, metadata=metadata)
-                documents.append(doc)
-            
-            # Create vector store
+            # Documents are rendered batch by batch as they are embedded, then indexed
+            texts = DocumentTexts(self.catalog)
             vector_start = time.time()
-            self.vector_store = FAISS.from_documents(documents, self.embeddings)
+            vectors = self._index_builder().build(texts)
+            self.vector_store = self._create_vector_store(vectors)
+            if self.index_config['type'] not in LOSSY_INDEX_TYPES:
+                vectors = None
             vector_duration = time.time() - vector_start
-            logger.info(f"✅ Loaded {len(documents)} university courses into vector store in {vector_duration:.2f}s")
+            logger.info(f"✅ Loaded {len(texts)} university courses into vector store in {vector_duration:.2f}s")
             
         except Exception as e:
             logger.error(f"❌ Error loading university data: {e}")
@@ -139,92 +479,107 @@ class UniversityRecommendationService:
         
         total_duration = time.time() - start_time
         logger.info(f"✅ Data loading completed in {total_duration:.2f}s")
+        return texts, vectors
     
-    def _load_data_minimal(self):
+    def _load_data_minimal(self, version_path: str):
         """Load only essential data for cached vector store"""
         try:
-            with open(settings.UNIVERSITY_DATASET_PATH, 'r') as f:
-                self.university_data = json.load(f)
-            logger.info(f"📊 Loaded {len(self.university_data)} university courses (minimal)")
+            catalog_path = os.path.join(version_path, CATALOG_FILE)
+            if os.path.exists(catalog_path):
+                # Column arrays and string tables are memory-mapped and shared with other workers
+                self.catalog = CourseCatalog.load(catalog_path, mmap=settings.FAISS_MMAP)
+            else:
+                # Cache from before the binary catalog: build it from the dataset once and keep it
+                self.catalog = CourseCatalog.from_records(iter_records(settings.UNIVERSITY_DATASET_PATH))
+                self.catalog.save(catalog_path)
+            self.constraints = ConstraintIndex(self.catalog)
+            self.universities = UniversityIndex(self.catalog)
+            logger.info(f"📊 Loaded {len(self.catalog)} university courses (minimal)")
         except Exception as e:
             logger.error(f"❌ Error loading minimal data: {e}")
             raise
     
-    def get_recommendations(self, user_preferences: Dict[str, Any], top_k: int = 10) -> List[Dict[str, Any]]:
+    def get_recommendations(self, user_preferences: Dict[str, Any], top_k: int = 10,
+                            search_stats: Optional[Dict[str, Any]] = None, group_by_university: bool = False,
+                            courses_per_university: int = 3) -> List[Dict[str, Any]]:
         """
         Get intelligent university recommendations based on user preferences - FAST VERSION
+        
+        ``search_stats``, if given, is filled with how the candidate pool was retrieved
+        (rounds, final pool size, candidates at the target match, stop reason) and
+        whether the result came from the result cache.
+        
+        With ``group_by_university`` the result is the ``top_k`` best universities,
+        each with its ``courses_per_university`` best matching courses nested.
         """
         start_time = time.time()
         logger.info(f"🎯 Getting recommendations for preferences: {user_preferences}")
         
         try:
-            # Create query based on user preferences
-            query_start = time.time()
-            query = self._create_query_from_preferences(user_preferences)
-            query_duration = time.time() - query_start
+            # Results depend only on the normalized preferences, which also key the result cache
+            user_preferences = normalize_preferences(user_preferences)
+            variant = f'universities:{courses_per_university}' if group_by_university else 'courses'
+            if self.result_cache is not None:
+                cached = self.result_cache.get(user_preferences, top_k, variant)
+                if cached is not None:
+                    return self._cached_recommendations(cached, search_stats)
             
-            # Get similar documents from vector store
-            vector_start = time.time()
-            similar_docs = self.vector_store.similarity_search_with_score(
-                query, k=top_k * 2  # Get more candidates for filtering
+            # Identical requests already being computed are waited for rather than repeated
+            key = result_key(self.index_version, user_preferences, top_k, variant)
+            compute = functools.partial(
+                self._compute_recommendations, key, user_preferences, top_k, variant,
+                group_by_university, courses_per_university,
             )
-            vector_duration = time.time() - vector_start
-            logger.info(f"✅ Vector search completed in {vector_duration:.2f}s, found {len(similar_docs)} candidates")
-            
-            # Filter and rank recommendations
-            processing_start = time.time()
-            recommendations = []
+            if self.single_flight is not None:
+                (final_recommendations, stats), coalesced = self.single_flight.do(key, compute)
+            else:
+                (final_recommendations, stats), coalesced = compute(), False
+            if search_stats is not None:
+                search_stats.update(stats, coalesced=coalesced)
+            total_duration = time.time() - start_time
             
-            for i, (doc, score) in enumerate(similar_docs):
-                # Calculate match percentage based on preferences
-                match_start = time.time()
-                match_percentage = self._calculate_match_percentage(doc.metadata, user_preferences)
-                match_duration = time.time() - match_start
-                
-                # Generate fast fallback reasoning (no API calls)
-                reasoning_start = time.time()
-                llm_reasoning = self._generate_fallback_reasoning(doc.metadata, user_preferences, match_percentage)
-                reasoning_duration = time.time() - reasoning_start
-                
-                recommendation = {
-                    'course_id': doc.metadata.get('course_id'),
-                    'university_id': doc.metadata.get('university_id'),
-                    'university_name': doc.metadata.get('university_name'),
-                    'university_slug': doc.metadata.get('university_slug'),
-                    'course_name': doc.metadata.get('course_name'),
-                    'course_program_label': doc.metadata.get('course_program_label'),
-                    'program_level': doc.metadata.get('program_level'),
-                    'program_type': doc.metadata.get('program_type'),
-                    'credential': doc.metadata.get('credential'),
-                    'parent_course': doc.metadata.get('parent_course'),
-                    'location': doc.metadata.get('location'),
-                    'country': doc.metadata.get('country'),
-                    'global_rank': doc.metadata.get('global_rank'),
-                    'tuition_usd': doc.metadata.get('tuition_usd'),
-                    'tuition_local': doc.metadata.get('tuition_local'),
-                    'university_type': doc.metadata.get('university_type'),
-                    'currency': doc.metadata.get('currency'),
-                    'is_partner': doc.metadata.get('is_partner'),
-                    'is_published': doc.metadata.get('is_published'),
-                    'university_views': doc.metadata.get('university_views'),
-                    'scholarship_count': doc.metadata.get('scholarship_count'),
-                    'is_gre_required': doc.metadata.get('is_gre_required'),
-                    'tuition_affordability': doc.metadata.get('tuition_affordability'),
-                    'university_quality': doc.metadata.get('university_quality'),
-                    'country_popularity': doc.metadata.get('country_popularity'),
-                    'similarity_score': float(score),
-                    'match_percentage': match_percentage,
-                    'llm_reasoning': llm_reasoning,
-                    'relevance_score': (match_percentage + (1 - float(score))) / 2
-                }
-                
-                recommendations.append(recommendation)
+            logger.info(f"✅ Generated {len(final_recommendations)} recommendations in {total_duration:.2f}s")
+            return final_recommendations
             
-            # Sort by relevance score and return top_k
-            recommendations.sort(key=lambda x: x['relevance_score'], reverse=True)
-            final_recommendations = recommendations[:top_k]
+        except Exception as e:
+            logger.error(f"❌ Error getting recommendations: {e}")
+            logger.error(f"❌ Error details: {type(e).__name__}")
+            import traceback
+            logger.error(f"❌ Full traceback: {traceback.format_exc()}")
+            return []
+    
+    async def aget_recommendations(self, user_preferences: Dict[str, Any], top_k: int = 10,
+                                   search_stats: Optional[Dict[str, Any]] = None, group_by_university: bool = False,
+                                   courses_per_university: int = 3) -> List[Dict[str, Any]]:
+        """``get_recommendations`` for the async (ASGI) path.
+        
+        The query embedding and the result cache are awaited, and the
+        CPU-bound work (strict filters, FAISS search, scoring, result dicts)
+        runs on the service's bounded executor, so the event loop only holds
+        the request while it waits.
+        """
+        start_time = time.time()
+        logger.info(f"🎯 Getting recommendations for preferences: {user_preferences}")
+        
+        try:
+            user_preferences = normalize_preferences(user_preferences)
+            variant = f'universities:{courses_per_university}' if group_by_university else 'courses'
+            if self.result_cache is not None:
+                cached = await self.result_cache.aget(user_preferences, top_k, variant)
+                if cached is not None:
+                    return self._cached_recommendations(cached, search_stats)
             
-            processing_duration = time.time() - processing_start
+            key = result_key(self.index_version, user_preferences, top_k, variant)
+            compute = functools.partial(
+                self._acompute_recommendations, key, user_preferences, top_k, variant,
+                group_by_university, courses_per_university,
+            )
+            if self.single_flight is not None:
+                (final_recommendations, stats), coalesced = await self.single_flight.ado(key, compute)
+            else:
+                (final_recommendations, stats), coalesced = await compute(), False
+            if search_stats is not None:
+                search_stats.update(stats, coalesced=coalesced)
             total_duration = time.time() - start_time
             
             logger.info(f"✅ Generated {len(final_recommendations)} recommendations in {total_duration:.2f}s")
@@ -237,6 +592,406 @@ class UniversityRecommendationService:
             logger.error(f"❌ Full traceback: {traceback.format_exc()}")
             return []
     
+    def _cached_recommendations(self, cached: Dict[str, Any], search_stats: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        if search_stats is not None:
+            search_stats.update(cached['retrieval'], cached=True, coalesced=False)
+        logger.info(f"⚡ Served {len(cached['recommendations'])} recommendations from the result cache")
+        return cached['recommendations']
+    
+    def _compute_recommendations(self, key: str, preferences: Dict[str, Any], top_k: int, variant: str,
+                                 group_by_university: bool, courses_per_university: int):
+        """Recommendations and retrieval stats for normalized preferences.
+        
+        With process locks, one process computes a result while the others
+        holding the same request wait, then read its result cache entry.
+        """
+        if self.process_locks is None:
+            return self._recommend(preferences, top_k, variant, group_by_university, courses_per_university)
+        with self.process_locks.hold(key):
+            # Counted once, by the lookup before the lock
+            cached = self.result_cache.get(preferences, top_k, variant, count=False)
+            if cached is not None:
+                return self._cached_recommendations(cached, None), dict(cached['retrieval'], cached=True)
+            return self._recommend(preferences, top_k, variant, group_by_university, courses_per_university)
+    
+    async def _acompute_recommendations(self, key: str, preferences: Dict[str, Any], top_k: int, variant: str,
+                                        group_by_university: bool, courses_per_university: int):
+        """``_compute_recommendations`` for the async path"""
+        if self.process_locks is None:
+            return await self._arecommend(preferences, top_k, variant, group_by_university, courses_per_university)
+        lock = await self.process_locks.aacquire(key)
+        try:
+            cached = await self.result_cache.aget(preferences, top_k, variant, count=False)
+            if cached is not None:
+                return self._cached_recommendations(cached, None), dict(cached['retrieval'], cached=True)
+            return await self._arecommend(preferences, top_k, variant, group_by_university, courses_per_university)
+        finally:
+            self.process_locks.release(lock)
+    
+    def _recommend(self, preferences: Dict[str, Any], top_k: int, variant: str,
+                   group_by_university: bool, courses_per_university: int):
+        # Create query based on user preferences
+        query = self._create_query_from_preferences(preferences)
+        
+        # In strict mode only rows satisfying the hard constraints are searched
+        allowed = self._allowed_rows(preferences)
+        if allowed is not None and len(allowed) == 0:
+            recommendations, stats = [], self._no_allowed_rows_stats()
+        else:
+            query_vector = self._query_vector(preferences, query)
+            recommendations, stats = self._rank_candidates(
+                query_vector, preferences, top_k, allowed, group_by_university, courses_per_university
+            )
+        if self.result_cache is not None:
+            self.result_cache.set(preferences, top_k, {'recommendations': recommendations, 'retrieval': stats}, variant)
+        return recommendations, dict(stats, cached=False)
+    
+    async def _arecommend(self, preferences: Dict[str, Any], top_k: int, variant: str,
+                          group_by_university: bool, courses_per_university: int):
+        loop = asyncio.get_running_loop()
+        query = self._create_query_from_preferences(preferences)
+        allowed = await loop.run_in_executor(self.executor, self._allowed_rows, preferences)
+        if allowed is not None and len(allowed) == 0:
+            recommendations, stats = [], self._no_allowed_rows_stats()
+        else:
+            query_vector = await self._aquery_vector(preferences, query)
+            recommendations, stats = await loop.run_in_executor(self.executor, functools.partial(
+                self._rank_candidates, query_vector, preferences, top_k, allowed,
+                group_by_university, courses_per_university,
+            ))
+        if self.result_cache is not None:
+            await self.result_cache.aset(preferences, top_k, {'recommendations': recommendations, 'retrieval': stats}, variant)
+        return recommendations, dict(stats, cached=False)
+    
+    @staticmethod
+    def _no_allowed_rows_stats() -> Dict[str, Any]:
+        """Retrieval stats of a request whose strict filters no course satisfies: nothing was searched"""
+        return {'rounds': 0, 'candidates': 0, 'matched': 0, 'stop_reason': 'no_allowed_rows', 'duration_ms': 0.0}
+    
+    def _rank_candidates(self, query_vector: np.ndarray, preferences: Dict[str, Any], top_k: int,
+                         allowed: Optional[AllowedRows], group_by_university: bool, courses_per_university: int):
+        """Search, score and build the result dicts for one query vector; returns (recommendations, stats)"""
+        # Search the FAISS index directly; row ids address the catalog
+        vector_start = time.time()
+        # Grouped results want enough good candidates to fill every university's course list
+        wanted = top_k * courses_per_university if group_by_university else top_k
+        (candidates,) = self._retrieve_adaptively(query_vector, [preferences], wanted, allowed)
+        stats = candidates[-1]
+        vector_duration = time.time() - vector_start
+        logger.info(
+            f"✅ Vector search completed in {vector_duration:.2f}s, found {stats['candidates']} candidates "
+            f"in {stats['rounds']} round(s) ({stats['stop_reason']})"
+        )
+        
+        if group_by_university:
+            recommendations = self._build_university_recommendations(
+                preferences, top_k, courses_per_university, *candidates[:-1]
+            )
+        else:
+            recommendations = self._build_recommendations(preferences, top_k, *candidates[:-1])
+        return recommendations, stats
+    
+    def get_batch_recommendations(self, preference_sets: List[Dict[str, Any]], top_k: int = 10) -> Dict[str, Any]:
+        """Recommendations for many preference sets at once.
+        
+        Queries that cannot be composed from label vectors are embedded in one
+        batched request, and all sets without strict filters share each
+        multi-row FAISS search. Every item gets its own recommendations and
+        retrieval stats, or an error; timings are per stage, in milliseconds.
+        """
+        start = time.perf_counter()
+        timings = {}
+        results = [None] * len(preference_sets)
+        
+        def failed(positions, error):
+            for position in positions:
+                results[position] = {'error': str(error)}
+        
+        # Queries and strict-filter rows; rows without strict filters are searched together
+        stage_start = time.perf_counter()
+        queries = {}
+        groups = [(None, [])]
+        preference_sets = list(preference_sets)
+        for position, preferences in enumerate(preference_sets):
+            try:
+                if not isinstance(preferences, dict):
+                    raise ValueError("preferences must be an object")
+                preferences = preference_sets[position] = normalize_preferences(preferences)
+                allowed = self._allowed_rows(preferences)
+                if allowed is not None and len(allowed) == 0:
+                    results[position] = {'recommendations': [], 'retrieval': self._no_allowed_rows_stats()}
+                    continue
+                queries[position] = self._create_query_from_preferences(preferences)
+            except Exception as e:
+                failed([position], e)
+                continue
+            if allowed is None:
+                groups[0][1].append(position)
+            else:
+                groups.append((allowed, [position]))
+        timings['queries_ms'] = (time.perf_counter() - stage_start) * 1000
+        
+        stage_start = time.perf_counter()
+        vectors = {}
+        positions = list(queries)
+        if positions:
+            try:
+                embedded = self._query_vectors([preference_sets[p] for p in positions], [queries[p] for p in positions])
+                vectors = dict(zip(positions, embedded))
+            except Exception as e:
+                logger.error(f"❌ Batch query embedding failed: {e}")
+                failed(positions, e)
+        timings['embedding_ms'] = (time.perf_counter() - stage_start) * 1000
+        
+        stage_start = time.perf_counter()
+        candidates = {}
+        for allowed, group in groups:
+            group = [position for position in group if position in vectors]
+            if not group:
+                continue
+            try:
+                found = self._retrieve_adaptively(
+                    np.vstack([vectors[p] for p in group]), [preference_sets[p] for p in group], top_k, allowed
+                )
+                candidates.update(zip(group, found))
+            except Exception as e:
+                logger.error(f"❌ Batch search failed for {len(group)} preference set(s): {e}")
+                failed(group, e)
+        timings['retrieval_ms'] = (time.perf_counter() - stage_start) * 1000
+        
+        stage_start = time.perf_counter()
+        for position, found in candidates.items():
+            try:
+                results[position] = {
+                    'recommendations': self._build_recommendations(preference_sets[position], top_k, *found[:-1]),
+                    'retrieval': found[-1],
+                }
+            except Exception as e:
+                failed([position], e)
+        timings['results_ms'] = (time.perf_counter() - stage_start) * 1000
+        
+        timings['total_ms'] = (time.perf_counter() - start) * 1000
+        timings = {stage: round(duration, 2) for stage, duration in timings.items()}
+        errors = sum(1 for result in results if 'error' in result)
+        logger.info(f"✅ Answered {len(results)} preference sets ({errors} failed) in {timings['total_ms']:.0f}ms")
+        return {'results': results, 'timings': timings}
+    
+    def _allowed_rows(self, preferences: Dict[str, Any]) -> Optional[AllowedRows]:
+        """Rows satisfying the hard constraints in strict mode, None when every row may be searched"""
+        if not preferences.get('strict_filters', settings.RECOMMENDATION_STRICT_FILTERS):
+            return None
+        allowed = self.constraints.allowed_rows(preferences)
+        if allowed is not None:
+            logger.info(f"🔒 Strict filters allow {len(allowed)} of {len(self.catalog)} courses")
+        return allowed
+    
+    def _build_recommendations(self, preferences: Dict[str, Any], top_k: int, row_ids: np.ndarray,
+                               distances: np.ndarray, match_percentages: np.ndarray,
+                               relevance_scores: np.ndarray) -> List[Dict[str, Any]]:
+        """Result dicts for the ``top_k`` most relevant scored candidates"""
+        recommendations = []
+        for index in self._select_results(row_ids, relevance_scores, top_k):
+            metadata = self.catalog.row(row_ids[index])
+            match_percentage = float(match_percentages[index])
+            
+            # Generate fast fallback reasoning (no API calls)
+            llm_reasoning = self._generate_fallback_reasoning(metadata, preferences, match_percentage)
+            
+            recommendations.append({
+                **metadata,
+                'similarity_score': float(distances[index]),
+                'match_percentage': match_percentage,
+                'llm_reasoning': llm_reasoning,
+                'relevance_score': float(relevance_scores[index])
+            })
+        return recommendations
+    
+    def _build_university_recommendations(self, preferences: Dict[str, Any], top_k: int, courses_per_university: int,
+                                          row_ids: np.ndarray, distances: np.ndarray, match_percentages: np.ndarray,
+                                          relevance_scores: np.ndarray) -> List[Dict[str, Any]]:
+        """One dict per university for the ``top_k`` universities of the best scored candidates.
+        
+        University metadata is taken from its best course and given once; its
+        best courses are nested with course fields only.
+        """
+        ranking = top_k_indices(relevance_scores, len(relevance_scores))
+        recommendations = []
+        for code, courses, matched in self.universities.group(row_ids, ranking, top_k, courses_per_university):
+            best = courses[0]
+            metadata = self.catalog.row(row_ids[best])
+            match_percentage = float(match_percentages[best])
+            recommendations.append({
+                **{key: metadata[key] for key in UNIVERSITY_KEYS},
+                'match_percentage': match_percentage,
+                'relevance_score': float(relevance_scores[best]),
+                'llm_reasoning': self._generate_fallback_reasoning(metadata, preferences, match_percentage),
+                'total_courses': int(self.universities.course_counts[code]),
+                'matching_courses': matched,
+                'courses': [
+                    {
+                        **{key: self.catalog.column(key).get(int(row_ids[index])) for key in COURSE_KEYS},
+                        'similarity_score': float(distances[index]),
+                        'match_percentage': float(match_percentages[index]),
+                        'relevance_score': float(relevance_scores[index]),
+                    }
+                    for index in courses
+                ],
+            })
+        return recommendations
+    
+    def _select_results(self, row_ids: np.ndarray, relevance_scores: np.ndarray, top_k: int) -> np.ndarray:
+        """Indices of the candidates shown, best first, diversified as configured.
+        
+        Diversification only considers the most relevant candidates (the
+        diversity pool), so its cost does not grow with the retrieval pool.
+        """
+        if self.diversity == 'none':
+            return top_k_indices(relevance_scores, top_k)
+        pool = top_k_indices(relevance_scores, max(settings.RECOMMENDATION_DIVERSITY_POOL, top_k))
+        if self.diversity == 'mmr':
+            vectors = reconstruct_rows(self.vector_store.index, row_ids[pool])
+            return pool[mmr_order(relevance_scores[pool], vectors, top_k, settings.RECOMMENDATION_MMR_LAMBDA)]
+        return pool[cap_per_group(self._university_groups(row_ids[pool]), settings.RECOMMENDATION_MAX_PER_UNIVERSITY, top_k)]
+    
+    def _university_groups(self, row_ids: np.ndarray) -> np.ndarray:
+        """University code of each row; rows without a university each form their own group"""
+        return self.universities.codes[row_ids]
+    
+    def _query_vector(self, preferences: Dict[str, Any], query: str) -> np.ndarray:
+        """Embedding for a request: composed from stored label vectors when possible, live otherwise"""
+        return self._query_vectors([preferences], [query])
+    
+    async def _aquery_vector(self, preferences: Dict[str, Any], query: str) -> np.ndarray:
+        """``_query_vector`` with a live embedding awaited on the embedding client"""
+        if self.label_embeddings is not None:
+            composed = self.label_embeddings.compose(preferences)
+            if composed is not None:
+                return composed.reshape(1, -1)
+        return (await self.embeddings.aembed_queries([query])).astype(np.float32)
+    
+    def _query_vectors(self, preference_sets: List[Dict[str, Any]], queries: List[str]) -> np.ndarray:
+        """One embedding per request; those not composed from label vectors are embedded in one batch"""
+        vectors = [None] * len(queries)
+        if self.label_embeddings is not None:
+            vectors = [self.label_embeddings.compose(preferences) for preferences in preference_sets]
+        live = [i for i, vector in enumerate(vectors) if vector is None]
+        if live:
+            for i, vector in zip(live, self.embeddings.embed_queries([queries[i] for i in live])):
+                vectors[i] = vector
+        return np.vstack(vectors).astype(np.float32)
+    
+    def _retrieve(self, query_vectors: np.ndarray, preference_sets: List[Dict[str, Any]], k: int,
+                  allowed: Optional[AllowedRows] = None) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """The top ``k`` candidates per query: vector matches, fused with lexical matches when enabled"""
+        candidates = self._search(query_vectors, k, allowed)
+        if self.lexical is not None:
+            for i, preferences in enumerate(preference_sets):
+                # Exact course-name matches from the whole catalog join the vector candidates
+                lexical_ids, _ = self.lexical.search(lexical_query(preferences), k, allowed)
+                candidates[i] = self._fuse_candidates(query_vectors[i:i + 1], *candidates[i], lexical_ids, k)
+        return candidates
+    
+    def _retrieve_adaptively(self, query_vectors: np.ndarray, preference_sets: List[Dict[str, Any]], top_k: int,
+                             allowed: Optional[AllowedRows] = None) -> List[Tuple]:
+        """Retrieve and score candidates, widening the pool geometrically until it is good enough.
+        
+        Each round searches for ``k`` candidates per query and scores them; a
+        query is done once ``top_k`` of them reach the target match percentage,
+        the index has no more candidates to give, the pool reaches its maximum,
+        or the next (larger) round would not fit in the latency budget, which
+        is per query (a batch gets one budget per preference set). The
+        queries still pending share the next round's search. FAISS cannot
+        resume a search, so every round starts over, but with geometric growth
+        all rounds together cost about as much as the last one.
+        
+        Returns (row_ids, distances, match_percentages, relevance_scores, stats)
+        per query.
+        """
+        start = time.perf_counter()
+        budget = settings.RECOMMENDATION_SEARCH_BUDGET_MS / 1000 * len(preference_sets)
+        growth = max(settings.RECOMMENDATION_CANDIDATE_GROWTH, 2)
+        maximum = max(settings.RECOMMENDATION_MAX_CANDIDATE_POOL, top_k)
+        available = len(self.catalog) if allowed is None else len(allowed)
+        k = min(max(top_k * 2, settings.RECOMMENDATION_CANDIDATE_POOL), maximum)
+        results = [None] * len(preference_sets)
+        pending = list(range(len(preference_sets)))
+        rounds = 0
+        
+        while pending:
+            round_start = time.perf_counter()
+            rounds += 1
+            candidates = self._retrieve(query_vectors[pending], [preference_sets[i] for i in pending], k, allowed)
+            scores = [
+                score_candidates(self.catalog, row_ids, distances, preference_sets[i])
+                for i, (row_ids, distances) in zip(pending, candidates)
+            ]
+            
+            now = time.perf_counter()
+            next_round_fits = now - start + (now - round_start) * growth <= budget
+            still_pending = []
+            for i, (row_ids, distances), (match_percentages, relevance_scores) in zip(pending, candidates, scores):
+                matched = int((match_percentages >= settings.RECOMMENDATION_TARGET_MATCH).sum())
+                if matched >= top_k:
+                    stop_reason = 'target_reached'
+                elif not has_match_criteria(preference_sets[i]):
+                    # Nothing to match against: a larger pool cannot raise any match percentage
+                    stop_reason = 'no_criteria'
+                elif k >= available:
+                    stop_reason = 'exhausted'
+                elif k >= maximum:
+                    stop_reason = 'max_pool'
+                elif not next_round_fits:
+                    stop_reason = 'budget'
+                else:
+                    still_pending.append(i)
+                    continue
+                stats = {
+                    'rounds': rounds,
+                    'candidates': len(row_ids),
+                    'matched': matched,
+                    'stop_reason': stop_reason,
+                    'duration_ms': round((now - start) * 1000, 2),
+                }
+                results[i] = (row_ids, distances, match_percentages, relevance_scores, stats)
+            pending = still_pending
+            k = min(k * growth, maximum)
+        return results
+    
+    def _search(self, query_vectors: np.ndarray, k: int,
+                allowed: Optional[AllowedRows] = None) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """Run one FAISS search for all ``query_vectors``, optionally restricted to ``allowed`` rows.
+        
+        Returns (row_ids, distances) per query, without the padding of queries with fewer than ``k`` hits.
+        """
+        index = self.vector_store.index
+        if allowed is not None and is_approximate(index) and len(allowed) <= EXACT_SEARCH_LIMIT:
+            distances, row_ids = exact_search(index, query_vectors, allowed.ids, k)
+        else:
+            params = None
+            if allowed is not None:
+                params = search_parameters(index, allowed.selector(), selectivity=len(allowed) / index.ntotal)
+            distances, row_ids = index.search(query_vectors, k, params=params)
+        found = row_ids >= 0
+        return [(ids[mask], dists[mask]) for ids, dists, mask in zip(row_ids, distances, found)]
+    
+    def _fuse_candidates(self, query_vector: np.ndarray, row_ids: np.ndarray, distances: np.ndarray,
+                         lexical_ids: np.ndarray, k: int):
+        """Merge vector and lexical candidates by reciprocal rank fusion, keeping the top ``k``.
+        
+        Rows found only lexically get their vector distance from the stored
+        vectors so every candidate is scored the same way.
+        """
+        if not len(lexical_ids):
+            return row_ids, distances
+        fused = reciprocal_rank_fusion([row_ids, lexical_ids], k=settings.HYBRID_RRF_K)[:k]
+        known = dict(zip(row_ids.tolist(), distances.tolist()))
+        fused_distances = np.array([known.get(row_id, np.nan) for row_id in fused.tolist()], dtype=np.float32)
+        missing = np.flatnonzero(np.isnan(fused_distances))
+        if len(missing):
+            vectors = reconstruct_rows(self.vector_store.index, fused[missing])
+            fused_distances[missing] = ((vectors - query_vector[0]) ** 2).sum(axis=1)
+        return fused, fused_distances
+    
     def _create_query_from_preferences(self, preferences: Dict[str, Any]) -> str:
         """Create a search query from user preferences"""
         query_parts = []
@@ -268,59 +1023,13 @@ class UniversityRecommendationService:
         query = " ".join(query_parts)
         return query
     
-    def _calculate_match_percentage(self, course_metadata: Dict[str, Any], preferences: Dict[str, Any]) -> float:
-        """Calculate how well a course matches user preferences (0-100)"""
-        match_points = 0
-        total_points = 0
-        
-        # Program match
-        if preferences.get('desired_program'):
-            total_points += 25
-            if course_metadata.get('parent_course') and preferences['desired_program'].lower() in course_metadata['parent_course'].lower():
-                match_points += 25
-            elif course_metadata.get('course_name') and preferences['desired_program'].lower() in course_metadata['course_name'].lower():
-                match_points += 20
-        
-        # Program level match
-        if preferences.get('program_level'):
-            total_points += 15
-            if course_metadata.get('program_type') and preferences['program_level'].lower() in course_metadata['program_type'].lower():
-                match_points += 15
-        
-        # Location match
-        if preferences.get('preferred_countries'):
-            total_points += 20
-            if course_metadata.get('country') and course_metadata['country'] in preferences['preferred_countries']:
-                match_points += 20
-        
-        # University type match
-        if preferences.get('university_types'):
-            total_points += 15
-            if course_metadata.get('university_type') and course_metadata['university_type'] in preferences['university_types']:
-                match_points += 15
-        
-        # Tuition match
-        if preferences.get('max_tuition_usd') and course_metadata.get('tuition_usd'):
-            total_points += 15
-            if course_metadata['tuition_usd'] <= preferences['max_tuition_usd']:
-                match_points += 15
-        
-        # Global rank match
-        if preferences.get('min_global_rank') and course_metadata.get('global_rank'):
-            total_points += 10
-            if course_metadata['global_rank'] <= preferences['min_global_rank']:
-                match_points += 10
-        
-        match_percentage = (match_points / total_points * 100) if total_points > 0 else 0
-        return match_percentage
-    
     def _generate_fallback_reasoning(self, course_metadata: Dict[str, Any], preferences: Dict[str, Any], match_percentage: float) -> str:
         """Generate intelligent fallback reasoning without LLM"""
         reasons = []
         
         # Program match
         if preferences.get('desired_program') and course_metadata.get('parent_course') and preferences['desired_program'].lower() in course_metadata['parent_course'].lower():
-            reasons.append(f"Perfect program match: {preferences['desired_program']}")
+            reasons.append(f"Perfect program match: {course_metadata['parent_course']}")
         
         # Location match
         if preferences.get('preferred_countries') and course_metadata.get('country') and course_metadata['country'] in preferences['preferred_countries']:
@@ -370,52 +1079,28 @@ class UniversityRecommendationService:
         return reasoning
     
     def get_available_programs(self) -> List[str]:
-        """Get list of available programs/courses with better variety"""
-        if not self.university_data:
+        """Get list of available programs/courses, most popular first"""
+        if not self.facets:
             return []
-        
-        # Count program frequencies to determine popularity
-        program_counts = {}
-        for item in self.university_data:
-            if item.get('parent_course_name'):
-                program = item['parent_course_name']
-                program_counts[program] = program_counts.get(program, 0) + 1
-        
-        # Sort by frequency (popularity) and then alphabetically
-        sorted_programs = sorted(program_counts.items(), key=lambda x: (-x[1], x[0]))
-        
-        # Return all programs sorted by popularity
-        return [program for program, count in sorted_programs]
+        return list(self.facets.values('programs'))
     
     def get_available_countries(self) -> List[str]:
-        """Get list of available countries with better variety"""
-        if not self.university_data:
+        """Get list of available countries, most popular first"""
+        if not self.facets:
             return []
-        
-        # Count country frequencies to determine popularity
-        country_counts = {}
-        for item in self.university_data:
-            if item.get('country_name'):
-                country = item['country_name']
-                country_counts[country] = country_counts.get(country, 0) + 1
-        
-        # Sort by frequency (popularity) and then alphabetically
-        sorted_countries = sorted(country_counts.items(), key=lambda x: (-x[1], x[0]))
-        
-        # Return all countries sorted by popularity
-        return [country for country, count in sorted_countries]
+        return list(self.facets.values('countries'))
     
     def get_available_locations(self) -> List[str]:
         """Get list of available locations"""
-        if not self.university_data:
+        if not self.facets:
             return []
-        
-        locations = set()
-        for item in self.university_data:
-            if item.get('location_name'):
-                locations.add(item['location_name'])
-        
-        return sorted(list(locations))
+        return list(self.facets.values('locations'))
+    
+    def typeahead_matches(self, field: str, prefix: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """Most frequent programs, countries or locations matching ``prefix``"""
+        if field not in self.typeahead:
+            raise ValueError(f"Unknown typeahead field: {field!r}")
+        return self.typeahead[field].search(prefix, limit)
     
     def get_available_previous_degrees(self) -> List[str]:
         """Get list of common previous degree types"""
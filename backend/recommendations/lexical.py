@@ -0,0 +1,177 @@
+import os
+import re
+from array import array
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .catalog import CourseCatalog
+from .filters import AllowedRows
+
+
+LEXICAL_INDEX_FILE = 'lexical_index.npz'
+
+# Catalog columns searched lexically
+LEXICAL_FIELDS = ('course_name', 'parent_course', 'course_program_label')
+
+# Preferences that make up the lexical query
+LEXICAL_PREFERENCES = ('desired_program', 'program_level')
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+STOPWORDS = frozenset({'a', 'an', 'and', 'at', 'for', 'in', 'of', 'on', 's', 'the', 'to', 'with'})
+
+# Degree abbreviations also index (and query) their spelled-out level, so that
+# "MSc Data Science" matches "Master of Data Science" and vice versa
+TOKEN_SYNONYMS = {
+    'msc': 'master', 'ma': 'master', 'meng': 'master', 'mres': 'master', 'mphil': 'master',
+    'masters': 'master',
+    'bsc': 'bachelor', 'ba': 'bachelor', 'beng': 'bachelor', 'bachelors': 'bachelor',
+    'phd': 'doctorate', 'dphil': 'doctorate', 'doctoral': 'doctorate',
+}
+
+
+def tokenize(text: str) -> List[str]:
+    tokens = []
+    for token in _TOKEN_PATTERN.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        tokens.append(token)
+        canonical = TOKEN_SYNONYMS.get(token)
+        if canonical is not None:
+            tokens.append(canonical)
+    return tokens
+
+
+def lexical_query(preferences: Dict[str, Any]) -> str:
+    """The text matched lexically for a request"""
+    return ' '.join(str(preferences[key]) for key in LEXICAL_PREFERENCES if preferences.get(key))
+
+
+class LexicalIndex:
+    """BM25 inverted index over course names, parent courses and program labels.
+
+    Postings are stored in CSR form by term, each with its precomputed BM25
+    impact, so a query is a handful of slices plus one ``bincount`` over the
+    whole catalog. String values are tokenized once per distinct value.
+    """
+
+    def __init__(self, terms: np.ndarray, offsets: np.ndarray, rows: np.ndarray, impacts: np.ndarray, size: int):
+        self.terms = terms
+        self.offsets = offsets
+        self.rows = rows
+        self.impacts = impacts
+        self.size = size
+
+    def __len__(self) -> int:
+        return len(self.terms)
+
+    @classmethod
+    def build(cls, catalog: CourseCatalog) -> 'LexicalIndex':
+        size = len(catalog)
+        vocabulary = {}
+        pair_rows = []
+        pair_terms = []
+        for key in LEXICAL_FIELDS:
+            column = catalog.column(key)
+            if not column.is_string:
+                continue
+            # Token ids of every distinct value; the extra trailing slot (code -1) has none
+            terms = array('i')
+            lengths = np.zeros(len(column.categories) + 1, dtype=np.int64)
+            for code, value in enumerate(column.categories):
+                tokens = tokenize(value)
+                terms.extend(vocabulary.setdefault(token, len(vocabulary)) for token in tokens)
+                lengths[code] = len(tokens)
+            starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+
+            codes = column.values
+            row_lengths = lengths[codes]
+            total = int(row_lengths.sum())
+            row_starts = np.repeat(starts[codes], row_lengths)
+            within = np.arange(total) - np.repeat(np.cumsum(row_lengths) - row_lengths, row_lengths)
+            pair_rows.append(np.repeat(np.arange(size, dtype=np.int64), row_lengths))
+            pair_terms.append(np.frombuffer(terms, dtype=np.int32)[row_starts + within])
+
+        words = np.array(list(vocabulary), dtype=str)
+        order = np.argsort(words)
+        rank = np.empty(len(order), dtype=np.int64)
+        rank[order] = np.arange(len(order))
+
+        rows = np.concatenate(pair_rows) if pair_rows else np.empty(0, dtype=np.int64)
+        terms = rank[np.concatenate(pair_terms)] if pair_terms else np.empty(0, dtype=np.int64)
+        document_lengths = np.bincount(rows, minlength=size)
+
+        # Unique (term, row) pairs sorted by term then row, i.e. already in CSR order
+        keys, frequencies = np.unique(terms * max(size, 1) + rows, return_counts=True)
+        posting_terms = keys // max(size, 1)
+        posting_rows = keys % max(size, 1)
+        document_frequencies = np.bincount(posting_terms, minlength=len(words))
+
+        idf = np.log(1.0 + (size - document_frequencies + 0.5) / (document_frequencies + 0.5))
+        average_length = document_lengths.mean() if size and document_lengths.any() else 1.0
+        norms = BM25_K1 * (1.0 - BM25_B + BM25_B * document_lengths[posting_rows] / average_length)
+        impacts = idf[posting_terms] * frequencies * (BM25_K1 + 1.0) / (frequencies + norms)
+
+        offsets = np.concatenate(([0], np.cumsum(document_frequencies))).astype(np.int64)
+        return cls(words[order], offsets, posting_rows.astype(np.int32), impacts.astype(np.float32), size)
+
+    def save(self, directory: str):
+        # Workers may build the index concurrently: each writes its own file and renames it into place
+        path = os.path.join(directory, LEXICAL_INDEX_FILE)
+        temp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(temp_path, terms=self.terms, offsets=self.offsets, rows=self.rows,
+                 impacts=self.impacts, size=np.int64(self.size))
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, directory: str, size: int) -> Optional['LexicalIndex']:
+        """Load a saved index, or None if there is none for a catalog of ``size`` rows"""
+        path = os.path.join(directory, LEXICAL_INDEX_FILE)
+        if not os.path.exists(path):
+            return None
+        with np.load(path, allow_pickle=False) as data:
+            if int(data['size']) != size:
+                return None
+            return cls(data['terms'], data['offsets'], data['rows'], data['impacts'], size)
+
+    def search(self, text: str, k: int, allowed: Optional[AllowedRows] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Top ``k`` rows by BM25 score (ties by row id), optionally only among ``allowed`` rows"""
+        empty = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        tokens = tokenize(text)
+        if not tokens or not len(self.terms):
+            return empty
+        positions = np.minimum(np.searchsorted(self.terms, tokens), len(self.terms) - 1)
+        term_ids = positions[self.terms[positions] == np.array(tokens)]
+        if not len(term_ids):
+            return empty
+
+        postings = np.concatenate([np.arange(self.offsets[t], self.offsets[t + 1]) for t in term_ids])
+        scores = np.bincount(self.rows[postings], weights=self.impacts[postings], minlength=self.size)
+        if allowed is not None:
+            candidates = allowed.ids[scores[allowed.ids] > 0]
+        else:
+            candidates = np.flatnonzero(scores > 0)
+        if len(candidates) > k:
+            # Keep everything tied with the k-th score so ties are broken by row id below
+            candidate_scores = scores[candidates]
+            threshold = np.partition(candidate_scores, len(candidates) - k)[len(candidates) - k]
+            candidates = candidates[candidate_scores >= threshold]
+        candidates = candidates[np.lexsort((candidates, -scores[candidates]))][:k]
+        return candidates.astype(np.int64), scores[candidates].astype(np.float32)
+
+
+def reciprocal_rank_fusion(rankings: Sequence[np.ndarray], k: int = 60) -> np.ndarray:
+    """Fuse ranked row-id lists: each row scores sum(1 / (k + rank)); ties keep first-seen order"""
+    rankings = [np.asarray(ranking, dtype=np.int64) for ranking in rankings if len(ranking)]
+    if not rankings:
+        return np.empty(0, dtype=np.int64)
+    ids = np.concatenate(rankings)
+    contributions = np.concatenate([1.0 / (k + np.arange(1, len(ranking) + 1)) for ranking in rankings])
+    unique, first_seen, inverse = np.unique(ids, return_index=True, return_inverse=True)
+    scores = np.bincount(inverse, weights=contributions)
+    order = np.lexsort((first_seen, -scores))
+    return unique[order]
@@ -0,0 +1,142 @@
+import hashlib
+import json
+import logging
+from typing import Any, Dict, Optional
+
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+
+RESULT_CACHE_ALIAS = 'recommendations'
+
+# Preferences that change a recommendation result; anything else in a payload
+# (GPA, test scores, currency, ...) is dropped. Text is matched case-insensitively
+# by every stage, so it is lowercased; list values are matched exactly against
+# catalog values.
+TEXT_PREFERENCES = ('desired_program', 'program_level', 'program_type', 'additional_preferences')
+LIST_PREFERENCES = ('preferred_countries', 'preferred_locations', 'university_types')
+NUMBER_PREFERENCES = ('max_tuition_usd', 'min_global_rank')
+
+# Settings that change results for the same index
+RESULT_SETTINGS = (
+    'RECOMMENDATION_CANDIDATE_POOL', 'RECOMMENDATION_MAX_CANDIDATE_POOL', 'RECOMMENDATION_CANDIDATE_GROWTH',
+    'RECOMMENDATION_TARGET_MATCH', 'RECOMMENDATION_STRICT_FILTERS', 'LEXICAL_RETRIEVAL_ENABLED',
+    'HYBRID_RRF_K', 'LABEL_EMBEDDINGS_ENABLED', 'RECOMMENDATION_DIVERSITY', 'RECOMMENDATION_DIVERSITY_POOL',
+    'RECOMMENDATION_MMR_LAMBDA', 'RECOMMENDATION_MAX_PER_UNIVERSITY',
+)
+
+
+# Spellings of strict_filters in form and query-string payloads
+FLAG_VALUES = {'true': True, '1': True, 'yes': True, 'false': False, '0': False, 'no': False}
+
+
+def _collapse(text: Any) -> str:
+    return ' '.join(str(text).split())
+
+
+def _strict_filters(value: Any) -> bool:
+    """A real boolean or one of FLAG_VALUES; anything else (absent, null, unknown) means the configured default"""
+    if isinstance(value, bool):
+        return value
+    return FLAG_VALUES.get(str(value).strip().lower(), settings.RECOMMENDATION_STRICT_FILTERS)
+
+
+def normalize_preferences(preferences: Dict[str, Any]) -> Dict[str, Any]:
+    """The preferences a recommendation depends on, in one canonical form.
+
+    Whitespace in text is collapsed and text lowercased, list values are trimmed, de-duplicated and
+    sorted, and numbers are parsed and rounded to cents. Recommendations are
+    computed from this form, so every payload with the same normal form gets
+    the same result and may share a cache entry.
+    """
+    normalized = {}
+    for key in TEXT_PREFERENCES:
+        if preferences.get(key):
+            normalized[key] = _collapse(preferences[key]).lower()
+    for key in LIST_PREFERENCES:
+        value = preferences.get(key)
+        if value:
+            values = value if isinstance(value, (list, tuple)) else [value]
+            normalized[key] = sorted({_collapse(item) for item in values})
+    for key in NUMBER_PREFERENCES:
+        try:
+            number = round(float(preferences[key]), 2) if preferences.get(key) else None
+        except (TypeError, ValueError):
+            number = None
+        if number:
+            normalized[key] = number
+    normalized['strict_filters'] = _strict_filters(preferences.get('strict_filters'))
+    return normalized
+
+
+def result_key(version: str, preferences: Dict[str, Any], top_k: int, variant: str = 'courses') -> str:
+    """Identifies one recommendation result: the normalized preferences for ``version``"""
+    payload = json.dumps([version, variant, top_k, normalize_preferences(preferences)], sort_keys=True, ensure_ascii=False)
+    return 'recommendations:' + hashlib.blake2b(payload.encode('utf-8'), digest_size=20).hexdigest()
+
+
+class RecommendationCache:
+    """Recommendation results in Django's 'recommendations' cache.
+
+    Keys hash the normalized preferences, ``top_k``,
+    the result shape (``variant``), the index version and the settings that affect results, so entries of an
+    older index or configuration are never served. They are never deleted
+    either (the alias may be shared with other data): expiry (TIMEOUT) and the
+    size bound (MAX_ENTRIES) configured on the cache itself remove them.
+    """
+
+    def __init__(self, index_version: str, alias: str = RESULT_CACHE_ALIAS):
+        self.cache = caches[alias]
+        configuration = {name: getattr(settings, name) for name in RESULT_SETTINGS}
+        self.version = f"{index_version}:{json.dumps(configuration, sort_keys=True)}"
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, preferences: Dict[str, Any], top_k: int, variant: str = 'courses') -> str:
+        return result_key(self.version, preferences, top_k, variant)
+
+    def get(self, preferences: Dict[str, Any], top_k: int, variant: str = 'courses',
+            count: bool = True) -> Optional[Dict[str, Any]]:
+        """The cached entry or None; ``count=False`` leaves the hit/miss counters alone (a repeated lookup)"""
+        try:
+            entry = self.cache.get(self.key(preferences, top_k, variant))
+        except Exception as e:
+            logger.warning(f"❌ Recommendation cache read failed: {e}")
+            entry = None
+        if count:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return entry
+
+    def set(self, preferences: Dict[str, Any], top_k: int, entry: Dict[str, Any], variant: str = 'courses'):
+        try:
+            self.cache.set(self.key(preferences, top_k, variant), entry)
+        except Exception as e:
+            logger.warning(f"❌ Recommendation cache write failed: {e}")
+
+    async def aget(self, preferences: Dict[str, Any], top_k: int, variant: str = 'courses',
+                   count: bool = True) -> Optional[Dict[str, Any]]:
+        try:
+            entry = await self.cache.aget(self.key(preferences, top_k, variant))
+        except Exception as e:
+            logger.warning(f"❌ Recommendation cache read failed: {e}")
+            entry = None
+        if count:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return entry
+
+    async def aset(self, preferences: Dict[str, Any], top_k: int, entry: Dict[str, Any], variant: str = 'courses'):
+        try:
+            await self.cache.aset(self.key(preferences, top_k, variant), entry)
+        except Exception as e:
+            logger.warning(f"❌ Recommendation cache write failed: {e}")
+
+    def stats(self) -> Dict[str, int]:
+        return {'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,151 @@
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+from .catalog import CatalogColumn, CourseCatalog
+
+
+# Points awarded per preference, mirroring the weights of the original per-document scorer
+PROGRAM_POINTS = 25
+COURSE_NAME_POINTS = 20
+PROGRAM_LEVEL_POINTS = 15
+COUNTRY_POINTS = 20
+UNIVERSITY_TYPE_POINTS = 15
+TUITION_POINTS = 15
+RANK_POINTS = 10
+
+# Preferences that contribute to the match percentage
+MATCH_PREFERENCES = (
+    'desired_program', 'program_level', 'preferred_countries', 'university_types',
+    'max_tuition_usd', 'min_global_rank',
+)
+
+
+def _gather(category_mask: np.ndarray, codes: np.ndarray) -> np.ndarray:
+    """Expand a per-category mask to rows; missing values (code -1) never match"""
+    return np.append(category_mask, False)[codes]
+
+
+def _contains_mask(column: CatalogColumn, needle: str, codes: np.ndarray) -> np.ndarray:
+    """Rows whose value contains ``needle`` case-insensitively, tested once per category"""
+    if not column.is_string:
+        return np.zeros(len(codes), dtype=bool)
+    needle = needle.lower()
+    category_mask = np.fromiter(
+        (needle in category for category in column.lowered_categories()),
+        dtype=bool, count=len(column.categories)
+    )
+    return _gather(category_mask, codes)
+
+
+def _isin_mask(column: CatalogColumn, values, codes: np.ndarray) -> np.ndarray:
+    """Rows whose value is exactly one of ``values``"""
+    if not column.is_string:
+        return np.zeros(len(codes), dtype=bool)
+    wanted = [column.code_of(value) for value in values if isinstance(value, str)]
+    wanted = [code for code in wanted if code >= 0]
+    if not wanted:
+        return np.zeros(len(codes), dtype=bool)
+    return np.isin(codes, wanted)
+
+
+def _preference_number(preferences: Dict[str, Any], key: str) -> Optional[float]:
+    value = preferences.get(key)
+    if not value:
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _numeric_values(column: CatalogColumn, row_ids: np.ndarray) -> Optional[np.ndarray]:
+    if column.is_string:
+        return None
+    return column.values[row_ids]
+
+
+def has_match_criteria(preferences: Dict[str, Any]) -> bool:
+    """Whether any preference can raise a candidate's match percentage above 0"""
+    return any(preferences.get(key) for key in MATCH_PREFERENCES)
+
+
+def calculate_match_percentages(catalog: CourseCatalog, row_ids: np.ndarray, preferences: Dict[str, Any]) -> np.ndarray:
+    """Calculate how well each candidate row matches user preferences (0-100), all at once"""
+    count = len(row_ids)
+    match_points = np.zeros(count, dtype=np.float64)
+    total_points = np.zeros(count, dtype=np.float64)
+
+    # Program match
+    desired_program = preferences.get('desired_program')
+    if desired_program:
+        total_points += PROGRAM_POINTS
+        parent = catalog.column('parent_course')
+        course = catalog.column('course_name')
+        parent_match = _contains_mask(parent, desired_program, parent.values[row_ids])
+        course_match = _contains_mask(course, desired_program, course.values[row_ids])
+        match_points += np.where(parent_match, PROGRAM_POINTS, np.where(course_match, COURSE_NAME_POINTS, 0))
+
+    # Program level match
+    program_level = preferences.get('program_level')
+    if program_level:
+        total_points += PROGRAM_LEVEL_POINTS
+        column = catalog.column('program_type')
+        match_points += PROGRAM_LEVEL_POINTS * _contains_mask(column, program_level, column.values[row_ids])
+
+    # Location match
+    if preferences.get('preferred_countries'):
+        total_points += COUNTRY_POINTS
+        column = catalog.column('country')
+        match_points += COUNTRY_POINTS * _isin_mask(column, preferences['preferred_countries'], column.values[row_ids])
+
+    # University type match
+    if preferences.get('university_types'):
+        total_points += UNIVERSITY_TYPE_POINTS
+        column = catalog.column('university_type')
+        match_points += UNIVERSITY_TYPE_POINTS * _isin_mask(column, preferences['university_types'], column.values[row_ids])
+
+    # Tuition match, only counted for courses with a known, non-zero tuition
+    max_tuition = _preference_number(preferences, 'max_tuition_usd')
+    tuition = _numeric_values(catalog.column('tuition_usd'), row_ids)
+    if max_tuition is not None and tuition is not None:
+        known = ~np.isnan(tuition) & (tuition != 0)
+        total_points += TUITION_POINTS * known
+        match_points += TUITION_POINTS * (known & (tuition <= max_tuition))
+
+    # Global rank match, only counted for ranked courses
+    min_rank = _preference_number(preferences, 'min_global_rank')
+    rank = _numeric_values(catalog.column('global_rank'), row_ids)
+    if min_rank is not None and rank is not None:
+        known = ~np.isnan(rank) & (rank != 0)
+        total_points += RANK_POINTS * known
+        match_points += RANK_POINTS * (known & (rank <= min_rank))
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(total_points > 0, match_points / total_points * 100, 0.0)
+
+
+def score_candidates(catalog: CourseCatalog, row_ids: np.ndarray, distances: np.ndarray,
+                     preferences: Dict[str, Any]) -> Tuple[np.ndarray, np.ndarray]:
+    """Return (match_percentage, relevance_score) arrays for every candidate"""
+    match_percentages = calculate_match_percentages(catalog, row_ids, preferences)
+    relevance = (match_percentages + (1 - distances.astype(np.float64))) / 2
+    return match_percentages, relevance
+
+
+def top_k_indices(relevance: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the ``k`` most relevant candidates, best first.
+
+    Ties keep the order in which candidates came out of the vector search.
+    """
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < len(relevance):
+        # Everything above the k-th best value, then the earliest of the candidates tied with it
+        threshold = -np.partition(-relevance, k - 1)[k - 1]
+        above = np.flatnonzero(relevance > threshold)
+        tied = np.flatnonzero(relevance == threshold)[:k - len(above)]
+        selected = np.concatenate((above, tied))
+    else:
+        selected = np.arange(len(relevance))
+    return selected[np.lexsort((selected, -relevance[selected]))]
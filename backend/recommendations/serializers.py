@@ -2,13 +2,6 @@ from rest_framework import serializers
 from .models import UserSubmission
 
 
-class AvailableOptionsSerializer(serializers.Serializer):
-    programs = serializers.ListField(child=serializers.CharField())
-    countries = serializers.ListField(child=serializers.CharField())
-    previous_degrees = serializers.ListField(child=serializers.CharField())
-    previous_courses = serializers.ListField(child=serializers.CharField())
-
-
 class UserSubmissionSerializer(serializers.ModelSerializer):
     class Meta:
         model = UserSubmission
@@ -0,0 +1,147 @@
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from django.conf import settings
+
+from .langchain_service_fast import UniversityRecommendationService
+
+logger = logging.getLogger(__name__)
+
+
+# idle: not started yet; loading: an attempt is running; ready: the service answers requests;
+# failed: the last attempt raised, another one starts after a backoff
+SERVICE_STATES = ('idle', 'loading', 'ready', 'failed')
+
+
+class ServiceLoader:
+    """Creates the recommendation service once per process, in a background thread.
+
+    ``get`` never blocks: it returns the service once it is ready and None
+    before, starting the load on first use if nothing started it earlier.
+    Failed attempts are retried with exponential backoff. ``status`` reports
+    the state and progress for health checks and 503 responses.
+    """
+
+    def __init__(self, factory: Callable[..., Any], retry_delay: float, max_retry_delay: float):
+        self.factory = factory
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._thread = None
+        self.service = None
+        self.state = 'idle'
+        self.stage = None
+        self.done = 0
+        self.total = 0
+        self.attempts = 0
+        self.error = None
+        self.started_at = None
+        self.next_attempt_at = None
+
+    def start(self) -> bool:
+        """Start loading unless the service is ready or being loaded; True if this call started it"""
+        with self._lock:
+            if self.state == 'ready' or (self._thread is not None and self._thread.is_alive()):
+                return False
+            self._thread = threading.Thread(target=self._run, name='recommendation-service-loader', daemon=True)
+            self._thread.start()
+            return True
+
+    def get(self) -> Optional[Any]:
+        """The service if it is ready, else None"""
+        if self.service is None:
+            self.start()
+        return self.service
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Block until the service is ready (or ``timeout`` seconds pass); True if it is ready"""
+        self.start()
+        return self._ready.wait(timeout)
+
+    def load(self) -> bool:
+        """One load attempt in the calling thread, e.g. in a server's parent process before it forks workers.
+
+        True if the service is ready. After a failure nothing is retried in
+        this process; the next ``get`` starts the background loader.
+        """
+        with self._lock:
+            if self.state == 'ready':
+                return True
+            if self._thread is not None and self._thread.is_alive():
+                raise RuntimeError("the service is already loading in the background")
+        return self._attempt()
+
+    def _run(self):
+        delay = self.retry_delay
+        while not self._attempt(retry_in=delay):
+            time.sleep(delay)
+            delay = min(delay * 2, self.max_retry_delay)
+
+    def _attempt(self, retry_in: Optional[float] = None) -> bool:
+        with self._lock:
+            self.state = 'loading'
+            self.attempts += 1
+            self.stage = None
+            self.done = self.total = 0
+            self.error = None
+            self.started_at = time.time()
+            self.next_attempt_at = None
+        logger.info(f"🚀 Loading recommendation service (attempt {self.attempts})...")
+        try:
+            service = self.factory(progress=self._report)
+        except Exception as e:
+            retrying = f"; retrying in {retry_in:.0f}s" if retry_in is not None else ""
+            logger.error(f"❌ Recommendation service failed to load: {e}{retrying}")
+            with self._lock:
+                self.state = 'failed'
+                self.error = f"{type(e).__name__}: {e}"
+                if retry_in is not None:
+                    self.next_attempt_at = time.time() + retry_in
+            return False
+
+        with self._lock:
+            self.service = service
+            self.state = 'ready'
+            self.stage = None
+        self._ready.set()
+        logger.info(f"✅ Recommendation service ready after {time.time() - self.started_at:.2f}s")
+        return True
+
+    def _report(self, stage: str, done: int = 0, total: int = 0):
+        with self._lock:
+            self.stage, self.done, self.total = stage, done, total
+
+    def retry_after(self) -> int:
+        """Seconds a client should wait before retrying a request the service could not answer yet"""
+        with self._lock:
+            if self.state == 'failed' and self.next_attempt_at is not None:
+                # The next attempt takes at least as long as loading normally does
+                return max(1, int(self.next_attempt_at - time.time())) + settings.RECOMMENDATION_RETRY_AFTER
+            return settings.RECOMMENDATION_RETRY_AFTER
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            status = {
+                'state': self.state,
+                'stage': self.stage,
+                'attempts': self.attempts,
+                'error': self.error,
+            }
+            if self.total:
+                status['progress'] = {'done': self.done, 'total': self.total}
+            if self.state == 'loading':
+                status['elapsed_s'] = round(time.time() - self.started_at, 1)
+            if self.state == 'failed' and self.next_attempt_at is not None:
+                status['next_attempt_in_s'] = max(0, round(self.next_attempt_at - time.time(), 1))
+            return status
+
+
+service_loader = ServiceLoader(
+    UniversityRecommendationService,
+    retry_delay=settings.RECOMMENDATION_INIT_RETRY_DELAY,
+    max_retry_delay=settings.RECOMMENDATION_INIT_MAX_RETRY_DELAY,
+)
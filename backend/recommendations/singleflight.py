@@ -0,0 +1,177 @@
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesces identical concurrent computations within a process.
+
+    The first caller for a key (the leader) runs the computation; callers that
+    arrive with the same key while it runs wait for it and share its result
+    (or its exception). Threads and coroutines coalesce separately: ``do`` for
+    threads, ``ado`` for coroutines of one event loop. Results are shared, so
+    callers must treat them as read-only.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights: Dict[str, _Flight] = {}
+        self._tasks: Dict[tuple, asyncio.Future] = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    def do(self, key: str, compute: Callable[[], Any]):
+        """``compute()``, or the result of the identical computation already running; returns (result, coalesced)"""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = _Flight()
+                self.leaders += 1
+                leader = True
+            else:
+                self.coalesced += 1
+                leader = False
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
+
+        try:
+            flight.result = compute()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+        return flight.result, False
+
+    async def ado(self, key: str, compute: Callable[[], Awaitable[Any]]):
+        """``do`` for coroutines: ``await compute()`` once per key and event loop"""
+        task_key = (id(asyncio.get_running_loop()), key)
+        task = self._tasks.get(task_key)
+        if task is not None:
+            self.coalesced += 1
+            # A follower that is cancelled must not cancel the leader's computation
+            return await asyncio.shield(task), True
+
+        task = asyncio.ensure_future(compute())
+        self._tasks[task_key] = task
+        self.leaders += 1
+        try:
+            return await asyncio.shield(task), False
+        finally:
+            if self._tasks.get(task_key) is task:
+                del self._tasks[task_key]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            in_flight = len(self._flights) + len(self._tasks)
+        return {'leaders': self.leaders, 'coalesced': self.coalesced, 'in_flight': in_flight}
+
+
+class ProcessLocks:
+    """Striped ``flock`` files coalescing computations across processes of one host.
+
+    A key maps to one of ``stripes`` lock files in ``directory``, so the number
+    of files is bounded; different keys sharing a stripe only wait for each
+    other. Holders are expected to publish their result to a store the other
+    processes check once they get the lock (the recommendation result cache).
+    """
+
+    def __init__(self, directory: str, stripes: int = 256):
+        self.directory = directory
+        self.stripes = stripes
+        os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def from_directory(cls, directory: str) -> Optional['ProcessLocks']:
+        """Locks in ``directory``, or None (coalescing within each process only) if they cannot be used"""
+        if fcntl is None:
+            logger.warning("❌ Cross-process request coalescing needs fcntl; coalescing within each process only")
+            return None
+        try:
+            return cls(directory)
+        except OSError as e:
+            logger.warning(f"❌ Could not create the request lock directory {directory}: {e}")
+            return None
+
+    def _path(self, key: str) -> str:
+        stripe = int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'big') % self.stripes
+        return os.path.join(self.directory, f"{stripe:04d}.lock")
+
+    def acquire(self, key: str, blocking: bool = True) -> Optional[int]:
+        """Take the lock of ``key``; returns the handle for ``release`` (None if not blocking and held elsewhere)"""
+        fd = os.open(self._path(key), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return None
+        except BaseException:
+            os.close(fd)
+            raise
+        return fd
+
+    async def aacquire(self, key: str, poll_interval: float = 0.01) -> int:
+        """``acquire`` for coroutines: polls instead of blocking the event loop or an executor thread"""
+        while True:
+            fd = self.acquire(key, blocking=False)
+            if fd is not None:
+                return fd
+            await asyncio.sleep(poll_interval)
+
+    def release(self, fd: int):
+        try:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
+
+    @contextmanager
+    def hold(self, key: str):
+        fd = self.acquire(key)
+        try:
+            yield
+        finally:
+            self.release(fd)
+
+
+@contextmanager
+def file_lock(path: str):
+    """Exclusive ``flock`` on ``path`` for the duration of the block, across processes of one host.
+
+    Without fcntl (Windows) the block runs unlocked.
+    """
+    if fcntl is None:
+        yield
+        return
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+    finally:
+        os.close(fd)
@@ -1,3 +1,2073 @@
-from django.test import TestCase
+import asyncio
+import glob
+import hashlib
+import importlib
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import faiss
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.test import SimpleTestCase, TestCase, override_settings
+from rest_framework.authtoken.models import Token
+
+from authentication.models import User
+
+from .catalog import CATALOG_FIELDS, CATALOG_FILE, CourseCatalog
+from .diversity import cap_per_group, group_occurrence, mmr_order
+from .documents import DOCUMENT_KEYS, DOCUMENT_TEMPLATE, DocumentTexts, iter_records
+from .embedding_cache import CachedQueryEmbeddings, QueryEmbeddingCache
+from .embeddings import HashingEmbeddings, get_embedding_backend
+from .facets import FacetSnapshot
+from .filters import AllowedRows, ConstraintIndex
+from .index_build import IndexBuilder, content_hashes, plan_incremental_update
+from .index_types import build_index, exact_search, read_index, reconstruct_rows, search_parameters, write_index
+from .label_embeddings import LabelEmbeddingTable
+from .lexical import BM25_B, BM25_K1, LEXICAL_FIELDS, LexicalIndex, reciprocal_rank_fusion, tokenize
+from .langchain_service_fast import (
+    CURRENT_VERSION_FILE, VECTORS_FILE, VERSIONS_DIR, UniversityRecommendationService, current_version_path,
+)
+from .result_cache import RecommendationCache, normalize_preferences, result_key
+from .scoring import calculate_match_percentages, top_k_indices
+from .service_loader import ServiceLoader
+from .singleflight import SingleFlight
+from .typeahead import TYPEAHEAD_MAX_LIMIT, TypeaheadIndex
+from .universities import UniversityIndex
+
+
+def _unique_bytes():
+    """Resident bytes that belong to this process alone (not shared with any other process)"""
+    total = 0
+    with open('/proc/self/smaps_rollup', 'r') as f:
+        for line in f:
+            fields = line.split()
+            if fields and fields[0] in ('Private_Clean:', 'Private_Dirty:'):
+                total += int(fields[1]) * 1024
+    return total
+
+
+def _worker(directory, mmap, queries, barrier, results):
+    before = _unique_bytes()
+    index = read_index(os.path.join(directory, 'index.faiss'), mmap=mmap)
+    catalog = CourseCatalog.load(os.path.join(directory, CATALOG_FILE), mmap=mmap)
+    # A flat search reads every stored vector; the sums read every catalog column
+    index.search(queries, 10)
+    for column in catalog.columns.values():
+        column.values.sum()
+    barrier.wait()  # every worker has the files mapped and paged in
+    results.put(_unique_bytes() - before)
+    barrier.wait()  # keep the mappings alive until every worker has measured
+
+
+@unittest.skipUnless(sys.platform.startswith('linux'), "needs /proc/self/smaps_rollup and fork")
+class MemoryMappedIndexTests(SimpleTestCase):
+    WORKERS = 3
+    ROWS = 20000
+    DIMENSION = 128
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        rng = np.random.default_rng(0)
+        self.vectors = rng.standard_normal((self.ROWS, self.DIMENSION)).astype(np.float32)
+        index = faiss.IndexFlatL2(self.DIMENSION)
+        index.add(self.vectors)
+        faiss.write_index(index, os.path.join(self.directory, 'index.faiss'))
+
+        records = [
+            {
+                'university_course_id': row,
+                'university_name': f"University {row % 500}",
+                'country_name': ('Canada', 'Germany', 'Australia')[row % 3],
+                'university_course_tuition_usd': float(row % 50) * 1000,
+            }
+            for row in range(self.ROWS)
+        ]
+        self.catalog = CourseCatalog.from_records(records)
+        self.catalog.save(os.path.join(self.directory, CATALOG_FILE))
+        self.queries = self.vectors[:8]
+
+    def tearDown(self):
+        for name in os.listdir(self.directory):
+            os.remove(os.path.join(self.directory, name))
+        os.rmdir(self.directory)
+
+    def test_mapped_index_and_catalog_match_in_memory_copies(self):
+        mapped = read_index(os.path.join(self.directory, 'index.faiss'), mmap=True)
+        loaded = read_index(os.path.join(self.directory, 'index.faiss'), mmap=False)
+        np.testing.assert_array_equal(mapped.search(self.queries, 10)[1], loaded.search(self.queries, 10)[1])
+
+        catalog = CourseCatalog.load(os.path.join(self.directory, CATALOG_FILE), mmap=True)
+        self.assertEqual(len(catalog), self.ROWS)
+        for row_id in (0, 1, 4321, self.ROWS - 1):
+            self.assertEqual(catalog.row(row_id), self.catalog.row(row_id))
+        self.assertEqual(catalog.value_counts('country'), self.catalog.value_counts('country'))
+
+    def _unique_memory_per_worker(self, mmap):
+        context = multiprocessing.get_context('fork')
+        barrier = context.Barrier(self.WORKERS)
+        results = context.Queue()
+        workers = [
+            context.Process(target=_worker, args=(self.directory, mmap, self.queries, barrier, results))
+            for _ in range(self.WORKERS)
+        ]
+        for worker in workers:
+            worker.start()
+        unique = [results.get(timeout=60) for _ in workers]
+        for worker in workers:
+            worker.join(timeout=60)
+            self.assertEqual(worker.exitcode, 0)
+        return unique
+
+    def test_workers_share_one_copy_of_the_mapped_files(self):
+        data_bytes = self.vectors.nbytes + sum(c.values.nbytes for c in self.catalog.columns.values())
+        mapped = self._unique_memory_per_worker(mmap=True)
+        copied = self._unique_memory_per_worker(mmap=False)
+        # Both include the copy-on-write pages every forked interpreter dirties; on top of that a
+        # worker holding its own copy owns all of the data, a mapping worker owns none of it
+        for worker_bytes in mapped:
+            self.assertLess(worker_bytes, data_bytes / 4)
+        self.assertGreater(min(copied) - max(mapped), 0.9 * data_bytes)
+
+
+def _reference_match_percentage(course_metadata, preferences):
+    """The per-document scorer calculate_match_percentages replaced, kept verbatim as the parity reference"""
+    match_points = 0
+    total_points = 0
+
+    if preferences.get('desired_program'):
+        total_points += 25
+        if course_metadata.get('parent_course') and preferences['desired_program'].lower() in course_metadata['parent_course'].lower():
+            match_points += 25
+        elif course_metadata.get('course_name') and preferences['desired_program'].lower() in course_metadata['course_name'].lower():
+            match_points += 20
+
+    if preferences.get('program_level'):
+        total_points += 15
+        if course_metadata.get('program_type') and preferences['program_level'].lower() in course_metadata['program_type'].lower():
+            match_points += 15
+
+    if preferences.get('preferred_countries'):
+        total_points += 20
+        if course_metadata.get('country') and course_metadata['country'] in preferences['preferred_countries']:
+            match_points += 20
+
+    if preferences.get('university_types'):
+        total_points += 15
+        if course_metadata.get('university_type') and course_metadata['university_type'] in preferences['university_types']:
+            match_points += 15
+
+    if preferences.get('max_tuition_usd') and course_metadata.get('tuition_usd'):
+        total_points += 15
+        if course_metadata['tuition_usd'] <= preferences['max_tuition_usd']:
+            match_points += 15
+
+    if preferences.get('min_global_rank') and course_metadata.get('global_rank'):
+        total_points += 10
+        if course_metadata['global_rank'] <= preferences['min_global_rank']:
+            match_points += 10
+
+    return (match_points / total_points * 100) if total_points > 0 else 0
+
+
+SCORING_RECORDS = [
+    {'parent_course_name': 'Computer Science', 'university_course_name': 'MSc Computer Science',
+     'program_type': "Master's", 'country_name': 'Germany', 'university_type': 'Public',
+     'university_course_tuition_usd': 12000.0, 'university_global_rank': 150},
+    {'parent_course_name': 'Engineering', 'university_course_name': 'Data Science and Computer Engineering',
+     'program_type': "Bachelor's", 'country_name': 'Canada', 'university_type': 'Private',
+     'university_course_tuition_usd': 0, 'university_global_rank': 0},
+    {'parent_course_name': None, 'university_course_name': 'Computer Science Foundations',
+     'program_type': None, 'country_name': None, 'university_type': None,
+     'university_course_tuition_usd': None, 'university_global_rank': None},
+    {'parent_course_name': 'Business', 'university_course_name': 'MBA', 'program_type': "Master's",
+     'country_name': 'Canada', 'university_type': 'Public',
+     'university_course_tuition_usd': 45000.5, 'university_global_rank': 40},
+    {'parent_course_name': 'Medicine', 'university_course_name': 'Medicine', 'program_type': 'PhD',
+     'country_name': 'Australia', 'university_type': 'Private',
+     'university_course_tuition_usd': 20000.0, 'university_global_rank': 900},
+]
+
+
+class ScoringParityTests(SimpleTestCase):
+    """The vectorized scorer against the per-document scorer it replaced"""
+
+    def setUp(self):
+        self.catalog = CourseCatalog.from_records(SCORING_RECORDS)
+        self.row_ids = np.arange(len(SCORING_RECORDS))
+
+    def assertMatchesReference(self, preferences):
+        expected = [_reference_match_percentage(self.catalog.row(row), preferences) for row in self.row_ids]
+        np.testing.assert_allclose(calculate_match_percentages(self.catalog, self.row_ids, preferences), expected)
+
+    def test_text_preferences(self):
+        self.assertMatchesReference({'desired_program': 'computer science'})
+        self.assertMatchesReference({'desired_program': 'Data Science', 'program_level': "master's"})
+        self.assertMatchesReference({'desired_program': 'Astrophysics'})
+
+    def test_known_and_unknown_tuition_and_rank(self):
+        # Rows with 0 or no tuition/rank leave those criteria out of their total
+        self.assertMatchesReference({'max_tuition_usd': 20000})
+        self.assertMatchesReference({'min_global_rank': 100})
+        self.assertMatchesReference({'max_tuition_usd': 50000, 'min_global_rank': 1000})
+        self.assertMatchesReference({'desired_program': 'Medicine', 'max_tuition_usd': 20000.0, 'min_global_rank': 900})
+
+    def test_list_preferences(self):
+        self.assertMatchesReference({'preferred_countries': ['Canada']})
+        self.assertMatchesReference({'preferred_countries': ['Canada', 'Germany', 'Canada']})
+        self.assertMatchesReference({'preferred_countries': ['Iceland'], 'university_types': ['Public', 'Unknown']})
+        self.assertMatchesReference({'university_types': ['Private'], 'preferred_countries': ['Australia', 'Germany']})
+
+    def test_all_preferences(self):
+        self.assertMatchesReference({
+            'desired_program': 'Computer', 'program_level': 'Master', 'preferred_countries': ['Germany', 'Canada'],
+            'university_types': ['Public'], 'max_tuition_usd': 15000, 'min_global_rank': 200,
+        })
+
+    def test_no_preferences_scores_zero(self):
+        self.assertMatchesReference({})
+        np.testing.assert_array_equal(calculate_match_percentages(self.catalog, self.row_ids, {}), 0)
+
+    def test_top_k_ties_keep_search_order(self):
+        relevance = np.array([0.5, 0.9, 0.5, 0.9, 0.1, 0.5])
+        self.assertEqual(top_k_indices(relevance, 3).tolist(), [1, 3, 0])
+        self.assertEqual(top_k_indices(relevance, 4).tolist(), [1, 3, 0, 2])
+        self.assertEqual(top_k_indices(np.zeros(5), 2).tolist(), [0, 1])
+
+    def test_top_k_matches_a_stable_sort(self):
+        rng = np.random.default_rng(0)
+        for _ in range(200):
+            relevance = rng.integers(0, 5, rng.integers(1, 200)).astype(np.float64)
+            k = int(rng.integers(1, len(relevance) + 1))
+            self.assertEqual(top_k_indices(relevance, k).tolist(), np.argsort(-relevance, kind='stable')[:k].tolist())
+
+    def test_top_k_larger_than_candidates(self):
+        relevance = np.array([0.2, 0.7, 0.4])
+        self.assertEqual(top_k_indices(relevance, 10).tolist(), [1, 2, 0])
+        self.assertEqual(top_k_indices(relevance, 3).tolist(), [1, 2, 0])
+        self.assertEqual(top_k_indices(relevance, 0).tolist(), [])
+        self.assertEqual(top_k_indices(np.empty(0), 5).tolist(), [])
+
+
+class ConstraintIndexTests(SimpleTestCase):
+    ROWS = 640
+
+    def setUp(self):
+        # Every 50th course has tuition 0 and every 7th has no rank: both mean unknown
+        self.records = [
+            {
+                'country_name': ('Iceland' if row % 64 == 1 else 'Canada') if row % 2 else 'Germany',
+                'university_type': ('Public', 'Private')[row % 2],
+                'university_course_tuition_usd': float(row % 50) * 1000,
+                'university_global_rank': None if row % 7 == 0 else row % 300,
+            }
+            for row in range(self.ROWS)
+        ]
+        self.constraints = ConstraintIndex(CourseCatalog.from_records(self.records))
+
+    def expected(self, keep):
+        return [row for row, record in enumerate(self.records) if keep(record)]
+
+    def test_unknown_tuition_and_rank_never_pass_a_maximum(self):
+        allowed = self.constraints.allowed_rows({'max_tuition_usd': 20000})
+        self.assertEqual(allowed.ids.tolist(), self.expected(lambda r: 0 < r['university_course_tuition_usd'] <= 20000))
+        allowed = self.constraints.allowed_rows({'min_global_rank': 100})
+        self.assertEqual(allowed.ids.tolist(), self.expected(lambda r: bool(r['university_global_rank']) and r['university_global_rank'] <= 100))
+
+    def test_selective_and_broad_paths_agree(self):
+        # Iceland is rare enough to take the selective path, Germany takes the bitmap path
+        for country in ('Iceland', 'Germany'):
+            allowed = self.constraints.allowed_rows({
+                'preferred_countries': [country], 'max_tuition_usd': 10000, 'min_global_rank': 250,
+            })
+            self.assertEqual(allowed.ids.tolist(), self.expected(
+                lambda r: r['country_name'] == country
+                and 0 < r['university_course_tuition_usd'] <= 10000
+                and bool(r['university_global_rank']) and r['university_global_rank'] <= 250
+            ))
+
+    def test_no_constraints(self):
+        self.assertIsNone(self.constraints.allowed_rows({'desired_program': 'Law'}))
+        self.assertEqual(len(self.constraints.allowed_rows({'preferred_countries': ['Atlantis']})), 0)
+
+
+class FilteredSearchTests(SimpleTestCase):
+    """Strict filters on approximate indexes must find what an exhaustive search finds"""
+
+    DIM = 32
+    K = 20
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        rng = np.random.default_rng(3)
+        centers = rng.standard_normal((100, cls.DIM)).astype(np.float32) * 4
+        cls.vectors = (centers[rng.integers(0, 100, 20000)]
+                       + rng.standard_normal((20000, cls.DIM)).astype(np.float32))
+        cls.queries = rng.standard_normal((4, cls.DIM)).astype(np.float32) * 4
+        cls.ivf = faiss.IndexIVFFlat(faiss.IndexFlatL2(cls.DIM), cls.DIM, 256)
+        cls.ivf.train(cls.vectors)
+        cls.ivf.add(cls.vectors)
+        cls.ivf.nprobe = 4
+        cls.hnsw = faiss.IndexHNSWFlat(cls.DIM, 16)
+        cls.hnsw.add(cls.vectors)
+        cls.hnsw.hnsw.efSearch = 16
+
+    def service(self, index):
+        service = UniversityRecommendationService.__new__(UniversityRecommendationService)
+        service.vector_store = SimpleNamespace(index=index)
+        return service
+
+    def brute_force(self, ids, k):
+        distances = ((self.queries[:, None, :] - self.vectors[ids][None, :, :]) ** 2).sum(axis=2)
+        return [ids[np.argsort(row, kind='stable')[:k]] for row in distances]
+
+    def test_exact_search_matches_brute_force(self):
+        ids = np.arange(5, 20000, 150)
+        distances, labels = exact_search(self.ivf, self.queries, ids, self.K)
+        for found, expected in zip(labels, self.brute_force(ids, self.K)):
+            self.assertEqual(found.tolist(), expected.tolist())
+        self.assertTrue(np.all(np.diff(distances, axis=1) >= 0))
+        # Fewer allowed rows than k: every allowed row, no padding
+        _, labels = exact_search(self.ivf, self.queries, ids[:3], self.K)
+        self.assertEqual(labels.shape, (len(self.queries), 3))
+
+    def test_selective_filter_finds_all_allowed_rows(self):
+        ids = np.arange(7, 20000, 140)  # 143 rows spread over every list
+        for index in (self.ivf, self.hnsw):
+            results = self.service(index)._search(self.queries, self.K, AllowedRows(ids))
+            for (found, _), expected in zip(results, self.brute_force(ids, self.K)):
+                self.assertEqual(found.tolist(), expected.tolist())
+
+    def test_search_parameters_widen_with_selectivity(self):
+        selector = AllowedRows(np.arange(10)).selector()
+        self.assertEqual(search_parameters(self.ivf, selector).nprobe, 4)
+        self.assertEqual(search_parameters(self.ivf, selector, selectivity=0.25).nprobe, 16)
+        self.assertEqual(search_parameters(self.ivf, selector, selectivity=0.001).nprobe, 256)
+        self.assertEqual(search_parameters(self.hnsw, selector, selectivity=0.5).efSearch, 32)
+
+    def test_broad_filter_returns_k_rows(self):
+        ids = np.arange(0, 20000, 4)  # 5000 rows: above the exact-search limit
+        bitmap = np.packbits(np.isin(np.arange(20000), ids), bitorder='little')
+        for index in (self.ivf, self.hnsw):
+            results = self.service(index)._search(self.queries, self.K, AllowedRows(ids, bitmap))
+            for found, _ in results:
+                self.assertEqual(len(found), self.K)
+                self.assertTrue(np.all(found % 4 == 0))
+
+
+def _cache_worker(cache, results):
+    inherited = cache._local.connection
+    vector = cache.get('written by the parent')
+    cache.put('written by the child', [3.0, 4.0])
+    results.put((vector.tolist(), cache._local.connection is not inherited, cache.stats()['disk_hits']))
+
+
+class QueryEmbeddingCacheTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'query_embedding_cache.sqlite3')
+
+    def test_memory_tier_evicts_least_recently_used(self):
+        cache = QueryEmbeddingCache('model', memory_size=2)
+        cache.put('a', [1.0])
+        cache.put('b', [2.0])
+        cache.get('a')
+        cache.put('c', [3.0])
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a').tolist(), [1.0])
+        self.assertEqual(cache.get('c').tolist(), [3.0])
+        self.assertEqual(cache.stats(), {'memory_hits': 3, 'disk_hits': 0, 'misses': 1, 'memory_entries': 2})
+
+    def test_disk_tier_is_shared_between_instances(self):
+        QueryEmbeddingCache('model', path=self.path).put('Computer Science', [1.0, 2.0])
+        cache = QueryEmbeddingCache('model', path=self.path)
+        self.assertEqual(cache.get('  computer   SCIENCE ').tolist(), [1.0, 2.0])
+        self.assertEqual(cache.get('computer science').tolist(), [1.0, 2.0])
+        self.assertEqual(cache.stats()['disk_hits'], 1)
+        self.assertEqual(cache.stats()['memory_hits'], 1)
+        # Another model never sees these vectors
+        self.assertIsNone(QueryEmbeddingCache('other model', path=self.path).get('computer science'))
+
+    def test_disk_tier_evicts_least_recently_used(self):
+        writer = QueryEmbeddingCache('model', path=self.path, memory_size=0, disk_size=3)
+        writer.EVICTION_INTERVAL = 1
+        for i in range(3):
+            writer.put(f"q{i}", [float(i)])
+        writer.get('q0')  # now more recently used than q1 and q2
+        writer.put('q3', [3.0])
+        writer.put('q4', [4.0])
+
+        reader = QueryEmbeddingCache('model', path=self.path)
+        self.assertEqual([reader.get(f"q{i}") is not None for i in range(5)], [True, False, False, True, True])
+
+    @unittest.skipUnless(sys.platform.startswith('linux'), "needs fork")
+    def test_forked_child_opens_its_own_connection(self):
+        cache = QueryEmbeddingCache('model', path=self.path, memory_size=0)
+        QueryEmbeddingCache('model', path=self.path).put('written by the parent', [1.0, 2.0])
+        self.assertIsNone(cache.get('not cached'))  # the parent's connection is open before the fork
+
+        context = multiprocessing.get_context('fork')
+        results = context.Queue()
+        child = context.Process(target=_cache_worker, args=(cache, results))
+        child.start()
+        vector, reconnected, disk_hits = results.get(timeout=60)
+        child.join(timeout=60)
+        self.assertEqual(child.exitcode, 0)
+        self.assertEqual(vector, [1.0, 2.0])
+        self.assertTrue(reconnected)
+        self.assertEqual(disk_hits, 1)
+        # The parent's connection still works and sees what the child wrote
+        self.assertEqual(cache.get('written by the child').tolist(), [3.0, 4.0])
+
+    def test_async_embedding_reads_disk_off_the_event_loop(self):
+        threads = set()
+
+        class RecordingCache(QueryEmbeddingCache):
+            def _connection(self):
+                threads.add(threading.get_ident())
+                return super()._connection()
+
+        QueryEmbeddingCache('hashing', path=self.path).put('on disk', HashingEmbeddings(16).embed_query('on disk'))
+        cache = RecordingCache('hashing', path=self.path)
+        cache.put('in memory', HashingEmbeddings(16).embed_query('in memory'))
+        embeddings = CachedQueryEmbeddings(HashingEmbeddings(16), cache)
+        threads.clear()
+
+        async def embed():
+            return threading.get_ident(), await embeddings.aembed_queries(['in memory', 'on disk', 'new'])
+
+        loop_thread, vectors = asyncio.run(embed())
+        self.assertTrue(threads)
+        self.assertNotIn(loop_thread, threads)
+        np.testing.assert_array_equal(
+            vectors, np.array(HashingEmbeddings(16).embed_documents(['in memory', 'on disk', 'new']), dtype=np.float32)
+        )
+        self.assertEqual(cache.stats(), {'memory_hits': 1, 'disk_hits': 1, 'misses': 1, 'memory_entries': 3})
+        self.assertIsNotNone(QueryEmbeddingCache('hashing', path=self.path).get('new'))
+
+    def test_close_closes_the_connections_of_every_thread(self):
+        cache = QueryEmbeddingCache('model', path=self.path, memory_size=0)
+        cache.put('a', [1.0])
+        with ThreadPoolExecutor(2) as pool:
+            list(pool.map(cache.get, ['a', 'b']))
+        connections = [connection for _, connection in cache._connections]
+        self.assertGreaterEqual(len(connections), 2)
+        cache.close()
+        for connection in connections:
+            with self.assertRaises(sqlite3.ProgrammingError):
+                connection.execute("SELECT 1")
+        # A closed cache reconnects on its next use
+        self.assertEqual(cache.get('a').tolist(), [1.0])
+
+
+class LabelEmbeddingTableTests(SimpleTestCase):
+    PROGRAMS = ('Computer Science', 'Mechanical Engineering', 'Business Administration', 'Nursing',
+                'Economics', 'Architecture', 'Data Science', 'International Law')
+    COUNTRIES = ('Canada', 'Germany', 'Australia', 'Japan', 'Netherlands')
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        records = [
+            {
+                'university_course_id': row,
+                'university_id': row % 90,
+                'university_name': f"University {row % 90}",
+                'university_course_name': f"{cls.PROGRAMS[row % 8]} {('Foundations', 'Studies', 'Practice')[row % 3]}",
+                'parent_course_name': cls.PROGRAMS[row % 8],
+                'program_type': ('Bachelor', 'Master', 'PhD')[row % 3],
+                'country_name': cls.COUNTRIES[row % 5],
+                'university_type': ('Public', 'Private')[row % 2],
+            }
+            for row in range(1200)
+        ]
+        cls.catalog = CourseCatalog.from_records(records)
+        cls.embeddings = CachedQueryEmbeddings(HashingEmbeddings(256), QueryEmbeddingCache('hashing'))
+        cls.table = LabelEmbeddingTable.build(cls.catalog, cls.embeddings, 'hashing', 'build-1')
+        cls.index = faiss.IndexFlatL2(256)
+        cls.index.add(np.array(cls.embeddings.embed_documents(list(DocumentTexts(cls.catalog))), dtype=np.float32))
+        cls.service = UniversityRecommendationService.__new__(UniversityRecommendationService)
+
+    def test_labels_are_looked_up_case_and_space_insensitively(self):
+        expected = self.table.compose({'desired_program': 'Computer Science', 'preferred_countries': ['Canada']})
+        composed = self.table.compose({'desired_program': ' computer  SCIENCE', 'preferred_countries': ['canada']})
+        np.testing.assert_array_equal(composed, expected)
+        self.assertIsNone(self.table.compose({'desired_program': 'Astrology'}))
+
+    def test_save_and_load_keep_the_catalog_labels(self):
+        with tempfile.TemporaryDirectory() as directory:
+            self.table.save(directory)
+            loaded = LabelEmbeddingTable.load(directory, 'hashing', 'build-1')
+            with self.assertLogs('recommendations.label_embeddings', 'WARNING'):
+                self.assertIsNone(LabelEmbeddingTable.load(directory, 'another model', 'build-1'))
+            # A table belongs to the index version it was built for
+            with self.assertLogs('recommendations.label_embeddings', 'WARNING'):
+                self.assertIsNone(LabelEmbeddingTable.load(directory, 'hashing', 'build-2'))
+        self.assertEqual(len(loaded), len(self.table))
+        self.assertIn('Computer Science', loaded.labels.tolist())
+        np.testing.assert_array_equal(loaded.vector('degree', 'master'), self.table.vector('degree', 'Master'))
+
+    def test_composed_vectors_retrieve_like_live_query_embeddings(self):
+        k = 20
+        overlaps = []
+        for i, program in enumerate(self.PROGRAMS):
+            preferences = {
+                'desired_program': program.lower() if i % 2 else program,
+                'program_type': ('Bachelor', 'Master', 'PhD')[i % 3],
+                'preferred_countries': [self.COUNTRIES[i % 5], self.COUNTRIES[(i + 2) % 5]],
+            }
+            query = self.service._create_query_from_preferences(preferences)
+            live = self.embeddings.embed_queries([query])
+            composed = self.table.compose(preferences).reshape(1, -1)
+            _, live_rows = self.index.search(live, k)
+            _, composed_rows = self.index.search(composed, k)
+            overlaps.append(len(set(live_rows[0]) & set(composed_rows[0])) / k)
+        self.assertGreaterEqual(np.mean(overlaps), 0.6, overlaps)
+
+
+def _service_worker(barrier, results):
+    logging.disable(logging.CRITICAL)
+    barrier.wait()
+    try:
+        results.put(UniversityRecommendationService().index_version)
+    except Exception as e:
+        results.put(repr(e))
+
+
+def _write_dataset(path, rows):
+    records = [
+        {
+            'university_id': row % 40,
+            'university_course_id': 1000 + row,
+            'university_name': f"University {row % 40}",
+            'university_course_name': f"{('Computer Science', 'Law', 'Nursing')[row % 3]} {row}",
+            'parent_course_name': ('Computer Science', 'Law', 'Nursing')[row % 3],
+            'program_level': ('undergraduate', 'postgraduate')[row % 2],
+            'program_type': ('Bachelor', 'Master')[row % 2],
+            'country_name': ('Canada', 'Germany', 'Japan')[row % 3],
+            'location_name': f"City {row % 7}",
+            'university_type': ('Public', 'Private')[row % 2],
+            'university_course_tuition_usd': 1000 * (row % 30),
+            'university_global_rank': row % 500 or None,
+        }
+        for row in range(rows)
+    ]
+    with open(path, 'w') as f:
+        json.dump(records, f)
+
+
+class ServiceTestMixin:
+    """Builds services from a small generated dataset with offline embeddings, in a scratch BASE_DIR"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.base_dir = directory.name
+        self.cache_path = os.path.join(self.base_dir, 'vector_store_cache')
+        self.dataset_path = os.path.join(self.base_dir, 'dataset.json')
+        _write_dataset(self.dataset_path, 300)
+        overrides = override_settings(
+            BASE_DIR=self.base_dir,
+            UNIVERSITY_DATASET_PATH=self.dataset_path,
+            EMBEDDING_BACKEND='local',
+            LOCAL_EMBEDDING_DIMENSION=64,
+            QUERY_EMBEDDING_CACHE_PATH=os.path.join(self.base_dir, 'query_embedding_cache.sqlite3'),
+            RECOMMENDATION_CACHE_ENABLED=False,
+            FAISS_INDEX_TYPE='flat',
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        logging.disable(logging.CRITICAL)
+        self.addCleanup(logging.disable, logging.NOTSET)
+
+    def service(self):
+        service = UniversityRecommendationService()
+        self.addCleanup(service.close)
+        return service
+
+
+class ServiceTestCase(ServiceTestMixin, SimpleTestCase):
+    pass
+
+
+class CacheBuildTests(ServiceTestCase):
+    def test_save_leaves_no_staging_directories(self):
+        service = self.service()
+        os.makedirs(os.path.join(self.cache_path, VERSIONS_DIR, '.staging-crashed'))
+        service._save_cache(self.cache_path, DocumentTexts(service.catalog), version=2)
+        self.assertEqual(glob.glob(os.path.join(self.cache_path, VERSIONS_DIR, '.staging*')), [])
+        self.assertEqual(self.service().index_version, service.index_version)
+
+    @unittest.skipUnless(sys.platform.startswith('linux'), "needs fork")
+    def test_concurrent_processes_build_the_cache_once(self):
+        context = multiprocessing.get_context('fork')
+        barrier = context.Barrier(2)
+        results = context.Queue()
+        workers = [context.Process(target=_service_worker, args=(barrier, results)) for _ in range(2)]
+        for worker in workers:
+            worker.start()
+        versions = [results.get(timeout=60) for _ in workers]
+        for worker in workers:
+            worker.join(timeout=60)
+            self.assertEqual(worker.exitcode, 0)
+        # The process that waited for the lock loaded the cache the other one built
+        self.assertEqual(versions[0], versions[1])
+        with open(os.path.join(current_version_path(self.cache_path), 'manifest.json')) as f:
+            self.assertEqual(json.load(f)['build_id'], versions[0])
+        self.assertFalse(os.path.exists(os.path.join(self.base_dir, 'vector_store_checkpoint')))
+
+
+class HashingEmbeddingsTests(SimpleTestCase):
+    TEXTS = ['Computer Science at University 1', 'Law', 'computer   SCIENCE at university 1', 'Zürich, Switzerland']
+
+    def test_vectors(self):
+        vectors = np.array(HashingEmbeddings(96).embed_documents(self.TEXTS))
+        self.assertEqual(vectors.shape, (4, 96))
+        np.testing.assert_allclose(np.linalg.norm(vectors, axis=1), 1, rtol=1e-6)
+        # Case and spacing do not change the features
+        np.testing.assert_array_equal(vectors[0], vectors[2])
+        self.assertLess(vectors[0] @ vectors[3], 0.9)
+        self.assertEqual(HashingEmbeddings(96).embed_query(self.TEXTS[1]), vectors[1].tolist())
+
+    def test_deterministic_across_instances_and_processes(self):
+        vectors = HashingEmbeddings(64).embed_documents(self.TEXTS)
+        self.assertEqual(HashingEmbeddings(64).embed_documents(self.TEXTS), vectors)
+        # CRC32 rather than hash(), which is salted per process
+        code = ("import json, sys; from recommendations.embeddings import HashingEmbeddings; "
+                "print(json.dumps(HashingEmbeddings(64).embed_documents(json.loads(sys.argv[1]))))")
+        env = dict(os.environ, PYTHONHASHSEED='random', DJANGO_SETTINGS_MODULE='university_recommender.settings')
+        output = subprocess.run([sys.executable, '-c', code, json.dumps(self.TEXTS)], check=True, capture_output=True,
+                                text=True, env=env, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        self.assertEqual(json.loads(output.stdout), vectors)
+
+    def test_text_without_words_is_a_zero_vector(self):
+        for text in ('', '  ', '!?'):
+            self.assertEqual(HashingEmbeddings(8).embed_query(text), [0.0] * 8)
+
+    def test_backend_setting(self):
+        with self.settings(EMBEDDING_BACKEND='local', LOCAL_EMBEDDING_DIMENSION=32):
+            embeddings, model_name = get_embedding_backend()
+        self.assertIsInstance(embeddings, HashingEmbeddings)
+        self.assertEqual((embeddings.dimension, model_name), (32, 'local-hashing-v1-32'))
+
+        genai = SimpleNamespace(GoogleGenerativeAIEmbeddings=mock.Mock())
+        with self.settings(EMBEDDING_BACKEND='gemini', GEMINI_API_KEY='key'), \
+                mock.patch.dict(sys.modules, {'langchain_google_genai': genai}):
+            embeddings, model_name = get_embedding_backend()
+        self.assertEqual(model_name, 'models/embedding-001')
+        self.assertIs(embeddings, genai.GoogleGenerativeAIEmbeddings.return_value)
+        genai.GoogleGenerativeAIEmbeddings.assert_called_once_with(model=model_name, google_api_key='key')
+
+        with self.settings(EMBEDDING_BACKEND='openai'), self.assertRaisesRegex(ValueError, 'openai'):
+            get_embedding_backend()
+
+
+class EmbeddingModelChangeTests(ServiceTestCase):
+    def test_cache_of_another_model_is_rebuilt(self):
+        service = self.service()
+        self.assertEqual(service.vector_store.index.d, 64)
+        with self.settings(LOCAL_EMBEDDING_DIMENSION=32):
+            rebuilt = self.service()
+        self.assertNotEqual(rebuilt.index_version, service.index_version)
+        self.assertEqual((rebuilt.embedding_model, rebuilt.vector_store.index.d), ('local-hashing-v1-32', 32))
+        with open(os.path.join(current_version_path(self.cache_path), 'manifest.json')) as f:
+            self.assertEqual(json.load(f)['embedding_model'], 'local-hashing-v1-32')
+        self.assertEqual(len(rebuilt.get_recommendations({'desired_program': 'Law'}, top_k=3)), 3)
+
+
+class _FlakyEmbeddings(HashingEmbeddings):
+    """Records every batch it embeds and fails the first ``failures`` attempts at batches starting with ``fail_on``"""
+
+    def __init__(self, fail_on=None, failures=0):
+        super().__init__(16)
+        self.fail_on = fail_on
+        self.failures = failures
+        self.batches = []
+
+    def embed_documents(self, texts):
+        if texts[0] == self.fail_on and self.failures:
+            self.failures -= 1
+            raise RuntimeError("rate limited")
+        self.batches.append(texts[0])
+        return super().embed_documents(texts)
+
+
+class IndexBuilderTests(SimpleTestCase):
+    TEXTS = [f"Course {row}" for row in range(10)]
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.checkpoint_dir = os.path.join(directory.name, 'checkpoint')
+        patcher = mock.patch('recommendations.index_build.time.sleep')
+        self.sleep = patcher.start()
+        self.addCleanup(patcher.stop)
+        logging.disable(logging.CRITICAL)
+        self.addCleanup(logging.disable, logging.NOTSET)
+
+    def builder(self, embeddings, batch_size=2, **kwargs):
+        return IndexBuilder(embeddings, embeddings.model_name, self.checkpoint_dir, batch_size=batch_size, **kwargs)
+
+    def expected(self):
+        return np.array(HashingEmbeddings(16).embed_documents(self.TEXTS), dtype=np.float32)
+
+    def test_build_resumes_from_checkpoints(self):
+        failing = _FlakyEmbeddings(fail_on='Course 4', failures=1)
+        with self.assertRaises(RuntimeError):
+            self.builder(failing, max_retries=1).build(self.TEXTS)
+        self.assertNotIn('Course 4', failing.batches)
+        checkpoints = sorted(os.listdir(self.checkpoint_dir))
+        self.assertIn(IndexBuilder.CHECKPOINT_MANIFEST, checkpoints)
+        self.assertNotIn('batch_000002.npy', checkpoints)
+
+        resumed = _FlakyEmbeddings()
+        progress = []
+        vectors = self.builder(resumed, progress=lambda done, total: progress.append((done, total))).build(self.TEXTS)
+        np.testing.assert_array_equal(vectors, self.expected())
+        # Only the batches without a checkpoint were embedded again
+        self.assertEqual(sorted(resumed.batches), sorted(set(self.TEXTS[::2]) - set(failing.batches)))
+        self.assertEqual(progress[0], (2 * len(failing.batches), 10))
+        self.assertEqual(progress[-1], (10, 10))
+
+    def test_failed_batches_are_retried_with_backoff(self):
+        embeddings = _FlakyEmbeddings(fail_on='Course 2', failures=2)
+        vectors = self.builder(embeddings, max_workers=1, max_retries=3).build(self.TEXTS)
+        np.testing.assert_array_equal(vectors, self.expected())
+        self.assertEqual([call.args for call in self.sleep.call_args_list], [(2,), (4,)])
+
+        self.sleep.reset_mock()
+        IndexBuilder(None, 'other', self.checkpoint_dir).clear()
+        with self.assertRaisesRegex(RuntimeError, 'rate limited'):
+            self.builder(_FlakyEmbeddings(fail_on='Course 2', failures=3), max_retries=3).build(self.TEXTS)
+        self.assertEqual([call.args for call in self.sleep.call_args_list], [(2,), (4,)])
+
+    def test_checkpoints_of_another_fingerprint_are_discarded(self):
+        self.builder(_FlakyEmbeddings()).build(self.TEXTS)
+        for batch_size, texts in ((3, self.TEXTS), (3, self.TEXTS[:-1] + ['Course ten'])):
+            embeddings = _FlakyEmbeddings()
+            vectors = self.builder(embeddings, batch_size=batch_size).build(texts)
+            self.assertEqual(sorted(embeddings.batches), sorted(texts[::batch_size]))
+            np.testing.assert_array_equal(vectors, np.array(HashingEmbeddings(16).embed_documents(texts), dtype=np.float32))
+            with open(os.path.join(self.checkpoint_dir, IndexBuilder.CHECKPOINT_MANIFEST)) as f:
+                self.assertEqual(json.load(f)['batch_size'], batch_size)
+            self.assertEqual(len(glob.glob(os.path.join(self.checkpoint_dir, 'batch_*.npy'))), 4)
+
+        # The same fingerprint again reuses every batch
+        embeddings = _FlakyEmbeddings()
+        self.builder(embeddings, batch_size=3).build(texts)
+        self.assertEqual(embeddings.batches, [])
+
+
+def _directory_digest(path):
+    digest = {}
+    for name in sorted(os.listdir(path)):
+        with open(os.path.join(path, name), 'rb') as f:
+            digest[name] = hashlib.sha256(f.read()).hexdigest()
+    return digest
+
+
+class IncrementalRefreshTests(ServiceTestCase):
+    def setUp(self):
+        super().setUp()
+        overrides = override_settings(LABEL_EMBEDDINGS_ENABLED=False, INDEX_BUILD_BATCH_SIZE=50)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def count_embedded(self):
+        """Texts sent to the document embedder from now on"""
+        texts = []
+        embed = HashingEmbeddings.embed_documents
+
+        def record(embeddings, batch):
+            texts.extend(batch)
+            return embed(embeddings, batch)
+
+        patcher = mock.patch.object(HashingEmbeddings, 'embed_documents', autospec=True, side_effect=record)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return texts
+
+    def count_plans(self):
+        plans = []
+
+        def plan(*args):
+            reuse, stats = plan_incremental_update(*args)
+            plans.append(stats)
+            return reuse, stats
+
+        patcher = mock.patch('recommendations.langchain_service_fast.plan_incremental_update', side_effect=plan)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return plans
+
+    def edit_dataset(self, edit):
+        with open(self.dataset_path) as f:
+            records = json.load(f)
+        edit(records)
+        with open(self.dataset_path, 'w') as f:
+            json.dump(records, f)
+
+    def manifest(self):
+        with open(os.path.join(current_version_path(self.cache_path), 'manifest.json')) as f:
+            return json.load(f)
+
+    def test_plan_incremental_update(self):
+        reuse, stats = plan_incremental_update(
+            np.array(['a', 'b', 'c', 'd']), np.array(['1', '2', '3', '4']),
+            np.array(['b', 'a', 'c', 'e']), np.array(['2', '1', '9', '5']),
+        )
+        self.assertEqual(reuse.tolist(), [1, 0, -1, -1])
+        self.assertEqual(stats, {'added': 1, 'changed': 1, 'removed': 1, 'unchanged': 2})
+
+    def test_refresh_embeds_only_changed_rows(self):
+        service = self.service()
+        old_version_path = service.version_path
+        old_files = _directory_digest(old_version_path)
+        self.assertEqual(self.manifest()['version'], 1)
+
+        def edit(records):
+            records[5]['university_course_name'] = 'Marine Biology 5'
+            del records[7]
+            records.append(dict(records[0], university_course_id=5000, university_course_name='Astronomy 5000'))
+
+        self.edit_dataset(edit)
+        embedded, plans = self.count_embedded(), self.count_plans()
+        refreshed = self.service()
+
+        self.assertEqual(plans, [{'added': 1, 'changed': 1, 'removed': 1, 'unchanged': 298}])
+        self.assertEqual(len(embedded), 2)
+        self.assertTrue(any('Marine Biology 5' in text for text in embedded))
+        self.assertTrue(any('Astronomy 5000' in text for text in embedded))
+
+        manifest = self.manifest()
+        self.assertEqual((manifest['version'], manifest['build_id'], manifest['rows']), (2, refreshed.index_version, 300))
+        self.assertEqual(refreshed.version_path, current_version_path(self.cache_path))
+        with np.load(os.path.join(refreshed.version_path, 'row_hashes.npz')) as data:
+            self.assertEqual(data['keys'].tolist(), refreshed._row_keys().tolist())
+            self.assertEqual(data['hashes'].tolist(), content_hashes(DocumentTexts(refreshed.catalog)).tolist())
+        # The refreshed index holds what a full build would
+        texts = list(DocumentTexts(refreshed.catalog))
+        np.testing.assert_allclose(
+            reconstruct_rows(refreshed.vector_store.index, np.arange(len(texts))),
+            np.array(HashingEmbeddings(64).embed_documents(texts), dtype=np.float32), atol=1e-6,
+        )
+        # The version the first service loaded is untouched, so a process still reading it sees one version
+        self.assertEqual(_directory_digest(old_version_path), old_files)
+
+    def test_saves_keep_the_current_and_previous_versions(self):
+        service = self.service()
+        paths = [service.version_path]
+        for version in (2, 3):
+            service._save_cache(self.cache_path, DocumentTexts(service.catalog), version)
+            paths.append(service.version_path)
+        self.assertEqual(len(set(paths)), 3)
+        self.assertEqual(sorted(os.listdir(os.path.join(self.cache_path, VERSIONS_DIR))),
+                         sorted(os.path.basename(path) for path in paths[1:]))
+        self.assertEqual(current_version_path(self.cache_path), paths[2])
+        self.assertEqual(sorted(os.listdir(self.cache_path)), [CURRENT_VERSION_FILE, VERSIONS_DIR])
+
+    def test_cache_from_before_versions_is_loaded_then_replaced(self):
+        service = self.service()
+        for name in os.listdir(service.version_path):
+            os.replace(os.path.join(service.version_path, name), os.path.join(self.cache_path, name))
+        shutil.rmtree(os.path.join(self.cache_path, VERSIONS_DIR))
+        os.remove(os.path.join(self.cache_path, CURRENT_VERSION_FILE))
+
+        embedded = self.count_embedded()
+        legacy = self.service()
+        self.assertEqual((legacy.version_path, legacy.index_version), (self.cache_path, service.index_version))
+        self.assertEqual(embedded, [])
+
+        legacy._save_cache(self.cache_path, DocumentTexts(legacy.catalog), version=2)
+        self.assertEqual(self.service().index_version, legacy.index_version)
+        legacy._save_cache(self.cache_path, DocumentTexts(legacy.catalog), version=3)
+        # Once no longer the previous version, the old files are gone
+        self.assertEqual(sorted(os.listdir(self.cache_path)), [CURRENT_VERSION_FILE, VERSIONS_DIR])
+
+    def test_full_rebuild_gets_new_label_embeddings(self):
+        with self.settings(LABEL_EMBEDDINGS_ENABLED=True):
+            service = self.service()
+            first_version = service.index_version
+            self.assertEqual(service.label_embeddings.build_id, first_version)
+            service._build_cache(self.cache_path)
+            rebuilt = self.service()
+        self.assertNotEqual(rebuilt.index_version, first_version)
+        self.assertEqual(rebuilt.label_embeddings.build_id, rebuilt.index_version)
+        self.assertIsNotNone(LabelEmbeddingTable.load(rebuilt.version_path, rebuilt.embedding_model, rebuilt.index_version))
+
+    def test_lossy_index_refreshes_from_stored_vectors(self):
+        _write_dataset(self.dataset_path, 700)
+        with self.settings(FAISS_INDEX_TYPE='ivfpq', FAISS_PQ_M=8, FAISS_PQ_NBITS=4):
+            service = self.service()
+            self.assertEqual(service.index_config['type'], 'ivfpq')
+            stored = np.load(os.path.join(service.version_path, VECTORS_FILE))
+            texts = list(DocumentTexts(service.catalog))
+            np.testing.assert_array_equal(stored, np.array(HashingEmbeddings(64).embed_documents(texts), dtype=np.float32))
+
+            self.edit_dataset(lambda records: records[3].update(university_course_name='Marine Biology 3'))
+            embedded = self.count_embedded()
+            refreshed = self.service()
+            self.assertEqual(len(embedded), 1)
+            refreshed_vectors = np.load(os.path.join(refreshed.version_path, VECTORS_FILE))
+            kept = np.arange(700) != 3
+            # Kept rows are copied, not reconstructed from their quantized codes
+            np.testing.assert_array_equal(refreshed_vectors[kept], stored[kept])
+
+            # Without stored vectors a compressed index is rebuilt from scratch
+            os.remove(os.path.join(refreshed.version_path, VECTORS_FILE))
+            self.edit_dataset(lambda records: records[4].update(university_course_name='Marine Biology 4'))
+            del embedded[:]
+            rebuilt = self.service()
+        self.assertEqual(len(embedded), 700)
+        self.assertEqual(rebuilt.vector_store.index.ntotal, 700)
+
+
+def _dataframe_texts(records):
+    """Document texts the way the service rendered them from a DataFrame before the catalog existed"""
+    import pandas as pd
+
+    fields = dict(CATALOG_FIELDS)
+    return [
+        DOCUMENT_TEMPLATE.format(**{key: row.get(fields[key], 'N/A') for key in DOCUMENT_KEYS})
+        for _, row in pd.DataFrame(records).iterrows()
+    ]
+
+
+class FailedInitializationTests(ServiceTestCase):
+    def test_failed_initialization_releases_threads_and_connections(self):
+        closed = []
+        close = UniversityRecommendationService.close
+
+        def record(service):
+            closed.append((service, [connection for _, connection in service.query_cache._connections]))
+            close(service)
+
+        with mock.patch.object(UniversityRecommendationService, 'close', autospec=True, side_effect=record), \
+                mock.patch.object(UniversityRecommendationService, '_prepare_facets', side_effect=RuntimeError('boom')):
+            with self.assertRaisesMessage(RuntimeError, 'boom'):
+                UniversityRecommendationService()
+
+        [(service, connections)] = closed
+        with self.assertRaises(RuntimeError):
+            service.executor.submit(print)
+        self.assertTrue(connections)
+        for connection in connections:
+            with self.assertRaises(sqlite3.ProgrammingError):
+                connection.execute("SELECT 1")
+
+
+class NoAllowedRowsTests(ServiceTestCase):
+    PREFERENCES = {'desired_program': 'Law', 'preferred_countries': ['Atlantis'], 'strict_filters': True}
+    STATS = {'rounds': 0, 'candidates': 0, 'matched': 0, 'stop_reason': 'no_allowed_rows', 'duration_ms': 0.0}
+
+    def test_stats_and_caching(self):
+        with self.settings(RECOMMENDATION_CACHE_ENABLED=True, CACHES=LOCAL_RESULT_CACHE):
+            service = self.service()
+            for cached in (False, True):
+                stats = {}
+                self.assertEqual(service.get_recommendations(self.PREFERENCES, search_stats=stats), [])
+                self.assertEqual(stats, dict(self.STATS, cached=cached, coalesced=False))
+                stats = {}
+                self.assertEqual(asyncio.run(service.aget_recommendations(
+                    self.PREFERENCES, search_stats=stats, group_by_university=True)), [])
+                self.assertEqual(stats, dict(self.STATS, cached=cached, coalesced=False))
+            [result] = service.get_batch_recommendations([self.PREFERENCES])['results']
+            self.assertEqual(result, {'recommendations': [], 'retrieval': self.STATS})
+
+
+class DocumentTextsTests(SimpleTestCase):
+    def setUp(self):
+        # Every record carries every key, as in the dataset; gaps are nulls
+        self.records = [
+            {
+                'university_name': f"University {row % 9}",
+                'university_course_name': f"Course {row}" if row % 5 else None,
+                'course_program_label': None,
+                'parent_course_name': ('Law', 'Medicine', 'Art & Design 100%')[row % 3],
+                'program_type': 'Master',
+                'university_courses_credential': 'MSc',
+                'location_name': 'Zürich' if row % 4 else None,
+                'country_name': 'Switzerland',
+                'university_global_rank': row % 11 or None,
+                'university_course_tuition_usd': 1000.5 * row if row % 3 else None,
+                'university_type': ('Public', 'Private', None)[row % 3],
+                'country_currency': 'CHF',
+                'scholarship_count': row,
+                'is_gre_required': (True, False, None)[row % 3],
+                'university_views': 2 ** 40 + row,
+                'tuition_affordability': row / 7,
+                'university_quality': float('nan') if row % 6 == 0 else 0.25 * row,
+                'country_popularity': 1.0,
+            }
+            for row in range(60)
+        ]
+
+    def render(self, records):
+        return list(DocumentTexts(CourseCatalog.from_records(records)))
+
+    def test_texts_match_the_dataframe_rendering(self):
+        texts = self.render(self.records)
+        self.assertEqual(texts, _dataframe_texts(self.records))
+        # Batches and single rows render the same texts
+        documents = DocumentTexts(CourseCatalog.from_records(self.records), np.array([7, 3, 59]))
+        self.assertEqual(list(documents), [texts[7], texts[3], texts[59]])
+        self.assertEqual(documents[-1], texts[59])
+
+    def test_documented_differences_from_the_dataframe_rendering(self):
+        records = [dict(record) for record in self.records[:3]]
+        del records[1]['university_type']
+        del records[1]['is_gre_required']
+        records[2]['scholarship_count'] = True
+        records[2]['university_views'] = 2 ** 53 + 1
+        texts, expected = self.render(records), _dataframe_texts(records)
+        self.assertEqual(texts[0], expected[0])
+        differences = [
+            (old.strip(), new.strip())
+            for text, reference in zip(texts, expected)
+            for new, old in zip(text.splitlines(), reference.splitlines())
+            if new != old
+        ]
+        self.assertEqual(differences, [
+            ('University Type: nan', 'University Type: None'),
+            ('GRE Required: nan', 'GRE Required: None'),
+            ('Scholarship Count: True', 'Scholarship Count: 1'),
+            ('University Views: 9007199254740993', 'University Views: 9007199254740992'),
+        ])
+
+
+class IterRecordsTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'records.json')
+
+    def write(self, text, encoding='utf-8'):
+        with open(self.path, 'w', encoding=encoding) as f:
+            f.write(text)
+
+    def read(self, chunk_size):
+        # Compared as JSON text, as NaN records never compare equal
+        return json.dumps(list(iter_records(self.path, chunk_size)))
+
+    def test_matches_json_load_at_every_chunk_size(self):
+        records = [
+            {'name': f"Course {row}", 'city': 'Zürich', 'tags': ['a', {'b': [row]}], 'quote': 'say "hi", \\ ]',
+             'rank': row * 1000 + 7, 'tuition': row / 3, 'quality': float('nan') if row % 4 == 0 else None}
+            for row in range(12)
+        ] + [12345, -0.5e-7, 'text', [], {}, True, None]
+        texts = [json.dumps(records), json.dumps(records, indent=2), '\n\t [ ' + json.dumps(records)[1:-1] + ' ] \r\n']
+        for text in texts:
+            self.write(text)
+            with open(self.path) as f:
+                expected = json.dumps(json.load(f))
+            for chunk_size in (1, 2, 3, 7, 64, 1 << 20):
+                with self.subTest(chunk_size=chunk_size):
+                    self.assertEqual(self.read(chunk_size), expected)
+
+    def test_empty_arrays_and_byte_order_mark(self):
+        for text in ('[]', ' [ \n ] \n', '[{"a": 1}]'):
+            self.write(text, encoding='utf-8-sig')
+            for chunk_size in (1, 1 << 20):
+                self.assertEqual(self.read(chunk_size), json.dumps(json.loads(text)))
+
+    def test_malformed_files_raise(self):
+        for text in ('', '   ', '{"a": 1}', '[{"a": 1}', '[{"a": 1},', '[{"a": 1} {"b": 2}]', '[{"a": 1},]',
+                     '[{"a": 1}] x', '[{"a": 1}][]', '[{"a": ', '[12'):
+            self.write(text)
+            for chunk_size in (1, 1 << 20):
+                with self.subTest(text=text, chunk_size=chunk_size), self.assertRaises(ValueError):
+                    list(iter_records(self.path, chunk_size))
+
+
+class IndexReconstructionTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.vectors = np.random.default_rng(5).standard_normal((4000, 16)).astype(np.float32)
+
+    def test_indexes_are_ready_to_reconstruct_when_built_or_read(self):
+        index = build_index(self.vectors, {'type': 'ivf', 'nlist': 0, 'nprobe': 4})
+        self.assertNotEqual(faiss.extract_index_ivf(index).direct_map.type, faiss.DirectMap.NoMap)
+
+        # A file written without the map gets it while it is read, before any worker could fork
+        raw = faiss.IndexIVFFlat(faiss.IndexFlatL2(16), 16, 32)
+        raw.train(self.vectors)
+        raw.add(self.vectors)
+        write_index(raw, os.path.join(self.directory, 'index.faiss'))
+        for mmap in (True, False):
+            loaded = read_index(os.path.join(self.directory, 'index.faiss'), mmap=mmap)
+            self.assertNotEqual(faiss.extract_index_ivf(loaded).direct_map.type, faiss.DirectMap.NoMap)
+            np.testing.assert_array_equal(reconstruct_rows(loaded, [0, 3999]), self.vectors[[0, 3999]])
+
+    def test_concurrent_reconstruction_of_an_index_without_a_map(self):
+        index = faiss.IndexIVFFlat(faiss.IndexFlatL2(16), 16, 32)
+        index.train(self.vectors)
+        index.add(self.vectors)
+        batches = [np.arange(start, 4000, 37) for start in range(16)]
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            results = list(pool.map(lambda rows: reconstruct_rows(index, rows), batches))
+        for rows, vectors in zip(batches, results):
+            np.testing.assert_array_equal(vectors, self.vectors[rows])
+
+
+LEXICAL_RECORDS = [
+    {'university_course_name': 'MSc Data Science', 'parent_course_name': 'Computer Science'},
+    {'university_course_name': 'Master of Data Science and Analytics', 'parent_course_name': 'Computer Science'},
+    {'university_course_name': 'BSc Computer Science', 'parent_course_name': 'Computer Science',
+     'course_program_label': 'Software Engineering'},
+    {'university_course_name': 'Bachelor of Laws', 'parent_course_name': 'Law'},
+    {'university_course_name': 'PhD in Law', 'parent_course_name': 'Law'},
+    {'university_course_name': 'Nursing', 'parent_course_name': 'Health'},
+    {'university_course_name': None, 'parent_course_name': None},
+    {'university_course_name': 'Data Science', 'parent_course_name': 'Computer Science'},
+    {'university_course_name': 'Nursing', 'parent_course_name': 'Health'},
+]
+
+
+class LexicalIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.catalog = CourseCatalog.from_records(LEXICAL_RECORDS)
+        self.index = LexicalIndex.build(self.catalog)
+
+    def reference_scores(self, text):
+        """Textbook BM25 over the concatenated lexical fields of each row"""
+        documents = [
+            [token for key in LEXICAL_FIELDS for token in tokenize(self.catalog.column(key).get(row) or '')]
+            for row in range(len(self.catalog))
+        ]
+        average_length = np.mean([len(document) for document in documents])
+        scores = np.zeros(len(documents))
+        for token in tokenize(text):
+            frequency = np.array([document.count(token) for document in documents], dtype=float)
+            containing = int((frequency > 0).sum())
+            if not containing:
+                continue
+            idf = np.log(1 + (len(documents) - containing + 0.5) / (containing + 0.5))
+            lengths = np.array([len(document) for document in documents])
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths / average_length)
+            scores += idf * frequency * (BM25_K1 + 1) / (frequency + norm)
+        return scores
+
+    def test_tokenize_drops_stopwords_and_adds_synonyms(self):
+        self.assertEqual(tokenize('MSc in the Science of Data'), ['msc', 'master', 'science', 'data'])
+        self.assertEqual(tokenize("Master's degree"), ['master', 'degree'])
+        self.assertEqual(tokenize('PhD, BSc'), ['phd', 'doctorate', 'bsc', 'bachelor'])
+
+    def test_scores_match_reference_bm25(self):
+        for text in ('data science', 'computer science master', 'law', 'masters masters', 'astrology'):
+            expected = self.reference_scores(text)
+            rows, scores = self.index.search(text, k=len(self.catalog))
+            np.testing.assert_allclose(scores, expected[rows], rtol=1e-5)
+            self.assertEqual(sorted(rows.tolist()), np.flatnonzero(expected > 0).tolist())
+            self.assertTrue(np.all(np.diff(scores) <= 0))
+
+    def test_synonyms_match_abbreviated_and_spelled_out_degrees(self):
+        msc, _ = self.index.search('MSc', k=10)
+        master, _ = self.index.search('master', k=10)
+        self.assertEqual(set(msc.tolist()), {0, 1})
+        self.assertEqual(set(master.tolist()), {0, 1})
+        doctorate, _ = self.index.search('doctorate law', k=10)
+        self.assertEqual(doctorate[0], 4)
+
+    def test_ties_break_by_row_and_allowed_rows_restrict(self):
+        rows, scores = self.index.search('nursing', k=2)
+        self.assertEqual(rows.tolist(), [5, 8])
+        self.assertEqual(scores[0], scores[1])
+        self.assertEqual(self.index.search('nursing', k=1)[0].tolist(), [5])
+        rows, _ = self.index.search('science', k=10, allowed=AllowedRows(np.array([1, 2, 5])))
+        self.assertEqual(sorted(rows.tolist()), [1, 2])
+        self.assertEqual(len(self.index.search('the of and', k=10)[0]), 0)
+
+    def test_save_and_load(self):
+        with tempfile.TemporaryDirectory() as directory:
+            self.index.save(directory)
+            self.assertIsNone(LexicalIndex.load(directory, len(self.catalog) + 1))
+            loaded = LexicalIndex.load(directory, len(self.catalog))
+        for text in ('data science', 'law'):
+            for expected, actual in zip(self.index.search(text, 5), loaded.search(text, 5)):
+                np.testing.assert_array_equal(actual, expected)
+
+    def test_reciprocal_rank_fusion(self):
+        fused = reciprocal_rank_fusion([np.array([10, 20, 30]), np.array([30, 40, 10])], k=60)
+        # 10: 1/61 + 1/63, 30: 1/63 + 1/61 (tied, 10 seen first), 20: 1/62, 40: 1/62 (tied, 20 first)
+        self.assertEqual(fused.tolist(), [10, 30, 20, 40])
+        fused = reciprocal_rank_fusion([np.array([1, 2]), np.array([2, 3])], k=1)
+        # 2: 1/3 + 1/2 beats 1: 1/2
+        self.assertEqual(fused.tolist(), [2, 1, 3])
+        self.assertEqual(reciprocal_rank_fusion([np.array([]), np.array([5])]).tolist(), [5])
+        self.assertEqual(len(reciprocal_rank_fusion([])), 0)
+
+
+FACET_RECORDS = [
+    {'parent_course_name': program, 'country_name': country, 'location_name': location,
+     'university_type': university_type, 'program_level': level}
+    for program, country, location, university_type, level in [
+        ('Law', 'Germany', 'Munich', 'Public', 'postgraduate'),
+        ('Medicine', 'Canada', 'Toronto', 'Public', 'undergraduate'),
+        ('Law', 'Canada', 'Berlin', 'Private', 'undergraduate'),
+        ('Art', 'Canada', 'Toronto', None, 'undergraduate'),
+        ('Medicine', '', 'Aachen', 'Public', None),
+    ]
+]
+
+
+class FacetSnapshotTests(SimpleTestCase):
+    EXTRA = {'previous_degrees': ['Bachelor', 'Master'], 'previous_courses': ['Biology']}
+
+    def setUp(self):
+        self.facets = FacetSnapshot.build(CourseCatalog.from_records(FACET_RECORDS), self.EXTRA)
+
+    def get(self, service, **headers):
+        with mock.patch('recommendations.views.get_recommendation_service', return_value=service):
+            return self.client.get('/api/v1/available-options/', headers=headers)
+
+    def test_contents(self):
+        # Most frequent first, then alphabetical; locations alphabetical; empty values left out
+        self.assertEqual(self.facets.counts['programs'], (('Law', 2), ('Medicine', 2), ('Art', 1)))
+        self.assertEqual(self.facets.values('countries'), ('Canada', 'Germany'))
+        self.assertEqual(self.facets.values('locations'), ('Aachen', 'Berlin', 'Munich', 'Toronto'))
+        self.assertEqual(self.facets.values('university_types'), ('Public', 'Private'))
+        self.assertEqual(self.facets.sizes()['program_levels'], 2)
+        self.assertEqual(json.loads(self.facets.options_body), {
+            'programs': ['Law', 'Medicine', 'Art'],
+            'countries': ['Canada', 'Germany'],
+            'locations': ['Aachen', 'Berlin', 'Munich', 'Toronto'],
+            'university_types': ['Public', 'Private'],
+            'program_levels': ['undergraduate', 'postgraduate'],
+            'previous_degrees': ['Bachelor', 'Master'],
+            'previous_courses': ['Biology'],
+        })
+        with self.assertRaises(TypeError):
+            self.facets.counts['programs'] = ()
+
+    def test_etag_follows_content(self):
+        same = FacetSnapshot.build(CourseCatalog.from_records(FACET_RECORDS), self.EXTRA)
+        changed = FacetSnapshot.build(CourseCatalog.from_records(FACET_RECORDS[:-1]), self.EXTRA)
+        self.assertEqual(same.etag, self.facets.etag)
+        self.assertNotEqual(changed.etag, self.facets.etag)
+        self.assertRegex(self.facets.etag, r'^"[0-9a-f]{32}"$')
+
+    def test_options_view_answers_conditional_requests(self):
+        service = SimpleNamespace(facets=self.facets)
+        response = self.get(service)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['ETag'], self.facets.etag)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(response.content, self.facets.options_body)
+
+        for header in (self.facets.etag, f'"other", W/{self.facets.etag}'):
+            response = self.get(service, If_None_Match=header)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response['ETag'], self.facets.etag)
+            self.assertEqual(response.content, b'')
+        self.assertEqual(self.get(service, If_None_Match='"stale"').status_code, 200)
+
+
+PROGRAM_COUNTS = [
+    ('Computer Science', 90), ('Business', 80), ('Data Science', 70), ('Science Education', 60),
+    ('Political Science', 50), ('Social Sciences and Science Policy', 40), ('Nursing', 30), ('Scandinavian Studies', 20),
+]
+
+
+class TypeaheadTests(SimpleTestCase):
+    def setUp(self):
+        self.index = TypeaheadIndex(PROGRAM_COUNTS)
+
+    def values(self, prefix, limit=10):
+        return [match['value'] for match in self.index.search(prefix, limit)]
+
+    def test_word_prefix_matches(self):
+        # Values starting with the prefix first, then matches on a later word, each by count
+        self.assertEqual(self.values('sc'), [
+            'Science Education', 'Scandinavian Studies', 'Computer Science', 'Data Science',
+            'Political Science', 'Social Sciences and Science Policy',
+        ])
+        self.assertEqual(self.values('  SCIENCE   ed'), ['Science Education'])
+        self.assertEqual(self.values('computer sc'), ['Computer Science'])
+        self.assertEqual(self.values('policy'), ['Social Sciences and Science Policy'])
+        self.assertEqual(self.values('ence'), [])
+        self.assertEqual(self.index.search('nurs'), [{'value': 'Nursing', 'count': 30}])
+
+    def test_limit(self):
+        self.assertEqual(self.values('sc', limit=3), ['Science Education', 'Scandinavian Studies', 'Computer Science'])
+        self.assertEqual(self.values('', limit=2), ['Computer Science', 'Business'])
+        self.assertEqual(len(self.values('', limit=100)), len(PROGRAM_COUNTS))
+
+    def test_matches_brute_force(self):
+        rng = np.random.default_rng(11)
+        words = ['alpha', 'alps', 'beta', 'bet', 'gamma', 'game', 'al', 'be']
+        values = sorted({' '.join(rng.choice(words, rng.integers(1, 4))) for _ in range(300)})
+        counts = sorted(((value, int(rng.integers(1, 1000))) for value in values), key=lambda x: (-x[1], x[0]))
+        index = TypeaheadIndex(counts)
+        for prefix in ('a', 'al', 'alp', 'be', 'bet', 'gam', 'alpha b', 'x'):
+            for limit in (1, 5, 40):
+                first = [value for value, _ in counts if value.startswith(prefix)]
+                later = [value for value, _ in counts
+                         if not value.startswith(prefix) and any(value[i:].startswith(prefix)
+                                                                 for i in range(1, len(value)) if value[i - 1] == ' ')]
+                self.assertEqual([match['value'] for match in index.search(prefix, limit)], (first + later)[:limit])
+
+    def get(self, path):
+        service = UniversityRecommendationService.__new__(UniversityRecommendationService)
+        service.typeahead = {'programs': self.index}
+        with mock.patch('recommendations.views.get_recommendation_service', return_value=service):
+            return self.client.get(path)
+
+    def test_view(self):
+        response = self.get('/api/v1/typeahead/programs/?prefix=sci&limit=2')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'field': 'programs', 'prefix': 'sci', 'matches': [
+            {'value': 'Science Education', 'count': 60}, {'value': 'Computer Science', 'count': 90},
+        ]})
+        # The limit is clamped to 1..TYPEAHEAD_MAX_LIMIT
+        self.assertEqual(len(self.get('/api/v1/typeahead/programs/?limit=0').json()['matches']), 1)
+        self.assertEqual(len(self.get(f"/api/v1/typeahead/programs/?limit={TYPEAHEAD_MAX_LIMIT + 10}").json()['matches']),
+                         len(PROGRAM_COUNTS))
+        self.assertEqual(self.get('/api/v1/typeahead/programs/?limit=many').status_code, 400)
+
+    def test_unknown_field(self):
+        response = self.get('/api/v1/typeahead/universities/?prefix=a')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {
+            'error': "Unknown field 'universities'", 'fields': ['countries', 'locations', 'programs'],
+        })
+
+
+LOCAL_RESULT_CACHE = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'recommendations': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'result-cache-tests'},
+}
+
+
+class ResultKeyTests(SimpleTestCase):
+    def test_normalize_preferences(self):
+        normalized = normalize_preferences({
+            'desired_program': '  Computer   Science ',
+            'preferred_countries': [' Germany', 'Canada', 'Germany '],
+            'university_types': 'Public',
+            'max_tuition_usd': '20000.004',
+            'min_global_rank': 'top 100',
+            'gpa': 3.7,
+            'additional_preferences': '',
+        })
+        self.assertEqual(normalized, {
+            'desired_program': 'computer science',
+            'preferred_countries': ['Canada', 'Germany'],
+            'university_types': ['Public'],
+            'max_tuition_usd': 20000.0,
+            'strict_filters': False,
+        })
+        self.assertTrue(normalize_preferences({'strict_filters': True})['strict_filters'])
+        with self.settings(RECOMMENDATION_STRICT_FILTERS=True):
+            self.assertTrue(normalize_preferences({})['strict_filters'])
+
+    def test_strict_filters_flag(self):
+        for value, expected in ((True, True), (False, False), ('true', True), (' Yes', True), ('1', True), (1, True),
+                                ('false', False), ('FALSE', False), ('0', False), ('no', False), (0, False)):
+            self.assertIs(normalize_preferences({'strict_filters': value})['strict_filters'], expected, value)
+        for default in (True, False):
+            with self.settings(RECOMMENDATION_STRICT_FILTERS=default):
+                for value in (None, '', 'maybe', [], {}):
+                    self.assertIs(normalize_preferences({'strict_filters': value})['strict_filters'], default, value)
+        # Spellings of one flag share a cache entry
+        self.assertEqual(result_key('v1', {'strict_filters': 'false'}, 10), result_key('v1', {'strict_filters': False}, 10))
+
+    def test_equivalent_preferences_share_a_key(self):
+        key = result_key('v1', {
+            'desired_program': 'Computer Science', 'preferred_countries': ['Germany', 'Canada'], 'max_tuition_usd': 20000,
+        }, 10)
+        self.assertEqual(key, result_key('v1', {
+            'desired_program': ' computer  SCIENCE', 'preferred_countries': ['Canada', 'Germany ', 'Canada'],
+            'max_tuition_usd': '20000.00', 'gpa': 3.2,
+        }, 10))
+        self.assertRegex(key, r'^recommendations:[0-9a-f]{40}$')
+
+    def test_different_requests_get_different_keys(self):
+        preferences = {'desired_program': 'Law', 'preferred_countries': ['Canada']}
+        key = result_key('v1', preferences, 10)
+        self.assertEqual(len({key,
+            result_key('v2', preferences, 10),
+            result_key('v1', preferences, 5),
+            result_key('v1', preferences, 10, variant='universities'),
+            result_key('v1', dict(preferences, strict_filters=True), 10),
+            # Countries are matched exactly against catalog values, so their case matters
+            result_key('v1', dict(preferences, preferred_countries=['canada']), 10),
+            result_key('v1', dict(preferences, max_tuition_usd=1000), 10),
+        }), 7)
+
+
+class ResultCacheInvalidationTests(ServiceTestCase):
+    PREFERENCES = {'desired_program': 'Law', 'preferred_countries': ['Canada']}
+
+    def recommend(self, service, preferences=PREFERENCES):
+        stats = {}
+        recommendations = service.get_recommendations(preferences, top_k=5, search_stats=stats)
+        return stats['cached'], recommendations
+
+    def test_results_do_not_depend_on_text_case(self):
+        with self.settings(RECOMMENDATION_CACHE_ENABLED=True, CACHES=LOCAL_RESULT_CACHE):
+            service = self.service()
+            cached, expected = self.recommend(service, dict(self.PREFERENCES, desired_program='LAW'))
+            self.assertFalse(cached)
+            cached, recommendations = self.recommend(service)
+            self.assertTrue(cached)
+        # Computed afresh, the other spelling gives the same result the cache handed out
+        _, uncached = self.recommend(self.service())
+        self.assertEqual(recommendations, expected)
+        self.assertEqual(uncached, expected)
+        self.assertIn("Perfect program match: Law", expected[0]['llm_reasoning'])
+
+    def test_results_of_a_replaced_index_are_not_served(self):
+        with self.settings(RECOMMENDATION_CACHE_ENABLED=True, CACHES=LOCAL_RESULT_CACHE):
+            service = self.service()
+            self.assertFalse(self.recommend(service)[0])
+            self.assertTrue(self.recommend(service)[0])
+            old_version = service.index_version
+
+            service._save_cache(self.cache_path, DocumentTexts(service.catalog), version=2)
+            self.assertNotEqual(service.index_version, old_version)
+            reloaded = self.service()
+            self.assertEqual(reloaded.index_version, service.index_version)
+            self.assertFalse(self.recommend(reloaded)[0])
+            self.assertTrue(self.recommend(reloaded)[0])
+            # The old entry was not deleted, only made unreachable
+            self.assertIsNotNone(RecommendationCache(old_version).get(self.PREFERENCES, 5))
+
+
+def _reference_mmr(relevance, vectors, k, weight):
+    """MMR computed pair by pair"""
+    span = max(relevance) - min(relevance)
+    scaled = [(value - min(relevance)) / span if span > 0 else 0.0 for value in relevance]
+    unit = [vector / np.linalg.norm(vector) if np.linalg.norm(vector) > 0 else vector for vector in vectors]
+    picked = []
+    while len(picked) < min(k, len(relevance)):
+        best, best_score = None, None
+        for candidate in range(len(relevance)):
+            if candidate in picked:
+                continue
+            redundancy = max([max(0.0, float(unit[candidate] @ unit[other])) for other in picked], default=0.0)
+            score = weight * scaled[candidate] - (1 - weight) * redundancy
+            if best_score is None or score > best_score + 1e-12:
+                best, best_score = candidate, score
+        picked.append(best)
+    return picked
+
+
+class DiversityTests(SimpleTestCase):
+    def test_mmr_matches_reference(self):
+        rng = np.random.default_rng(2)
+        for trial in range(20):
+            count = int(rng.integers(1, 40))
+            vectors = rng.standard_normal((count, 8))
+            relevance = rng.random(count)
+            weight = (0.0, 0.3, 0.7, 1.0)[trial % 4]
+            k = int(rng.integers(1, count + 3))
+            self.assertEqual(mmr_order(relevance, vectors, k, weight).tolist(),
+                             _reference_mmr(relevance, vectors, k, weight))
+
+    def test_mmr_prefers_a_different_candidate_over_a_near_duplicate(self):
+        vectors = np.array([[1.0, 0.0], [0.99, 0.01], [0.0, 1.0]])
+        relevance = np.array([1.0, 0.95, 0.7])
+        self.assertEqual(mmr_order(relevance, vectors, 3, weight=1.0).tolist(), [0, 1, 2])
+        self.assertEqual(mmr_order(relevance, vectors, 3, weight=0.5).tolist(), [0, 2, 1])
+
+    def test_mmr_edge_cases(self):
+        # Equal relevance and zero vectors: ties go to the lower index
+        self.assertEqual(mmr_order(np.ones(4), np.zeros((4, 3)), 10, weight=0.7).tolist(), [0, 1, 2, 3])
+        self.assertEqual(len(mmr_order(np.ones(3), np.eye(3), 0, weight=0.7)), 0)
+        self.assertEqual(len(mmr_order(np.empty(0), np.empty((0, 3)), 5, weight=0.7)), 0)
+
+    def test_cap_per_group(self):
+        groups = np.array([7, 7, 3, 7, 5, 3, 3])
+        self.assertEqual(cap_per_group(groups, cap=1, k=3).tolist(), [0, 2, 4])
+        self.assertEqual(cap_per_group(groups, cap=2, k=5).tolist(), [0, 1, 2, 4, 5])
+        # Too few candidates under the cap: the capped ones follow in rank order
+        self.assertEqual(cap_per_group(groups, cap=1, k=7).tolist(), [0, 2, 4, 1, 3, 5, 6])
+        self.assertEqual(cap_per_group(groups, cap=0, k=3).tolist(), [0, 2, 4])
+        self.assertEqual(len(cap_per_group(np.empty(0), cap=1, k=3)), 0)
+        self.assertEqual(len(cap_per_group(groups, cap=1, k=0)), 0)
+
+    def test_group_occurrence(self):
+        groups = np.array([4, 5, 4, 2, 6, 4], dtype=np.int32)
+        self.assertEqual(group_occurrence(groups).tolist(), [0, 0, 1, 0, 0, 2])
+        rng = np.random.default_rng(4)
+        groups = rng.integers(0, 6, 200)
+        expected = [int((groups[:i] == group).sum()) for i, group in enumerate(groups)]
+        self.assertEqual(group_occurrence(groups).tolist(), expected)
+
+
+class SingleFlightTests(SimpleTestCase):
+    CALLERS = 8
+
+    def wait_for(self, condition):
+        for _ in range(1000):
+            if condition():
+                return
+            time.sleep(0.005)
+        self.fail("callers never arrived")
+
+    def run_threads(self, flight, compute, key='key'):
+        def call():
+            try:
+                return flight.do(key, compute)
+            except Exception as e:
+                return e
+
+        with ThreadPoolExecutor(self.CALLERS) as pool:
+            return list(pool.map(lambda _: call(), range(self.CALLERS)))
+
+    def test_do_runs_identical_calls_once(self):
+        flight = SingleFlight()
+        calls = []
+
+        def compute():
+            calls.append(1)
+            self.assertEqual(flight.stats()['in_flight'], 1)
+            # Hold the leader until every other caller waits on it
+            self.wait_for(lambda: flight.coalesced == self.CALLERS - 1)
+            return {'answer': 42}
+
+        results = self.run_threads(flight, compute)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(coalesced for _, coalesced in results), [False] + [True] * (self.CALLERS - 1))
+        self.assertTrue(all(result is results[0][0] for result, _ in results))
+        self.assertEqual(flight.stats(), {'leaders': 1, 'coalesced': self.CALLERS - 1, 'in_flight': 0})
+
+        # Once it finished, the next call computes again
+        self.assertEqual(flight.do('key', lambda: 'again'), ('again', False))
+        self.assertEqual(flight.do('other', lambda: 'other'), ('other', False))
+        self.assertEqual(flight.stats(), {'leaders': 3, 'coalesced': self.CALLERS - 1, 'in_flight': 0})
+
+    def test_do_raises_the_error_in_every_caller(self):
+        flight = SingleFlight()
+        error = ValueError('failed')
+
+        def compute():
+            self.wait_for(lambda: flight.coalesced == self.CALLERS - 1)
+            raise error
+
+        self.assertEqual(self.run_threads(flight, compute), [error] * self.CALLERS)
+        self.assertEqual(flight.stats(), {'leaders': 1, 'coalesced': self.CALLERS - 1, 'in_flight': 0})
+        # A failed computation is not remembered
+        self.assertEqual(flight.do('key', lambda: 'recovered'), ('recovered', False))
+
+    def test_ado_runs_identical_calls_once(self):
+        flight = SingleFlight()
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return ['shared']
+
+        async def main():
+            results = await asyncio.gather(*(flight.ado('key', compute) for _ in range(self.CALLERS)),
+                                           flight.ado('other', compute))
+            return results, flight.stats()
+
+        results, stats = asyncio.run(main())
+        self.assertEqual(len(calls), 2)
+        self.assertEqual([coalesced for _, coalesced in results], [False] + [True] * (self.CALLERS - 1) + [False])
+        self.assertTrue(all(result is results[0][0] for result, _ in results[:self.CALLERS]))
+        self.assertEqual(stats, {'leaders': 2, 'coalesced': self.CALLERS - 1, 'in_flight': 0})
+
+    def test_ado_raises_the_error_in_every_caller(self):
+        flight = SingleFlight()
+        error = ValueError('failed')
+
+        async def compute():
+            await asyncio.sleep(0.01)
+            raise error
+
+        async def main():
+            return await asyncio.gather(*(flight.ado('key', compute) for _ in range(self.CALLERS)),
+                                        return_exceptions=True)
+
+        self.assertEqual(asyncio.run(main()), [error] * self.CALLERS)
+        self.assertEqual(flight.stats(), {'leaders': 1, 'coalesced': self.CALLERS - 1, 'in_flight': 0})
+
+    def test_ado_follower_cancellation_spares_the_leader(self):
+        flight = SingleFlight()
+
+        async def compute():
+            await asyncio.sleep(0.02)
+            return 'done'
+
+        async def main():
+            leader = asyncio.ensure_future(flight.ado('key', compute))
+            await asyncio.sleep(0)
+            follower = asyncio.ensure_future(flight.ado('key', compute))
+            await asyncio.sleep(0)
+            follower.cancel()
+            return await leader, follower.cancelled()
+
+        self.assertEqual(asyncio.run(main()), (('done', False), True))
+
+
+class ProcessLockStatsTests(ServiceTestCase):
+    PREFERENCES = {'desired_program': 'Law', 'preferred_countries': ['Canada']}
+
+    def test_lookup_under_the_lock_is_not_counted(self):
+        with self.settings(RECOMMENDATION_CACHE_ENABLED=True, CACHES=LOCAL_RESULT_CACHE,
+                           RECOMMENDATION_LOCK_DIR=os.path.join(self.base_dir, 'locks')):
+            service = self.service()
+            self.assertIsNotNone(service.process_locks)
+            preferences = normalize_preferences(self.PREFERENCES)
+            key = result_key(service.index_version, preferences, 5)
+
+            # Another process published the result while this request waited for the lock
+            service.result_cache.set(preferences, 5, {'recommendations': ['computed elsewhere'], 'retrieval': {}})
+            for compute in (service._compute_recommendations,
+                            lambda *args: asyncio.run(service._acompute_recommendations(*args))):
+                recommendations, stats = compute(key, preferences, 5, 'courses', False, 3)
+                self.assertEqual((recommendations, stats['cached']), (['computed elsewhere'], True))
+            self.assertEqual(service.result_cache.stats(), {'hits': 0, 'misses': 0})
+
+            # A request that computes counts one miss, its repeat one hit
+            for _ in range(2):
+                service.get_recommendations(dict(self.PREFERENCES, desired_program='Nursing'), top_k=5)
+            asyncio.run(service.aget_recommendations(dict(self.PREFERENCES, desired_program='Nursing'), top_k=5))
+            self.assertEqual(service.result_cache.stats(), {'hits': 2, 'misses': 1})
+
+
+class AdaptiveRetrievalTests(ServiceTestCase):
+    PREFERENCES = {'desired_program': 'Law', 'preferred_countries': ['Canada']}
+
+    def setUp(self):
+        super().setUp()
+        # A first pool of 10 for top_k=5 that doubles each round; no match reaches 101%
+        overrides = override_settings(
+            RECOMMENDATION_CANDIDATE_POOL=10, RECOMMENDATION_CANDIDATE_GROWTH=2, RECOMMENDATION_MAX_CANDIDATE_POOL=1000,
+            RECOMMENDATION_TARGET_MATCH=101, RECOMMENDATION_SEARCH_BUDGET_MS=60000,
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.recommendation_service = self.service()
+
+    def retrieve(self, preference_sets, top_k=5, allowed=None):
+        """Stats per preference set, and the (queries, k) of every search round"""
+        service = self.recommendation_service
+        preference_sets = [normalize_preferences(preferences) for preferences in preference_sets]
+        vectors = np.vstack([
+            service._query_vector(preferences, service._create_query_from_preferences(preferences))
+            for preferences in preference_sets
+        ])
+        with mock.patch.object(service, '_retrieve', wraps=service._retrieve) as retrieve:
+            results = service._retrieve_adaptively(vectors, preference_sets, top_k, allowed)
+        rounds = [(len(call.args[1]), call.args[2]) for call in retrieve.call_args_list]
+        return [result[-1] for result in results], rounds
+
+    def assertStats(self, stats, rounds, candidates, stop_reason):
+        self.assertEqual((stats['rounds'], stats['candidates'], stats['stop_reason']), (rounds, candidates, stop_reason))
+
+    def test_pool_grows_until_the_catalog_is_exhausted(self):
+        [stats], rounds = self.retrieve([self.PREFERENCES])
+        self.assertEqual(rounds, [(1, 10), (1, 20), (1, 40), (1, 80), (1, 160), (1, 320)])
+        self.assertStats(stats, 6, 300, 'exhausted')
+        self.assertEqual(stats['matched'], 0)
+
+    def test_allowed_rows_limit_the_pool(self):
+        allowed = self.recommendation_service.constraints.allowed_rows(
+            normalize_preferences(dict(self.PREFERENCES, strict_filters=True)))
+        self.assertEqual(len(allowed), 100)
+        [stats], rounds = self.retrieve([self.PREFERENCES], allowed=allowed)
+        self.assertEqual([k for _, k in rounds], [10, 20, 40, 80, 160])
+        self.assertStats(stats, 5, 100, 'exhausted')
+
+    def test_target_reached(self):
+        with self.settings(RECOMMENDATION_TARGET_MATCH=0):
+            [stats], rounds = self.retrieve([self.PREFERENCES])
+        self.assertEqual(rounds, [(1, 10)])
+        self.assertStats(stats, 1, 10, 'target_reached')
+        self.assertEqual(stats['matched'], 10)
+
+    def test_no_criteria(self):
+        [stats], rounds = self.retrieve([{'strict_filters': False}])
+        self.assertEqual(rounds, [(1, 10)])
+        self.assertStats(stats, 1, 10, 'no_criteria')
+
+    def test_max_pool(self):
+        with self.settings(RECOMMENDATION_MAX_CANDIDATE_POOL=50):
+            [stats], rounds = self.retrieve([self.PREFERENCES])
+        self.assertEqual(rounds, [(1, 10), (1, 20), (1, 40), (1, 50)])
+        self.assertStats(stats, 4, 50, 'max_pool')
+
+    def test_budget(self):
+        with self.settings(RECOMMENDATION_SEARCH_BUDGET_MS=0):
+            [stats], rounds = self.retrieve([self.PREFERENCES])
+        self.assertEqual(rounds, [(1, 10)])
+        self.assertStats(stats, 1, 10, 'budget')
+
+    def test_pending_queries_share_later_rounds(self):
+        with self.settings(RECOMMENDATION_MAX_CANDIDATE_POOL=40):
+            stats, rounds = self.retrieve([self.PREFERENCES, {}, dict(self.PREFERENCES, desired_program='Nursing')])
+        self.assertEqual(rounds, [(3, 10), (2, 20), (2, 40)])
+        self.assertStats(stats[0], 3, 40, 'max_pool')
+        self.assertStats(stats[1], 1, 10, 'no_criteria')
+        self.assertStats(stats[2], 3, 40, 'max_pool')
+
+
+class BatchRecommendationTests(ServiceTestCase):
+    ITEMS = [
+        {'desired_program': 'Law', 'preferred_countries': ['Canada']},
+        {'desired_program': 'Nursing', 'max_tuition_usd': 12000},
+        {'desired_program': 'Law', 'preferred_countries': ['Japan'], 'strict_filters': True},
+        {'desired_program': 'Computer Science', 'university_types': ['Private'], 'strict_filters': True},
+        {},
+    ]
+
+    def setUp(self):
+        super().setUp()
+        # Stop reasons must not depend on timing for results to be comparable
+        overrides = override_settings(RECOMMENDATION_SEARCH_BUDGET_MS=60000)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def test_items_match_single_requests(self):
+        service = self.service()
+        batch = service.get_batch_recommendations(self.ITEMS, top_k=5)
+        self.assertEqual(set(batch['timings']), {'queries_ms', 'embedding_ms', 'retrieval_ms', 'results_ms', 'total_ms'})
+        self.assertEqual(len(batch['results']), len(self.ITEMS))
+        for preferences, result in zip(self.ITEMS, batch['results']):
+            stats = {}
+            self.assertEqual(result['recommendations'], service.get_recommendations(preferences, top_k=5, search_stats=stats))
+            self.assertEqual(len(result['recommendations']), 5)
+            for key in ('rounds', 'candidates', 'matched', 'stop_reason'):
+                self.assertEqual(result['retrieval'][key], stats[key])
+
+    def test_items_without_strict_filters_share_one_search(self):
+        service = self.service()
+        with mock.patch.object(service, '_retrieve', wraps=service._retrieve) as retrieve:
+            service.get_batch_recommendations(self.ITEMS, top_k=5)
+        first_rounds = {}
+        for query_vectors, preference_sets, k, allowed in (call.args for call in retrieve.call_args_list):
+            self.assertEqual(len(query_vectors), len(preference_sets))
+            key = None if allowed is None else tuple(allowed.ids)
+            first_rounds.setdefault(key, len(preference_sets))
+        # One shared search for the three unrestricted items, one per strict item
+        self.assertEqual(first_rounds.pop(None), 3)
+        self.assertEqual(sorted(first_rounds.values()), [1, 1])
+
+    def test_malformed_item_does_not_fail_the_batch(self):
+        service = self.service()
+        results = service.get_batch_recommendations([self.ITEMS[0], 'Law', None, self.ITEMS[1]], top_k=3)['results']
+        self.assertEqual(results[1], {'error': 'preferences must be an object'})
+        self.assertEqual(results[2], {'error': 'preferences must be an object'})
+        self.assertEqual([len(results[i]['recommendations']) for i in (0, 3)], [3, 3])
+
+
+class UniversityIndexTests(SimpleTestCase):
+    def test_codes_and_course_counts(self):
+        catalog = CourseCatalog.from_records([{'university_id': value} for value in (7, 3, 7, None, 3, 7, None)])
+        universities = UniversityIndex(catalog)
+        self.assertEqual(universities.codes.tolist(), [1, 0, 1, 2, 0, 1, 3])
+        # Rows without a university each form their own
+        self.assertEqual(universities.course_counts.tolist(), [2, 3, 1, 1])
+        self.assertEqual(len(universities), 4)
+
+    def test_group(self):
+        universities = UniversityIndex(CourseCatalog.from_records(
+            [{'university_id': value} for value in (10, 20, 10, 30, 20, 10, 40)]
+        ))
+        row_ids = np.array([0, 1, 2, 3, 4, 5, 6])
+        ranking = np.array([2, 4, 0, 5, 3, 1, 6])  # universities 10, 20, 10, 10, 30, 20, 40
+        groups = [(code, courses.tolist(), matched) for code, courses, matched in universities.group(row_ids, ranking, 2, 2)]
+        self.assertEqual(groups, [(0, [2, 0], 3), (1, [4, 1], 2)])
+        self.assertEqual([code for code, _, _ in universities.group(row_ids, ranking, 10, 1)], [0, 1, 2, 3])
+        self.assertEqual(universities.group(row_ids, ranking[:0], 3, 2), [])
+
+    def test_group_matches_brute_force(self):
+        rng = np.random.default_rng(8)
+        records = [{'university_id': int(value) if value < 45 else None} for value in rng.integers(0, 50, 500)]
+        universities = UniversityIndex(CourseCatalog.from_records(records))
+        for _ in range(20):
+            row_ids = rng.choice(500, int(rng.integers(1, 120)), replace=False)
+            ranking = rng.permutation(len(row_ids))
+            limit, per_university = int(rng.integers(1, 15)), int(rng.integers(1, 4))
+            expected = {}
+            for index in ranking:
+                expected.setdefault(int(universities.codes[row_ids[index]]), []).append(int(index))
+            expected = [(code, members[:per_university], len(members)) for code, members in expected.items()][:limit]
+            actual = [(code, courses.tolist(), matched)
+                      for code, courses, matched in universities.group(row_ids, ranking, limit, per_university)]
+            self.assertEqual(actual, expected)
+
+
+class RecommendationViewTests(ServiceTestMixin, TestCase):
+    URL = '/api/v1/recommendations/'
+    PREFERENCES = {'desired_program': 'Law', 'preferred_countries': ['Canada']}
+
+    def setUp(self):
+        super().setUp()
+        user = User.objects.create_user(email='student@example.com', password='secret', first_name='A', last_name='B')
+        self.token = Token.objects.create(user=user).key
+        self.recommendation_service = self.service()
+        patcher = mock.patch('recommendations.views.get_recommendation_service', return_value=self.recommendation_service)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def post(self, data, url=None, token=True):
+        headers = {'Authorization': f"Token {self.token}"} if token else {}
+        return self.client.post(url or self.URL, data, content_type='application/json', headers=headers)
+
+    def test_grouped_response(self):
+        response = self.post(dict(self.PREFERENCES, group_by='university', courses_per_university=2))
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(body['group_by'], 'university')
+        universities = body['recommendations']
+        self.assertEqual(len(universities), 10)
+        self.assertEqual(len({university['university_id'] for university in universities}), 10)
+        for university in universities:
+            self.assertEqual(set(university), {
+                'university_id', 'university_name', 'university_slug', 'country', 'location', 'global_rank',
+                'university_type', 'currency', 'is_partner', 'university_views', 'university_quality',
+                'country_popularity', 'match_percentage', 'relevance_score', 'reasoning', 'total_courses',
+                'matching_courses', 'courses',
+            })
+            self.assertTrue(1 <= len(university['courses']) <= min(2, university['matching_courses']))
+            self.assertLessEqual(university['matching_courses'], university['total_courses'])
+            # The university is described by its best course, whose scores it carries
+            self.assertEqual(university['relevance_score'], university['courses'][0]['relevance_score'])
+            scores = [course['relevance_score'] for course in university['courses']]
+            self.assertEqual(scores, sorted(scores, reverse=True))
+            for course in university['courses']:
+                self.assertNotIn('university_name', course)
+                # Generated course ids are 1000 + row, their universities row % 40
+                self.assertEqual((course['course_id'] - 1000) % 40, university['university_id'])
+        self.assertEqual(
+            [u['relevance_score'] for u in universities], sorted((u['relevance_score'] for u in universities), reverse=True)
+        )
+
+    def test_course_response(self):
+        body = self.post(self.PREFERENCES).json()
+        self.assertEqual(body['group_by'], 'course')
+        self.assertEqual(len(body['recommendations']), 10)
+        self.assertNotIn('courses', body['recommendations'][0])
+
+    def test_invalid_grouping_options(self):
+        self.assertEqual(self.post(dict(self.PREFERENCES, group_by='country')).status_code, 400)
+        self.assertEqual(self.post(dict(self.PREFERENCES, group_by='university', courses_per_university='all')).status_code, 400)
+        self.assertEqual(self.post(self.PREFERENCES, token=False).status_code, 401)
+
+    def test_batch(self):
+        url = '/api/v1/recommendations/batch/'
+        items = [self.PREFERENCES, ['not', 'an', 'object']]
+        body = self.post({'items': items, 'top_k': 3}, url).json()
+        self.assertEqual(len(body['results'][0]['recommendations']), 3)
+        self.assertEqual(body['results'][0]['recommendations'], self.post(dict(self.PREFERENCES, top_k=3)).json()['recommendations'][:3])
+        self.assertEqual(body['results'][1], {'error': 'preferences must be an object'})
+        self.assertEqual(set(body['timings_ms']), {'queries_ms', 'embedding_ms', 'retrieval_ms', 'results_ms', 'total_ms'})
+
+        # top_k is clamped to 1..50
+        for top_k, expected in ((0, 1), (-5, 1), (500, 50)):
+            body = self.post({'items': [self.PREFERENCES], 'top_k': top_k}, url).json()
+            self.assertEqual(len(body['results'][0]['recommendations']), expected)
+
+        self.assertEqual(self.post({'items': [self.PREFERENCES], 'top_k': 'many'}, url).status_code, 400)
+        self.assertEqual(self.post({'items': []}, url).status_code, 400)
+        self.assertEqual(self.post({'items': self.PREFERENCES}, url).status_code, 400)
+        with self.settings(RECOMMENDATION_BATCH_MAX_ITEMS=2):
+            self.assertEqual(self.post({'items': [self.PREFERENCES] * 3}, url).status_code, 400)
+        self.assertEqual(self.post({'items': [self.PREFERENCES]}, url, token=False).status_code, 401)
+
+    async def async_post(self, data, token=True, **kwargs):
+        headers = {'Authorization': f"Token {self.token}"} if token else {}
+        return await self.async_client.post('/api/v1/recommendations/async/', data, headers=headers, **kwargs)
+
+    async def test_async_requires_authentication(self):
+        response = await self.async_post(self.PREFERENCES, token=False, content_type='application/json')
+        self.assertEqual(response.status_code, 401)
+        response = await self.async_client.post('/api/v1/recommendations/async/', self.PREFERENCES,
+                                                content_type='application/json',
+                                                headers={'Authorization': 'Token not-a-token'})
+        self.assertEqual(response.status_code, 401)
+
+    async def test_async_parsing(self):
+        self.assertEqual((await self.async_post('{"desired_program": ', content_type='application/json')).status_code, 400)
+        response = await self.async_post(dict(self.PREFERENCES, group_by='country'), content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual((await self.async_client.get('/api/v1/recommendations/async/')).status_code, 405)
+        # Form-encoded bodies are parsed like JSON ones
+        response = await self.async_post({'desired_program': 'Law', 'group_by': 'university'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['group_by'], 'university')
+
+    async def test_async_matches_sync(self):
+        for options in ({}, {'group_by': 'university', 'courses_per_university': 2}):
+            data = dict(self.PREFERENCES, **options)
+            expected = (await sync_to_async(self.post)(data)).json()
+            actual = (await self.async_post(data, content_type='application/json')).json()
+            self.assertEqual(actual['group_by'], expected['group_by'])
+            self.assertEqual(actual['recommendations'], expected['recommendations'])
+
+
+class ServiceLoaderTests(SimpleTestCase):
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.addCleanup(logging.disable, logging.NOTSET)
+
+    def test_idle_loading_ready(self):
+        release = threading.Event()
+
+        def factory(progress):
+            progress('building_index', 3, 10)
+            release.wait(10)
+            return 'service'
+
+        loader = ServiceLoader(factory, retry_delay=1, max_retry_delay=4)
+        self.assertEqual(loader.status(), {'state': 'idle', 'stage': None, 'attempts': 0, 'error': None})
+        self.assertIsNone(loader.get())  # starts the load
+        self.assertFalse(loader.wait(0.05))
+        status = loader.status()
+        self.assertEqual((status['state'], status['stage'], status['progress']),
+                         ('loading', 'building_index', {'done': 3, 'total': 10}))
+        self.assertIn('elapsed_s', status)
+        self.assertFalse(loader.start())  # already loading
+
+        release.set()
+        self.assertTrue(loader.wait(10))
+        self.assertEqual(loader.get(), 'service')
+        self.assertEqual(loader.status(), {'state': 'ready', 'stage': None, 'attempts': 1, 'error': None,
+                                           'progress': {'done': 3, 'total': 10}})
+        self.assertFalse(loader.start())
+        self.assertTrue(loader.load())
+
+    @override_settings(RECOMMENDATION_RETRY_AFTER=10)
+    def test_failed_attempts_retry_with_backoff(self):
+        attempts = []
+
+        def factory(progress):
+            attempts.append(1)
+            if len(attempts) < 5:
+                raise RuntimeError(f"attempt {len(attempts)}")
+            return 'service'
+
+        delays = []
+        first_sleep = threading.Event()
+        resume = threading.Event()
+
+        def sleep(delay):
+            delays.append(delay)
+            first_sleep.set()
+            resume.wait(10)
+
+        loader = ServiceLoader(factory, retry_delay=1, max_retry_delay=4)
+        with mock.patch('recommendations.service_loader.time.sleep', side_effect=sleep):
+            loader.start()
+            self.assertTrue(first_sleep.wait(10))
+            status = loader.status()
+            self.assertEqual((status['state'], status['attempts'], status['error']),
+                             ('failed', 1, 'RuntimeError: attempt 1'))
+            self.assertLessEqual(status['next_attempt_in_s'], 1)
+            # Waiting for the retry comes on top of the time a load takes
+            self.assertEqual(loader.retry_after(), 11)
+            self.assertIsNone(loader.get())
+
+            resume.set()
+            self.assertTrue(loader.wait(10))
+        self.assertEqual(delays, [1, 2, 4, 4])
+        self.assertEqual(loader.get(), 'service')
+        self.assertEqual(loader.status()['attempts'], 5)
+        self.assertEqual(loader.retry_after(), 10)
+
+    @override_settings(RECOMMENDATION_RETRY_AFTER=10)
+    def test_load_makes_one_attempt(self):
+        loader = ServiceLoader(mock.Mock(side_effect=RuntimeError('boom')), retry_delay=1, max_retry_delay=4)
+        self.assertFalse(loader.load())
+        status = loader.status()
+        self.assertEqual((status['state'], status['attempts']), ('failed', 1))
+        self.assertNotIn('next_attempt_in_s', status)
+        self.assertEqual(loader.retry_after(), 10)
+
+    def test_preload_runs_in_the_calling_thread(self):
+        threads = []
+
+        def factory(progress):
+            threads.append(threading.current_thread())
+            return 'service'
+
+        loader = ServiceLoader(factory, retry_delay=1, max_retry_delay=4)
+        self.assertTrue(loader.load())
+        self.assertEqual(threads, [threading.current_thread()])
+        self.assertIsNone(loader._thread)
+        self.assertEqual(loader.get(), 'service')
+        self.assertTrue(loader.load())
+        self.assertEqual(len(threads), 1)
+
+    def test_failed_preload_falls_back_to_the_background_loader(self):
+        factory = mock.Mock(side_effect=[RuntimeError('dataset missing'), 'service'])
+        loader = ServiceLoader(factory, retry_delay=1, max_retry_delay=4)
+        self.assertFalse(loader.load())
+        # Nothing retries in the preloading process, whose threads would not survive a fork
+        self.assertIsNone(loader._thread)
+        self.assertEqual(loader.status()['state'], 'failed')
+
+        self.assertIsNone(loader.get())  # starts the background loader
+        self.assertTrue(loader.wait(10))
+        self.assertEqual(loader.get(), 'service')
+        self.assertEqual(loader.status()['attempts'], 2)
+
+    def test_wsgi_application_preloads_when_configured(self):
+        for preload in (True, False):
+            sys.modules.pop('university_recommender.wsgi', None)
+            with self.subTest(preload=preload), self.settings(RECOMMENDATION_PRELOAD=preload), \
+                    mock.patch('recommendations.service_loader.service_loader') as loader:
+                importlib.import_module('university_recommender.wsgi')
+            self.assertEqual((loader.load.call_count, loader.start.call_count), (1, 0) if preload else (0, 1))
+        sys.modules.pop('university_recommender.wsgi', None)
+
+
+@override_settings(RECOMMENDATION_RETRY_AFTER=10)
+class ServiceUnavailableTests(TestCase):
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.addCleanup(logging.disable, logging.NOTSET)
+        user = User.objects.create_user(email='student@example.com', password='secret', first_name='A', last_name='B')
+        self.headers = {'Authorization': f"Token {Token.objects.create(user=user).key}"}
+        self.loader = ServiceLoader(mock.Mock(side_effect=RuntimeError('boom')), retry_delay=30, max_retry_delay=60)
+        for patcher in (mock.patch('recommendations.views.service_loader', self.loader),
+                        mock.patch('recommendations.views.get_recommendation_service', return_value=None)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def post(self, url):
+        return self.client.post(url, {'desired_program': 'Law'}, content_type='application/json', headers=self.headers)
+
+    def test_loading(self):
+        for url in ('/api/v1/recommendations/', '/api/v1/recommendations/async/'):
+            response = self.post(url)
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response['Retry-After'], '10')
+            body = response.json()
+            self.assertEqual(body['error'], 'System is still initializing')
+            self.assertEqual((body['retry_after'], body['initialization']['state']), (10, 'idle'))
+
+    def test_failed(self):
+        # What the background loader records after a failed attempt
+        self.loader._attempt(retry_in=30)
+        for url in ('/api/v1/recommendations/', '/api/v1/recommendations/async/'):
+            response = self.post(url)
+            self.assertEqual(response.status_code, 503)
+            retry_after = int(response['Retry-After'])
+            self.assertTrue(30 < retry_after <= 40)
+            body = response.json()
+            self.assertEqual(body['error'], 'System failed to initialize')
+            self.assertEqual(body['retry_after'], retry_after)
+            self.assertEqual((body['initialization']['state'], body['initialization']['error']),
+                             ('failed', 'RuntimeError: boom'))
@@ -0,0 +1,70 @@
+import re
+from bisect import bisect_left
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+
+# Facets (see facets.FACET_COLUMNS) offered for typeahead
+TYPEAHEAD_FIELDS = ('programs', 'countries', 'locations')
+
+TYPEAHEAD_MAX_LIMIT = 50
+
+_WORD = re.compile(r"\w+")
+
+
+def normalize_prefix(prefix: str) -> str:
+    return ' '.join(prefix.lower().split())
+
+
+class TypeaheadIndex:
+    """Sorted-array prefix index over one facet's values.
+
+    Every value is indexed under its full (lower-cased) text and under each
+    later word, so "sci" finds "Computer Science". ``value_counts`` must be
+    ordered most frequent first, which makes a value's position its rank: the
+    best matches for a prefix are the smallest ranks in the matching key range.
+    Values that start with the prefix come before values matched on a later word.
+    """
+
+    def __init__(self, value_counts: Sequence[Tuple[str, int]]):
+        self.values = [value for value, _ in value_counts]
+        self.counts = [count for _, count in value_counts]
+
+        entries = []
+        self._max_words = 1
+        for rank, value in enumerate(self.values):
+            text = ' '.join(value.lower().split())
+            starts = 0
+            for match in _WORD.finditer(text):
+                # Matches on a later word rank after every match on the first word
+                entries.append((text[match.start():], rank if match.start() == 0 else rank + len(self.values)))
+                starts += 1
+            self._max_words = max(self._max_words, starts)
+        entries.sort()
+        self._keys = [key for key, _ in entries]
+        self._ranks = np.array([rank for _, rank in entries], dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def search(self, prefix: str, limit: int = 10) -> List[Dict[str, object]]:
+        """Up to ``limit`` values matching ``prefix``, best first"""
+        prefix = normalize_prefix(prefix)
+        if not prefix:
+            ranks = range(min(limit, len(self.values)))
+        else:
+            start = bisect_left(self._keys, prefix)
+            end = bisect_left(self._keys, prefix + '\U0010ffff', start)
+            if start == end:
+                return []
+            ranks = self._ranks[start:end]
+            # The best ``limit`` values are among the limit * max_words smallest entries
+            keep = limit * self._max_words
+            if keep < len(ranks):
+                ranks = np.partition(ranks, keep - 1)[:keep]
+            ordered = np.sort(ranks) % len(self.values)
+            # A value can match on several words; keep its best (first) occurrence
+            _, first = np.unique(ordered, return_index=True)
+            ranks = ordered[np.sort(first)[:limit]].tolist()
+        return [{'value': self.values[rank], 'count': self.counts[rank]} for rank in ranks]
@@ -0,0 +1,73 @@
+from typing import List, Tuple
+
+import numpy as np
+
+from .catalog import CourseCatalog
+from .diversity import group_occurrence
+
+
+# Metadata describing the university rather than one of its courses
+UNIVERSITY_KEYS = (
+    'university_id', 'university_name', 'university_slug', 'location', 'country', 'global_rank',
+    'university_type', 'currency', 'is_partner', 'university_views', 'university_quality',
+    'country_popularity',
+)
+
+COURSE_KEYS = (
+    'course_id', 'course_name', 'course_program_label', 'program_level', 'program_type', 'credential',
+    'parent_course', 'tuition_usd', 'tuition_local', 'is_published', 'scholarship_count',
+    'is_gre_required', 'tuition_affordability',
+)
+
+
+class UniversityIndex:
+    """Row -> university mapping, built once per catalog.
+
+    Every row gets a dense university code (rows without a ``university_id``
+    each get their own), so grouping candidates is a gather plus a sort over
+    the candidates alone, never a scan of the catalog.
+    """
+
+    def __init__(self, catalog: CourseCatalog):
+        column = catalog.column('university_id')
+        ids = column.values.astype(np.float64)
+        if column.is_string:
+            ids[column.values < 0] = np.nan
+        missing = np.isnan(ids)
+        _, known = np.unique(ids[~missing], return_inverse=True)
+
+        self.codes = np.empty(len(ids), dtype=np.int32)
+        self.codes[~missing] = known
+        self.codes[missing] = (known.max() + 1 if len(known) else 0) + np.arange(int(missing.sum()))
+        self.course_counts = np.bincount(self.codes).astype(np.int32) if len(ids) else np.empty(0, dtype=np.int32)
+
+    def __len__(self) -> int:
+        return len(self.course_counts)
+
+    def group(self, row_ids: np.ndarray, ranking: np.ndarray, limit: int,
+              per_university: int) -> List[Tuple[int, np.ndarray, int]]:
+        """Collapse ranked candidates into their ``limit`` best universities.
+
+        ``ranking`` orders the candidates (indices into ``row_ids``), best first.
+        Returns (university code, its best ``per_university`` candidates, how
+        many candidates it had) per university, best university first.
+        """
+        ranked_codes = self.codes[row_ids[ranking]]
+        occurrence = group_occurrence(ranked_codes)
+        leaders = ranked_codes[occurrence == 0][:limit]
+        if not len(leaders):
+            return []
+
+        # Slot of each candidate's university among the leaders (-1: not among them)
+        sorter = np.argsort(leaders)
+        positions = np.minimum(np.searchsorted(leaders, ranked_codes, sorter=sorter), len(leaders) - 1)
+        slots = np.where(leaders[sorter[positions]] == ranked_codes, sorter[positions], -1)
+
+        matched = np.bincount(slots[slots >= 0], minlength=len(leaders))
+        chosen = (slots >= 0) & (occurrence < max(per_university, 1))
+        members = ranking[chosen][np.argsort(slots[chosen], kind='stable')]
+        sizes = np.bincount(slots[chosen], minlength=len(leaders))
+        return [
+            (int(code), courses, int(count))
+            for code, courses, count in zip(leaders, np.split(members, np.cumsum(sizes)[:-1]), matched)
+        ]
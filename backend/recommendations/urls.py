@@ -4,6 +4,9 @@ from . import views
 urlpatterns = [
     path('health/', views.health_check, name='health_check'),
     path('recommendations/', views.get_recommendations, name='get_recommendations'),
+    path('recommendations/async/', views.get_recommendations_async, name='get_recommendations_async'),
+    path('recommendations/batch/', views.get_batch_recommendations, name='get_batch_recommendations'),
     path('available-options/', views.get_available_options, name='get_available_options'),
+    path('typeahead/<str:field>/', views.typeahead, name='typeahead'),
     path('user-submissions/', views.get_user_submissions, name='get_user_submissions'),
 ] 
\ No newline at end of file
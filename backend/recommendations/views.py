@@ -1,31 +1,51 @@
+from asgiref.sync import sync_to_async
 from rest_framework.decorators import api_view, permission_classes
+from rest_framework.exceptions import APIException
 from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.request import Request
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from rest_framework import status
-from django.http import JsonResponse
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 import json
 import time
 import os
 import logging
 from .models import UserSubmission
-from .serializers import (
-    AvailableOptionsSerializer, UserSubmissionCreateSerializer
-)
-from .langchain_service_fast import UniversityRecommendationService
+from .serializers import UserSubmissionCreateSerializer
+from .service_loader import service_loader
+from .typeahead import TYPEAHEAD_FIELDS, TYPEAHEAD_MAX_LIMIT
 from django.contrib.auth.models import AnonymousUser
 
 logger = logging.getLogger(__name__)
 
 
 def get_recommendation_service():
-    """Get or create the recommendation service instance"""
-    if not hasattr(get_recommendation_service, '_service'):
-        try:
-            get_recommendation_service._service = UniversityRecommendationService()
-        except Exception as e:
-            logger.error(f"Error initializing recommendation service: {e}")
-            get_recommendation_service._service = None
-    return get_recommendation_service._service
+    """The recommendation service, or None while it is loading (never blocks)"""
+    return service_loader.get()
+
+
+def service_unavailable(response_class=Response):
+    """503 for a request that needs the service before it is ready"""
+    initialization = service_loader.status()
+    retry_after = service_loader.retry_after()
+    if initialization['state'] == 'failed':
+        body = {
+            'error': 'System failed to initialize',
+            'message': 'Loading the recommendation index failed and will be retried automatically.',
+        }
+    else:
+        body = {
+            'error': 'System is still initializing',
+            'message': 'Please wait a few minutes for the system to finish setting up. This happens on first startup.',
+        }
+    body.update(retry_after=retry_after, initialization=initialization)
+    response = response_class(body, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    response['Retry-After'] = str(retry_after)
+    return response
 
 
 @api_view(['GET'])
@@ -37,23 +57,24 @@ def health_check(request):
         
         # Check if service is available
         if service is None:
-            return Response({
-                'status': 'initializing',
+            initialization = service_loader.status()
+            response = Response({
+                'status': 'failed' if initialization['state'] == 'failed' else 'initializing',
                 'message': 'System is initializing. Please wait a few minutes for first-time setup.',
                 'cache_status': 'building',
-                'ready': False
+                'ready': False,
+                'initialization': initialization
             }, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+            response['Retry-After'] = str(service_loader.retry_after())
+            return response
         
         # Check if cache exists
         cache_path = os.path.join(os.path.dirname(__file__), '..', 'vector_store_cache')
         cache_exists = os.path.exists(cache_path)
         
         # Test basic functionality
-        try:
-            test_options = service.get_available_programs()
-            service_ready = len(test_options) > 0
-        except Exception as e:
-            service_ready = False
+        programs_count = service.facets.sizes()['programs'] if service.facets else 0
+        service_ready = programs_count > 0
         
         return Response({
             'status': 'operational' if service_ready else 'initializing',
@@ -61,7 +82,11 @@ def health_check(request):
             'cache_status': 'ready' if cache_exists else 'building',
             'ready': service_ready,
             'cache_exists': cache_exists,
-            'programs_count': len(test_options) if service_ready else 0
+            'programs_count': programs_count,
+            'query_embedding_cache': service.query_cache.stats(),
+            'recommendation_cache': service.result_cache.stats() if service.result_cache else None,
+            'request_coalescing': service.single_flight.stats() if service.single_flight else None,
+            'initialization': service_loader.status()
         })
         
     except Exception as e:
@@ -74,6 +99,117 @@ def health_check(request):
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+def transform_recommendation(rec):
+    """Shape a service recommendation the way the frontend expects it"""
+    return {
+        'university_name': rec.get('university_name', ''),
+        'program_name': rec.get('course_name') or rec.get('parent_course') or rec.get('course_program_label', ''),
+        'country': rec.get('country', ''),
+        'tuition_fee_usd': rec.get('tuition_usd'),
+        'global_rank': rec.get('global_rank'),
+        'match_percentage': rec.get('match_percentage', 0),
+        'reasoning': rec.get('llm_reasoning', ''),
+        'location': rec.get('location', ''),
+        'program_duration': rec.get('credential', ''),
+        'application_deadline': None,  # Not available in current dataset
+        'language_requirements': None,  # Not available in current dataset
+        # Include additional fields for future use
+        'university_id': rec.get('university_id'),
+        'course_id': rec.get('course_id'),
+        'university_slug': rec.get('university_slug'),
+        'course_program_label': rec.get('course_program_label'),
+        'program_level': rec.get('program_level'),
+        'program_type': rec.get('program_type'),
+        'parent_course': rec.get('parent_course'),
+        'tuition_local': rec.get('tuition_local'),
+        'university_type': rec.get('university_type'),
+        'currency': rec.get('currency'),
+        'is_partner': rec.get('is_partner'),
+        'is_published': rec.get('is_published'),
+        'university_views': rec.get('university_views'),
+        'scholarship_count': rec.get('scholarship_count'),
+        'is_gre_required': rec.get('is_gre_required'),
+        'tuition_affordability': rec.get('tuition_affordability'),
+        'university_quality': rec.get('university_quality'),
+        'country_popularity': rec.get('country_popularity'),
+        'similarity_score': rec.get('similarity_score'),
+        'relevance_score': rec.get('relevance_score')
+    }
+
+
+def transform_university_recommendation(rec):
+    """Shape a grouped (per university) recommendation; course entries carry course fields only"""
+    return {
+        'university_id': rec.get('university_id'),
+        'university_name': rec.get('university_name', ''),
+        'university_slug': rec.get('university_slug'),
+        'country': rec.get('country', ''),
+        'location': rec.get('location', ''),
+        'global_rank': rec.get('global_rank'),
+        'university_type': rec.get('university_type'),
+        'currency': rec.get('currency'),
+        'is_partner': rec.get('is_partner'),
+        'university_views': rec.get('university_views'),
+        'university_quality': rec.get('university_quality'),
+        'country_popularity': rec.get('country_popularity'),
+        'match_percentage': rec.get('match_percentage', 0),
+        'relevance_score': rec.get('relevance_score'),
+        'reasoning': rec.get('llm_reasoning', ''),
+        'total_courses': rec.get('total_courses'),
+        'matching_courses': rec.get('matching_courses'),
+        'courses': [
+            {
+                'course_id': course.get('course_id'),
+                'program_name': course.get('course_name') or course.get('parent_course') or course.get('course_program_label', ''),
+                'course_program_label': course.get('course_program_label'),
+                'program_level': course.get('program_level'),
+                'program_type': course.get('program_type'),
+                'parent_course': course.get('parent_course'),
+                'program_duration': course.get('credential', ''),
+                'tuition_fee_usd': course.get('tuition_usd'),
+                'tuition_local': course.get('tuition_local'),
+                'scholarship_count': course.get('scholarship_count'),
+                'is_gre_required': course.get('is_gre_required'),
+                'tuition_affordability': course.get('tuition_affordability'),
+                'match_percentage': course.get('match_percentage', 0),
+                'similarity_score': course.get('similarity_score'),
+                'relevance_score': course.get('relevance_score'),
+            }
+            for course in rec.get('courses', [])
+        ],
+    }
+
+
+def grouping_options(data):
+    """(group_by, courses_per_university) of a recommendations request; ValueError if invalid"""
+    group_by = data.get('group_by') or 'course'
+    if group_by not in ('course', 'university'):
+        raise ValueError("group_by must be 'course' or 'university'")
+    try:
+        courses_per_university = min(max(int(data.get('courses_per_university', 3)), 1), 10)
+    except (TypeError, ValueError):
+        raise ValueError('courses_per_university must be an integer')
+    return group_by, courses_per_university
+
+
+def submission_data(data):
+    """The UserSubmission fields of a recommendations request"""
+    return {
+        'desired_program': data.get('desired_program', ''),
+        'program_level': data.get('program_level', ''),
+        'program_type': data.get('program_type', ''),
+        'preferred_countries': data.get('preferred_countries', []),
+        'preferred_locations': data.get('preferred_locations', []),
+        'max_tuition_usd': data.get('max_tuition_usd'),
+        'preferred_currency': data.get('preferred_currency', 'USD'),
+        'min_global_rank': data.get('min_global_rank'),
+        'university_types': data.get('university_types', []),
+        'gpa': data.get('gpa'),
+        'test_scores': data.get('test_scores', {}),
+        'additional_preferences': data.get('additional_preferences', '')
+    }
+
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def get_recommendations(request):
@@ -84,33 +220,19 @@ def get_recommendations(request):
         # Check if service is ready
         service = get_recommendation_service()
         if service is None:
-            return Response({
-                'error': 'System is still initializing',
-                'message': 'Please wait a few minutes for the system to finish setting up. This happens on first startup.',
-                'retry_after': 60  # Suggest retry after 1 minute
-            }, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+            return service_unavailable()
         
         # Extract user preferences from request
         data = request.data
         
-        # Create user submission record
-        submission_data = {
-            'desired_program': data.get('desired_program', ''),
-            'program_level': data.get('program_level', ''),
-            'program_type': data.get('program_type', ''),
-            'preferred_countries': data.get('preferred_countries', []),
-            'preferred_locations': data.get('preferred_locations', []),
-            'max_tuition_usd': data.get('max_tuition_usd'),
-            'preferred_currency': data.get('preferred_currency', 'USD'),
-            'min_global_rank': data.get('min_global_rank'),
-            'university_types': data.get('university_types', []),
-            'gpa': data.get('gpa'),
-            'test_scores': data.get('test_scores', {}),
-            'additional_preferences': data.get('additional_preferences', '')
-        }
+        # Rank courses (default) or universities with their best courses nested
+        try:
+            group_by, courses_per_university = grouping_options(data)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         
         # Create submission serializer
-        submission_serializer = UserSubmissionCreateSerializer(data=submission_data)
+        submission_serializer = UserSubmissionCreateSerializer(data=submission_data(data))
         if submission_serializer.is_valid():
             # Save the submission with user
             submission = submission_serializer.save(user=request.user)
@@ -118,46 +240,15 @@ def get_recommendations(request):
             logger.warning(f"Submission validation errors: {submission_serializer.errors}")
         
         # Get recommendations from service
-        recommendations = service.get_recommendations(data)
+        retrieval = {}
+        recommendations = service.get_recommendations(
+            data, search_stats=retrieval, group_by_university=group_by == 'university',
+            courses_per_university=courses_per_university,
+        )
         
         # Transform recommendations to match frontend expectations
-        transformed_recommendations = []
-        for rec in recommendations:
-            transformed_rec = {
-                'university_name': rec.get('university_name', ''),
-                'program_name': rec.get('course_name') or rec.get('parent_course') or rec.get('course_program_label', ''),
-                'country': rec.get('country', ''),
-                'tuition_fee_usd': rec.get('tuition_usd'),
-                'global_rank': rec.get('global_rank'),
-                'match_percentage': rec.get('match_percentage', 0),
-                'reasoning': rec.get('llm_reasoning', ''),
-                'location': rec.get('location', ''),
-                'program_duration': rec.get('credential', ''),
-                'application_deadline': None,  # Not available in current dataset
-                'language_requirements': None,  # Not available in current dataset
-                # Include additional fields for future use
-                'university_id': rec.get('university_id'),
-                'course_id': rec.get('course_id'),
-                'university_slug': rec.get('university_slug'),
-                'course_program_label': rec.get('course_program_label'),
-                'program_level': rec.get('program_level'),
-                'program_type': rec.get('program_type'),
-                'parent_course': rec.get('parent_course'),
-                'tuition_local': rec.get('tuition_local'),
-                'university_type': rec.get('university_type'),
-                'currency': rec.get('currency'),
-                'is_partner': rec.get('is_partner'),
-                'is_published': rec.get('is_published'),
-                'university_views': rec.get('university_views'),
-                'scholarship_count': rec.get('scholarship_count'),
-                'is_gre_required': rec.get('is_gre_required'),
-                'tuition_affordability': rec.get('tuition_affordability'),
-                'university_quality': rec.get('university_quality'),
-                'country_popularity': rec.get('country_popularity'),
-                'similarity_score': rec.get('similarity_score'),
-                'relevance_score': rec.get('relevance_score')
-            }
-            transformed_recommendations.append(transformed_rec)
+        transform = transform_university_recommendation if group_by == 'university' else transform_recommendation
+        transformed_recommendations = [transform(rec) for rec in recommendations]
         
         # Calculate search duration
         search_duration = int((time.time() - start_time) * 1000)  # Convert to milliseconds
@@ -174,6 +265,8 @@ def get_recommendations(request):
         return Response({
             'recommendations': transformed_recommendations,
             'search_duration_ms': search_duration,
+            'group_by': group_by,
+            'retrieval': retrieval,
             'submission_id': submission.id if 'submission' in locals() else None
         })
         
@@ -185,6 +278,132 @@ def get_recommendations(request):
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+def _authenticate_and_parse(request):
+    """DRF authentication and body parsing for a plain Django view (both may query the database)"""
+    drf_request = Request(
+        request,
+        parsers=[parser() for parser in api_settings.DEFAULT_PARSER_CLASSES],
+        authenticators=[authenticator() for authenticator in api_settings.DEFAULT_AUTHENTICATION_CLASSES],
+    )
+    return drf_request.user, drf_request.data
+
+
+@csrf_exempt
+@require_POST
+async def get_recommendations_async(request):
+    """Async variant of get_recommendations for ASGI deployments.
+    
+    Authentication and the submission writes go through the async ORM (or a
+    thread for DRF's synchronous authenticators), the query embedding is
+    awaited and search and scoring run on the service's bounded executor, so
+    a waiting request holds no worker thread.
+    """
+    start_time = time.time()
+    
+    try:
+        try:
+            user, data = await sync_to_async(_authenticate_and_parse)(request)
+        except APIException as e:
+            return JsonResponse({'detail': e.detail}, status=e.status_code)
+        if not user or not user.is_authenticated:
+            return JsonResponse({'detail': 'Authentication credentials were not provided.'},
+                                status=status.HTTP_401_UNAUTHORIZED)
+        
+        service = get_recommendation_service()
+        if service is None:
+            return service_unavailable(JsonResponse)
+        
+        try:
+            group_by, courses_per_university = grouping_options(data)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        submission = None
+        submission_serializer = UserSubmissionCreateSerializer(data=submission_data(data))
+        if submission_serializer.is_valid():
+            submission = await UserSubmission.objects.acreate(user=user, **submission_serializer.validated_data)
+        else:
+            logger.warning(f"Submission validation errors: {submission_serializer.errors}")
+        
+        retrieval = {}
+        recommendations = await service.aget_recommendations(
+            data, search_stats=retrieval, group_by_university=group_by == 'university',
+            courses_per_university=courses_per_university,
+        )
+        transform = transform_university_recommendation if group_by == 'university' else transform_recommendation
+        transformed_recommendations = [transform(rec) for rec in recommendations]
+        search_duration = int((time.time() - start_time) * 1000)
+        
+        if submission is not None:
+            submission.recommendations_count = len(transformed_recommendations)
+            submission.search_results = transformed_recommendations
+            submission.search_duration_ms = search_duration
+            submission.ip_address = get_client_ip(request)
+            submission.user_agent = request.META.get('HTTP_USER_AGENT', '')
+            await submission.asave()
+        
+        return JsonResponse({
+            'recommendations': transformed_recommendations,
+            'search_duration_ms': search_duration,
+            'group_by': group_by,
+            'retrieval': retrieval,
+            'submission_id': submission.id if submission is not None else None
+        })
+        
+    except Exception as e:
+        logger.error(f"Error in get_recommendations_async: {str(e)}")
+        return JsonResponse({
+            'error': 'Failed to get recommendations',
+            'details': str(e)
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def get_batch_recommendations(request):
+    """Get recommendations for a list of preference sets in one request"""
+    try:
+        service = get_recommendation_service()
+        if service is None:
+            return service_unavailable()
+        
+        items = request.data.get('items')
+        if not isinstance(items, list) or not items:
+            return Response({'error': 'items must be a non-empty list of preference sets'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > settings.RECOMMENDATION_BATCH_MAX_ITEMS:
+            return Response({'error': f'At most {settings.RECOMMENDATION_BATCH_MAX_ITEMS} items per batch'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        try:
+            top_k = int(request.data.get('top_k', 10))
+        except (TypeError, ValueError):
+            return Response({'error': 'top_k must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        top_k = min(max(top_k, 1), 50)
+        
+        batch = service.get_batch_recommendations(items, top_k=top_k)
+        results = []
+        for result in batch['results']:
+            if 'error' in result:
+                results.append({'error': result['error']})
+            else:
+                results.append({
+                    'recommendations': [transform_recommendation(rec) for rec in result['recommendations']],
+                    'retrieval': result['retrieval'],
+                })
+        
+        return Response({
+            'results': results,
+            'timings_ms': batch['timings'],
+        })
+        
+    except Exception as e:
+        logger.error(f"Error in get_batch_recommendations: {str(e)}")
+        return Response({
+            'error': 'Failed to get recommendations',
+            'details': str(e)
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
 def get_client_ip(request):
     """Get client IP address"""
     x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
@@ -204,21 +423,16 @@ def get_available_options(request):
         
         # Check if service is ready
         if service is None:
-            return Response({
-                'error': 'System is still initializing',
-                'message': 'Please wait a few minutes for the system to finish setting up.',
-                'retry_after': 60
-            }, status=status.HTTP_503_SERVICE_UNAVAILABLE)
-        
-        options = {
-            'programs': service.get_available_programs(),
-            'countries': service.get_available_countries(),
-            'previous_degrees': service.get_available_previous_degrees(),
-            'previous_courses': service.get_available_previous_courses()
-        }
+            return service_unavailable()
         
-        serializer = AvailableOptionsSerializer(options)
-        return Response(serializer.data)
+        # The body was serialized when the facets were computed
+        facets = service.facets
+        if facets.etag in request.headers.get('If-None-Match', ''):
+            response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = HttpResponse(facets.options_body, content_type='application/json')
+        response['ETag'] = facets.etag
+        return response
         
     except Exception as e:
         logger.error(f"Error in get_available_options: {str(e)}")
@@ -228,6 +442,42 @@ def get_available_options(request):
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def typeahead(request, field):
+    """Prefix search over programs, countries or locations for autocomplete"""
+    if field not in TYPEAHEAD_FIELDS:
+        return Response({
+            'error': f"Unknown field '{field}'",
+            'fields': sorted(TYPEAHEAD_FIELDS)
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    try:
+        limit = int(request.query_params.get('limit', 10))
+    except ValueError:
+        return Response({'error': 'limit must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+    limit = max(1, min(limit, TYPEAHEAD_MAX_LIMIT))
+    prefix = request.query_params.get('prefix', '')
+    
+    try:
+        service = get_recommendation_service()
+        if service is None:
+            return service_unavailable()
+        
+        return Response({
+            'field': field,
+            'prefix': prefix,
+            'matches': service.typeahead_matches(field, prefix, limit)
+        })
+        
+    except Exception as e:
+        logger.error(f"Error in typeahead: {str(e)}")
+        return Response({
+            'error': 'Failed to get typeahead matches',
+            'details': str(e)
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_user_submissions(request):
@@ -28,6 +28,12 @@ else:
     print('Superuser already exists')
 " || echo "⚠️ Could not create superuser (this is normal)"
 
-# Start the server
-echo "🌐 Starting Django development server..."
-python manage.py runserver 0.0.0.0:8000 
\ No newline at end of file
+# Start the server: the Django development server, or gunicorn with SERVER=gunicorn
+# (index loaded once before the workers fork, see gunicorn.conf.py)
+if [ "${SERVER:-runserver}" = "gunicorn" ]; then
+    echo "🌐 Starting gunicorn..."
+    exec gunicorn -c gunicorn.conf.py university_recommender.wsgi:application
+else
+    echo "🌐 Starting Django development server..."
+    python manage.py runserver 0.0.0.0:8000
+fi 
\ No newline at end of file
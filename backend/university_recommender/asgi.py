@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'university_recommender.settings')
 
 application = get_asgi_application()
+
+# Load the recommendation service in the background now instead of on the first request
+from recommendations.service_loader import service_loader  # noqa: E402
+
+service_loader.start()
@@ -95,6 +95,28 @@ DATABASES = {
 }
 
 
+# Caches
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# The recommendations cache lives in each worker process by default; point RECOMMENDATION_CACHE_BACKEND /
+# _LOCATION at Redis or memcached to share it between workers and hosts. The file based backend also shares
+# it between the workers of one host, but it lists its whole directory on every write to enforce MAX_ENTRIES,
+# so each cache miss pays a scan of all entries on the request path.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'recommendations': {
+        'BACKEND': os.getenv('RECOMMENDATION_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('RECOMMENDATION_CACHE_LOCATION', 'recommendations'),
+        'TIMEOUT': int(os.getenv('RECOMMENDATION_CACHE_TTL', '3600')),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.getenv('RECOMMENDATION_CACHE_MAX_ENTRIES', '10000')),
+        },
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -165,5 +187,86 @@ CORS_ALLOW_CREDENTIALS = True
 # LangChain settings
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY', '')
 
+# Embedding backend: 'gemini' (remote, needs GEMINI_API_KEY) or 'local' (offline hashed n-gram vectors)
+EMBEDDING_BACKEND = os.getenv('EMBEDDING_BACKEND', 'gemini')
+LOCAL_EMBEDDING_DIMENSION = int(os.getenv('LOCAL_EMBEDDING_DIMENSION', '512'))
+
+# Index build: documents per embedding request, concurrent requests, retries per batch
+INDEX_BUILD_BATCH_SIZE = int(os.getenv('INDEX_BUILD_BATCH_SIZE', '100'))
+INDEX_BUILD_WORKERS = int(os.getenv('INDEX_BUILD_WORKERS', '4'))
+INDEX_BUILD_MAX_RETRIES = int(os.getenv('INDEX_BUILD_MAX_RETRIES', '3'))
+
+# FAISS index type: flat (exact), ivf, hnsw or ivfpq, with their build and search parameters.
+# FAISS_IVF_NLIST=0 picks about 4*sqrt(rows) lists.
+FAISS_INDEX_TYPE = os.getenv('FAISS_INDEX_TYPE', 'flat')
+FAISS_IVF_NLIST = int(os.getenv('FAISS_IVF_NLIST', '0'))
+FAISS_IVF_NPROBE = int(os.getenv('FAISS_IVF_NPROBE', '16'))
+FAISS_HNSW_M = int(os.getenv('FAISS_HNSW_M', '32'))
+FAISS_HNSW_EF_CONSTRUCTION = int(os.getenv('FAISS_HNSW_EF_CONSTRUCTION', '80'))
+FAISS_HNSW_EF_SEARCH = int(os.getenv('FAISS_HNSW_EF_SEARCH', '64'))
+FAISS_PQ_M = int(os.getenv('FAISS_PQ_M', '16'))
+FAISS_PQ_NBITS = int(os.getenv('FAISS_PQ_NBITS', '8'))
+
+# Open the cached index and catalog memory-mapped and read-only so workers on one host share them
+FAISS_MMAP = os.getenv('FAISS_MMAP', 'True').lower() == 'true'
+
+# Query embedding cache: in-process LRU plus a SQLite file shared by all workers (empty path disables it)
+QUERY_EMBEDDING_CACHE_PATH = os.getenv('QUERY_EMBEDDING_CACHE_PATH', os.path.join(BASE_DIR, 'query_embedding_cache.sqlite3'))
+QUERY_EMBEDDING_CACHE_MEMORY_SIZE = int(os.getenv('QUERY_EMBEDDING_CACHE_MEMORY_SIZE', '1024'))
+QUERY_EMBEDDING_CACHE_DISK_SIZE = int(os.getenv('QUERY_EMBEDDING_CACHE_DISK_SIZE', '100000'))
+
+# Answer structured preference sets from label embeddings stored next to the index
+LABEL_EMBEDDINGS_ENABLED = os.getenv('LABEL_EMBEDDINGS_ENABLED', 'True').lower() == 'true'
+
+# Candidates fetched in the first retrieval round; the pool doubles each round, up to the maximum,
+# until top_k candidates reach the target match percentage or the latency budget (per preference set) is spent
+RECOMMENDATION_CANDIDATE_POOL = int(os.getenv('RECOMMENDATION_CANDIDATE_POOL', '50'))
+RECOMMENDATION_MAX_CANDIDATE_POOL = int(os.getenv('RECOMMENDATION_MAX_CANDIDATE_POOL', '3200'))
+RECOMMENDATION_CANDIDATE_GROWTH = int(os.getenv('RECOMMENDATION_CANDIDATE_GROWTH', '2'))
+RECOMMENDATION_TARGET_MATCH = float(os.getenv('RECOMMENDATION_TARGET_MATCH', '70'))
+RECOMMENDATION_SEARCH_BUDGET_MS = float(os.getenv('RECOMMENDATION_SEARCH_BUDGET_MS', '150'))
+
+# Diversify result pages: none, mmr (maximal marginal relevance on the candidate vectors, weighted
+# by RECOMMENDATION_MMR_LAMBDA) or university_cap (at most RECOMMENDATION_MAX_PER_UNIVERSITY per university),
+# applied to the RECOMMENDATION_DIVERSITY_POOL most relevant candidates
+RECOMMENDATION_DIVERSITY = os.getenv('RECOMMENDATION_DIVERSITY', 'none')
+RECOMMENDATION_DIVERSITY_POOL = int(os.getenv('RECOMMENDATION_DIVERSITY_POOL', '200'))
+RECOMMENDATION_MMR_LAMBDA = float(os.getenv('RECOMMENDATION_MMR_LAMBDA', '0.7'))
+RECOMMENDATION_MAX_PER_UNIVERSITY = int(os.getenv('RECOMMENDATION_MAX_PER_UNIVERSITY', '2'))
+
+# Serve repeated preference sets from the 'recommendations' cache (see CACHES), per index version
+RECOMMENDATION_CACHE_ENABLED = os.getenv('RECOMMENDATION_CACHE_ENABLED', 'True').lower() == 'true'
+
+# Concurrent identical recommendation requests wait for one computation instead of repeating it
+RECOMMENDATION_SINGLE_FLIGHT = os.getenv('RECOMMENDATION_SINGLE_FLIGHT', 'True').lower() == 'true'
+
+# Lock file directory that extends this coalescing across worker processes on the host (results are
+# handed over through the 'recommendations' cache, which must then be shared); empty to coalesce per process only
+RECOMMENDATION_LOCK_DIR = os.getenv('RECOMMENDATION_LOCK_DIR', '')
+
+# Threads running the CPU-bound part (search, scoring) of async recommendation requests
+RECOMMENDATION_EXECUTOR_WORKERS = int(os.getenv('RECOMMENDATION_EXECUTOR_WORKERS', str(min(8, os.cpu_count() or 1))))
+
+# Largest number of preference sets accepted by the batch recommendations endpoint
+RECOMMENDATION_BATCH_MAX_ITEMS = int(os.getenv('RECOMMENDATION_BATCH_MAX_ITEMS', '100'))
+
+# The service loads in a background thread when the server starts; failed loads are retried after
+# RECOMMENDATION_INIT_RETRY_DELAY seconds, doubling up to the maximum. Requests arriving before it is
+# ready get a 503 whose Retry-After is RECOMMENDATION_RETRY_AFTER seconds (plus the wait for a retry).
+RECOMMENDATION_INIT_RETRY_DELAY = float(os.getenv('RECOMMENDATION_INIT_RETRY_DELAY', '30'))
+RECOMMENDATION_INIT_MAX_RETRY_DELAY = float(os.getenv('RECOMMENDATION_INIT_MAX_RETRY_DELAY', '600'))
+RECOMMENDATION_RETRY_AFTER = int(os.getenv('RECOMMENDATION_RETRY_AFTER', '10'))
+
+# Load the service while the WSGI application is imported instead of in the background. gunicorn.conf.py
+# turns this on so the index is loaded once in the parent and shared copy-on-write by the forked workers.
+RECOMMENDATION_PRELOAD = os.getenv('RECOMMENDATION_PRELOAD', 'False').lower() == 'true'
+
+# Treat countries, university types, max tuition and min rank as hard filters unless a request says otherwise
+RECOMMENDATION_STRICT_FILTERS = os.getenv('RECOMMENDATION_STRICT_FILTERS', 'False').lower() == 'true'
+
+# Add BM25 matches on course names to the vector candidates, fused by reciprocal rank (constant k)
+LEXICAL_RETRIEVAL_ENABLED = os.getenv('LEXICAL_RETRIEVAL_ENABLED', 'True').lower() == 'true'
+HYBRID_RRF_K = int(os.getenv('HYBRID_RRF_K', '60'))
+
 # University dataset path
 UNIVERSITY_DATASET_PATH = os.path.join(BASE_DIR.parent, 'cleaned_combined_dataset.json')
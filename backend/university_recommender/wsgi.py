@@ -14,3 +14,13 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'university_recommender.settings')
 
 application = get_wsgi_application()
+
+# Load the recommendation service now instead of on the first request: right here when a
+# pre-forking server imports the application in its parent process, in the background otherwise
+from django.conf import settings  # noqa: E402
+from recommendations.service_loader import service_loader  # noqa: E402
+
+if settings.RECOMMENDATION_PRELOAD:
+    service_loader.load()
+else:
+    service_loader.start()